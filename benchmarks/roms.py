@@ -0,0 +1,110 @@
+'''
+Synthetic ROMs for the benchmarks, assembled in memory. Every program starts at 0x200 and loops forever.
+'''
+
+def assemble(*words):
+    return b''.join(word.to_bytes(2, 'big') for word in words)
+
+# 8xyN - every logical/arithmetic operation in a tight loop
+ALU = assemble(
+    0x6001, 0x6103, 0x6207,                 # 0x200: V0 = 1, V1 = 3, V2 = 7
+    0x8014, 0x8125, 0x8216, 0x8307, 0x840E, # 0x206: add, sub, shift right, subn, shift left
+    0x8121, 0x8232, 0x8013, 0x8340,         #        or, and, xor, set
+    0x7001,                                 #        V0 += 1
+    0x1206                                  #        loop
+)
+
+# 3xkk, 4xkk, 5xy0, 9xy0 - taken and not taken skips
+SKIPS = assemble(
+    0x6005, 0x6105,                         # 0x200: V0 = 5, V1 = 5
+    0x3005, 0x6000,                         # 0x204: skip taken
+    0x4005, 0x6200,                         #        skip not taken
+    0x5010, 0x6300,                         #        skip taken
+    0x9010, 0x6400,                         #        skip not taken
+    0x1204                                  #        loop
+)
+
+# Dxyn - font sprites drawn across the screen, wrapping around the edges
+DRAW = assemble(
+    0x00E0, 0xA000,                         # 0x200: clear, I = font 0
+    0xD015, 0x7009, 0xD125, 0x7105,         # 0x204: draw at (V0, V1) and (V1, V2), move
+    0xF029, 0x1204                          #        I = font V0, loop
+)
+
+# Fx55, Fx65 - save and load every register
+LOAD_STORE = assemble(
+    0xA300,                                 # 0x200: I = 0x300
+    0xFF55, 0xFF65, 0x7001,                 # 0x202: save V0-VF, load V0-VF, V0 += 1
+    0x1202                                  #        loop
+)
+
+# Fx33 - binary-coded decimal of a changing value
+BCD = assemble(
+    0xA300,                                 # 0x200: I = 0x300
+    0xF033, 0xF133, 0x7001, 0x7103,         # 0x202: BCD V0, BCD V1, V0 += 1, V1 += 3
+    0x1202                                  #        loop
+)
+
+# 2nnn, 00EE - two levels of nested subroutine calls
+CALLS = assemble(
+    0x6000,                                 # 0x200: V0 = 0
+    0x2210, 0x7001,                         # 0x202: call outer, V0 += 1
+    0x1202,                                 #        loop
+    *[0x0000] * 4,                          # pad to 0x210
+    0x2220, 0x7101,                         # 0x210: outer: call inner, V1 += 1
+    0x00EE,                                 #        return
+    *[0x0000] * 5,                          # pad to 0x220
+    0x7201,                                 # 0x220: inner: V2 += 1
+    0x00EE                                  #        return
+)
+
+# A bouncing ball: subroutine calls, erase/move/redraw, bounds checks and an idle key check
+BOUNCE = assemble(
+    0x00E0, 0x6A00, 0x6B00,                 # 0x200: clear, X = 0, Y = 0
+    0x6C01, 0x6D01,                         # 0x206: dX = 1, dY = 1
+    0xA000, 0xDAB5,                         # 0x20A: I = font 0, draw
+    0x2300,                                 # 0x20E: move
+    0xE09E, 0x6E00,                         # 0x210: skip unless key V0 is down
+    0x120E,                                 # 0x214: loop
+    *[0x0000] * 117,                        # pad to 0x300
+    0xDAB5,                                 # 0x300: erase
+    0x8AC4, 0x8BD4,                         #        X += dX, Y += dY
+    0x4A3B, 0x6CFF, 0x4A00, 0x6C01,         #        bounce off the left and right edges
+    0x4B1B, 0x6DFF, 0x4B00, 0x6D01,         #        bounce off the top and bottom edges
+    0xDAB5,                                 #        draw
+    0x00EE                                  #        return
+)
+
+# A score counter: BCD of the score, three digits drawn from the font, cleared every frame
+SCORE = assemble(
+    0x6500,                                 # 0x200: score = 0
+    0x00E0, 0xA300, 0xF533,                 # 0x202: clear, BCD score into 0x300
+    0xF265,                                 #        V0-V2 = digits
+    0x6320, 0x6410,                         #        position
+    0xF029, 0xD345, 0x7305,                 #        hundreds
+    0xF129, 0xD345, 0x7305,                 #        tens
+    0xF229, 0xD345,                         #        ones
+    0x7501, 0x1202                          #        score += 1, loop
+)
+
+# SUPER-CHIP high resolution: 16x16 sprites (Dxy0) and scrolls in every direction on the 128x64 screen
+HIRES = assemble(
+    0x00FF, 0xA050,                         # 0x200: high resolution, I = large font 0
+    0xD010, 0x7011,                         # 0x204: draw 16x16 at (V0, V1), V0 += 17
+    0x00C1, 0x00FB, 0xD120, 0x00FC,         #        scroll down, right, draw at (V1, V2), scroll left
+    0x7103,                                 #        V1 += 3
+    0x1204                                  #        loop
+)
+
+# (name, program) pairs, each run through the CPU with a null screen
+PROGRAMS = [
+    ('alu',        ALU),
+    ('skips',      SKIPS),
+    ('draw',       DRAW),
+    ('load_store', LOAD_STORE),
+    ('bcd',        BCD),
+    ('calls',      CALLS),
+    ('bounce',     BOUNCE),
+    ('score',      SCORE),
+    ('hires',      HIRES)
+]
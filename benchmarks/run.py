@@ -0,0 +1,335 @@
+'''
+Benchmark suite for the CPU and Screen, compared against a stored baseline.
+
+    python -m benchmarks.run                     # run and compare against benchmarks/baseline.json
+    python -m benchmarks.run --update-baseline   # run and store the results as the new baseline
+
+Each synthetic ROM runs through the CPU with a null screen, once interpreted and once through the
+block compiler, and reports instructions per second. Screen.update and Screen.place_sprite are
+measured on their own, and so is startup: ROMs loaded by create_headless per second.
+
+Results are compared as ratios to a reference measured right next to them, so the baseline holds
+on another machine or under load: the compiled engine against the interpreter on the same ROM, and
+everything else against a fixed pure Python loop (calibration). The suite runs --runs times and the
+median ratio of each benchmark counts. It fails the run when it is further below the baseline than
+that benchmark's tolerance, or for the compiled engine, when it is below the interpreter. Either way
+by more than SPREADS times the spread of the runs, so a run on a noisy host does not fail for it.
+
+    python -m benchmarks.run --runs 15 --update-baseline   # store medians and tolerances from 15 runs
+
+--update-baseline stores each median with a tolerance of SPREADS times the spread of the runs
+around it (at least --threshold), and refuses to store a compiled engine slower than the interpreter.
+'''
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from math import ceil
+from statistics import median
+from time import perf_counter
+
+from chippy8.cpu import CPU
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.headless import create_headless
+from chippy8.scheduler import Scheduler
+from chippy8.screen import NullScreen, Screen, HalfBlockScreen, BrailleScreen
+from chippy8.config import FONT_FILE, PROGRAM_COUNTER_START
+from benchmarks.roms import PROGRAMS
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+CALIBRATION   = 'calibration'
+SPREADS       = 3 # Deviation from the median that still counts as noise, in spreads of the runs around it
+
+class NullOutput:
+    '''
+    Stand-in for stdout that discards everything, so only rendering is measured.
+    '''
+
+    def write(self, _text):
+        pass
+
+    def flush(self):
+        pass
+
+def best_of(repeat, function):
+    '''
+    Fastest of repeat timed calls, in seconds.
+    '''
+    timings = []
+
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+
+    return min(timings)
+
+def reference_of(name):
+    '''
+    The benchmark whose result, from the same run, name is compared against.
+    '''
+    if name.startswith('compiled.'):
+        return 'cpu.' + name[len('compiled.'):]
+
+    return CALIBRATION
+
+def bench_calibration(count, repeat):
+    '''
+    Iterations per second of a fixed loop of integer arithmetic and dict stores, a measure of the host.
+    '''
+    def run():
+        total = 0
+        table = {}
+        for value in range(count):
+            total = (total + value * 7) & 0xFFFF
+            table[value & 0xFF] = total
+
+    return count / best_of(repeat, run)
+
+def bench_program(program, cycles, compiled, repeat):
+    '''
+    Instructions per second running program for cycles instructions, in 60 Hz frames as the emulator does.
+    '''
+    def run():
+        chippy = CPU(NullScreen(), ScriptedKeyboard())
+        chippy.load_rom(FONT_FILE, 0)
+        chippy.memory[PROGRAM_COUNTER_START:PROGRAM_COUNTER_START + len(program)] = program
+        chippy.invalidate()
+
+        if compiled:
+            chippy.enable_compiler()
+
+        Scheduler(chippy, turbo=True).run(cycles)
+
+    return cycles / best_of(repeat, run)
+
+def bench_startup(rounds, repeat):
+    '''
+    ROMs made ready to run per second by create_headless.
+    '''
+    directory = tempfile.mkdtemp()
+    roms      = []
+
+    try:
+        for name, program in PROGRAMS:
+            path = os.path.join(directory, name + '.ch8')
+            with open(path, 'wb') as rom:
+                rom.write(program)
+
+            roms.append(path)
+
+        def run():
+            for _ in range(rounds):
+                for path in roms:
+                    create_headless(path)
+
+        return rounds * len(roms) / best_of(repeat, run)
+    finally:
+        shutil.rmtree(directory)
+
+def random_sprites(count):
+    rng = random.Random(0x8)
+
+    return [
+        (bytes(rng.randrange(0x100) for _ in range(rng.randint(1, 15))), rng.randrange(0x100), rng.randrange(0x100))
+        for _ in range(count)
+    ]
+
+def bench_place_sprite(count, repeat):
+    '''
+    Sprites placed per second.
+    '''
+    sprites = random_sprites(count)
+    screen  = Screen()
+
+    def run():
+        for sprite, x, y in sprites:
+            screen.place_sprite(sprite, x, y)
+
+    return count / best_of(repeat, run)
+
+def bench_update(count, repeat, full, screen_class=Screen):
+    '''
+    Frames rendered per second, with one sprite drawn between frames (or a full redraw every frame).
+    '''
+    sprites = random_sprites(count)
+    screen  = screen_class()
+
+    def run():
+        stdout, sys.stdout = sys.stdout, NullOutput()
+        try:
+            for sprite, x, y in sprites:
+                screen.place_sprite(sprite, x, y)
+                if full:
+                    screen.presented = None
+                screen.update()
+        finally:
+            sys.stdout = stdout
+
+    return count / best_of(repeat, run)
+
+def run_benchmarks(cycles, repeat, only=None):
+    '''
+    Run every benchmark (or those whose name contains only, and their references).
+
+    Returns {name: (value, unit, ratio)}, ratio being value over its reference's. The calibration is
+    measured again after each benchmark compared against it, so both see the same load.
+    '''
+    benchmarks = []
+
+    for name, program in PROGRAMS:
+        benchmarks.append(('cpu.' + name, 'instructions/s', lambda program=program: bench_program(program, cycles, False, repeat)))
+        benchmarks.append(('compiled.' + name, 'instructions/s', lambda program=program: bench_program(program, cycles, True, repeat)))
+
+    benchmarks.append(('screen.place_sprite', 'sprites/s', lambda: bench_place_sprite(cycles // 10, repeat)))
+    benchmarks.append(('screen.update', 'frames/s', lambda: bench_update(cycles // 100, repeat, False)))
+    benchmarks.append(('screen.update_full', 'frames/s', lambda: bench_update(cycles // 1000, repeat, True)))
+
+    for name, screen_class in (('half', HalfBlockScreen), ('braille', BrailleScreen)):
+        benchmarks.append(('screen.update.' + name, 'frames/s',
+                           lambda screen_class=screen_class: bench_update(cycles // 100, repeat, False, screen_class)))
+        benchmarks.append(('screen.update_full.' + name, 'frames/s',
+                           lambda screen_class=screen_class: bench_update(cycles // 1000, repeat, True, screen_class)))
+
+    benchmarks.append(('startup', 'ROMs/s', lambda: bench_startup(cycles // 2000, repeat)))
+
+    selected = {name for name, _unit, _benchmark in benchmarks if not only or only in name}
+    selected |= {reference_of(name) for name in selected} - {CALIBRATION}
+
+    results = {}
+    for name, unit, benchmark in benchmarks:
+        if name not in selected:
+            continue
+
+        value     = benchmark()
+        reference = reference_of(name)
+        reference = bench_calibration(cycles, repeat) if reference == CALIBRATION else results[reference][0]
+
+        results[name] = (value, unit, value / reference)
+
+    return results
+
+def run_repeated(cycles, repeat, runs, only=None):
+    '''
+    Run the benchmarks runs times over.
+
+    Returns {name: (value, unit, ratio, ratios)}, value and ratio being the medians and ratios those of each run.
+    '''
+    measured = {}
+
+    for _ in range(runs):
+        for name, (value, unit, ratio) in run_benchmarks(cycles, repeat, only).items():
+            measured.setdefault(name, (unit, [], []))
+            measured[name][1].append(value)
+            measured[name][2].append(ratio)
+
+    return {name: (median(values), unit, median(ratios), ratios) for name, (unit, values, ratios) in measured.items()}
+
+def spread(ratio, ratios):
+    '''
+    Median deviation of the runs' ratios from the median ratio, as a fraction of it.
+
+    A few runs disturbed by the host do not move it, as they would the largest deviation.
+    '''
+    return median(abs(run / ratio - 1) for run in ratios)
+
+def allowed(ratio, ratios, expected):
+    '''
+    How far below its {ratio, tolerance} baseline entry a median ratio may be, as a fraction: the
+    tolerance, or more when the runs spread further than they did for the baseline.
+    '''
+    return max(expected['tolerance'], SPREADS * spread(ratio, ratios))
+
+def check(name, ratio, ratios, expected):
+    '''
+    Why a median ratio fails against its baseline entry, None if it passes.
+    '''
+    if ratio < expected['ratio'] * (1 - allowed(ratio, ratios, expected)):
+        return 'REGRESSION'
+    if name.startswith('compiled.') and ratio * (1 + SPREADS * spread(ratio, ratios)) < 1:
+        return 'SLOWER THAN INTERPRETER'
+
+    return None
+
+def compare(results, baseline, threshold):
+    '''
+    Print the results and their ratios next to the baseline, returns the names that failed their check.
+
+    Benchmarks the baseline has no tolerance for get threshold.
+    '''
+    failures = []
+
+    print('{:<28} {:>12}  {:<16} {:<14} {:>9} {:>7} {:>9} {:>9} {:>8}'.format(
+        'benchmark', 'result', 'unit', 'against', 'ratio', 'spread', 'baseline', 'allowed', 'change'
+    ))
+    for name, (value, unit, ratio, ratios) in results.items():
+        line = '{:<28} {:>12,.0f}  {:<16} {:<14} {:>9.4g} {:>7.1%}'.format(
+            name, value, unit, reference_of(name), ratio, spread(ratio, ratios)
+        )
+
+        if name not in baseline:
+            print('{} {:>9} {:>9} {:>8}'.format(line, '-', '-', '-'))
+            continue
+
+        expected = dict({'tolerance': threshold}, **baseline[name])
+        change   = ratio / expected['ratio'] - 1
+        status   = check(name, ratio, ratios, expected)
+        if status:
+            failures.append(name)
+
+        print('{} {:>9.4g} {:>9.1%} {:>+7.1%}{}'.format(
+            line, expected['ratio'], -allowed(ratio, ratios, expected), change, '  ' + status if status else ''
+        ))
+
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ChipPy8 benchmarks.')
+    parser.add_argument('--cycles', metavar='N', type=int, default=200000, help='instructions per CPU benchmark')
+    parser.add_argument('--repeat', metavar='N', type=int, default=3, help='timed runs per benchmark, the best counts')
+    parser.add_argument('--runs', metavar='N', type=int, default=5, help='runs of the whole suite, the median counts (default 5)')
+    parser.add_argument('--threshold', metavar='F', type=float, default=0.25,
+                        help='smallest tolerance --update-baseline stores, and the one for benchmarks without (default 0.25)')
+    parser.add_argument('--only', metavar='NAME', default=None, help='only run benchmarks whose name contains NAME')
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE_FILE, help='baseline file')
+    parser.add_argument('--update-baseline', action='store_true', help='store the medians and their tolerances as the new baseline')
+    args = parser.parse_args(argv)
+
+    results = run_repeated(args.cycles, args.repeat, args.runs, args.only)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    failures = compare(results, baseline, args.threshold)
+
+    if args.update_baseline:
+        slower = [name for name, (_value, _unit, ratio, _ratios) in results.items() if name.startswith('compiled.') and ratio < 1]
+        if slower:
+            print('\nNot storing a compiled engine slower than the interpreter: {}'.format(', '.join(slower)))
+            return 1
+
+        baseline.update({
+            name: {
+                'ratio':     float('{:.4g}'.format(ratio)),
+                'tolerance': ceil(max(args.threshold, SPREADS * spread(ratio, ratios)) * 100) / 100
+            }
+            for name, (_value, _unit, ratio, ratios) in results.items()
+        })
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        return 0
+
+    if failures:
+        print('\n{} benchmark(s) failed over the median of {} runs: {}'.format(len(failures), args.runs, ', '.join(failures)))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
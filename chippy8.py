@@ -1,31 +1,203 @@
 import argparse
+import asyncio
+import random
 from os.path import exists
 
 from chippy8.cpu import CPU as ChipPy8
-from chippy8.screen import Screen
-from chippy8.config import FONT_FILE
+from chippy8.screen import NullScreen, RENDERERS
+from chippy8.presenter import Presenter
+from chippy8.scheduler import Scheduler
+from chippy8.keyboard import ScriptedKeyboard, save_script
+from chippy8.profiler import Profiler, REPORT_FORMATS
+from chippy8.rewind import RewindBuffer
+from chippy8.trace import Tracer
+from chippy8.headless import create_headless, run_headless
+from chippy8.aio import AsyncKeyboard, Session
+from chippy8.stream import FrameServer
+from chippy8.config import FONT_FILE, INSTRUCTIONS_PER_FRAME
 
 
 parser = argparse.ArgumentParser(description='A Python CHIP-8 Emulator.')
 parser.add_argument('filepath', metavar='F', type=str, help='path to the CHIP-8 ROM')
+parser.add_argument('--headless', action='store_true', help='run without a display or keyboard')
+parser.add_argument('--max-cycles', metavar='N', type=int, default=None,
+                    help='stop after N instructions, counted from the save state with --load-state')
+parser.add_argument('--dump-frame', action='store_true', help='print the final frame as text when stopping')
+parser.add_argument('--input', metavar='SCRIPT', type=str, default=None,
+                    help='key presses for headless runs, one "<cycle> <key> <down|up>" event per line')
+parser.add_argument('--ipf', metavar='N', type=int, default=None,
+                    help='instructions per 60 Hz frame (default {})'.format(INSTRUCTIONS_PER_FRAME))
+parser.add_argument('--turbo', action='store_true', help='run as fast as possible, timers still follow emulated frames')
+parser.add_argument('--compile', action='store_true', help='execute through the block compiler')
+parser.add_argument('--async', dest='use_async', action='store_true', help='run on an asyncio event loop (chippy8.aio)')
+parser.add_argument('--serve', metavar='PORT', type=int, default=None,
+                    help='stream the frames to viewers on local TCP PORT and take their keys, instead of the terminal')
+parser.add_argument('--render', choices=sorted(RENDERERS), default='blocks',
+                    help='terminal rendering: a block per pixel, half blocks (2 pixels per cell) or braille (8 pixels per cell)')
+parser.add_argument('--seed', metavar='N', type=int, default=None, help='seed the random number generator (Cxkk)')
+parser.add_argument('--record', metavar='FILE', type=str, default=None,
+                    help='record the key presses, seed and cycle count to FILE for --replay')
+parser.add_argument('--replay', metavar='FILE', type=str, default=None,
+                    help='replay a recording headless at full speed, same as --headless --input FILE')
+parser.add_argument('--rewind', action='store_true', help='keep a history of frames, hold backspace to run backwards')
+parser.add_argument('--load-state', metavar='FILE', type=str, default=None, help='start from a save state')
+parser.add_argument('--save-state', metavar='FILE', type=str, default=None, help='write a save state when stopping')
+parser.add_argument('--profile', metavar='FILE', type=str, default=None,
+                    help='profile the run (through the interpreter) and write the statistics to FILE')
+parser.add_argument('--profile-format', choices=REPORT_FORMATS, default='json', help='profile format (default json)')
+parser.add_argument('--trace', metavar='FILE', type=str, default=None,
+                    help='record every instruction executed to FILE (through the interpreter), see chippy8.trace')
+parser.add_argument('--trace-compress', action='store_true', help='compress the trace with zlib')
 args = parser.parse_args()
 
-def run():
+if args.record and args.rewind:
+    parser.error('--record cannot be combined with --rewind, a rewound run cannot be replayed')
+if args.trace and (args.rewind or args.profile):
+    parser.error('--trace cannot be combined with --rewind or --profile')
+
+if args.replay:
+    args.headless = True
+    args.input    = args.replay
+
+def run(profiler=None):
     chippy.screen.load_emulator_window()
 
-    while True:
-        chippy.delay()
-        chippy.execute_instruction()
-        chippy.decrement_timers()
+    # Drawing only touches the pixel buffer, the terminal is written from the presenter thread
+    presenter = Presenter(chippy.screen)
+    presenter.start()
 
-if __name__ == '__main__':
-    screen = Screen()
-    chippy = ChipPy8(screen)
+    rewind    = RewindBuffer(chippy) if args.rewind else None
+    scheduler = Scheduler(chippy, args.ipf, turbo=args.turbo, rewind=rewind)
+
+    if profiler is not None:
+        profiler.scheduler = scheduler
+        profiler.enable()
+
+    try:
+        scheduler.run(args.max_cycles)
+    finally:
+        presenter.stop()
+
+async def run_async(profiler=None):
+    rewind  = RewindBuffer(chippy) if args.rewind else None
+    session = Session(chippy, args.ipf, turbo=args.turbo, rewind=rewind)
+    server  = None
+
+    if args.serve is not None:
+        # Frames go out to the viewers and their keys come back, the terminal is left alone
+        server = FrameServer(session, port=args.serve)
+        await server.start()
+    else:
+        chippy.screen.load_emulator_window()
+        chippy.keyboard.listen()
 
-    chippy.load_rom(FONT_FILE, 0)
+    if profiler is not None:
+        profiler.scheduler = session.scheduler
+        profiler.enable()
 
+    try:
+        await session.run(args.max_cycles)
+    finally:
+        if server is not None:
+            await server.stop()
+
+def load_state():
+    '''
+    Resume from the save state, --max-cycles counts from the cycle it was saved at.
+    '''
+    with open(args.load_state, 'rb') as state:
+        chippy.load_state(state.read())
+
+    if args.max_cycles is not None:
+        args.max_cycles += chippy.cycles
+
+if __name__ == '__main__':
     if exists(args.filepath):
-        chippy.load_rom(args.filepath)
-        run()
+        if args.headless:
+            keyboard = ScriptedKeyboard.load(args.input) if args.input else ScriptedKeyboard()
+
+            # Recordings carry the settings they were made with, flags given explicitly still win
+            for name in ('seed', 'ipf'):
+                if getattr(args, name) is None:
+                    setattr(args, name, keyboard.settings.get(name))
+            if args.max_cycles is None:
+                args.max_cycles = keyboard.settings.get('cycles')
+
+            args.ipf = args.ipf or INSTRUCTIONS_PER_FRAME
+            chippy   = create_headless(args.filepath, keyboard, args.seed)
+
+            if args.load_state:
+                load_state()
+
+            if args.compile:
+                chippy.enable_compiler()
+
+            profiler = Profiler(chippy) if args.profile else None
+            if profiler is not None:
+                profiler.enable()
+
+            tracer = Tracer(chippy, args.trace, args.trace_compress) if args.trace else None
+            if tracer is not None:
+                tracer.enable()
+
+            try:
+                run_headless(chippy, args.max_cycles, args.ipf)
+            finally:
+                # A ROM failing is what a trace is usually for, keep the records leading up to it
+                if tracer is not None:
+                    tracer.close()
+        else:
+            if args.record and args.seed is None:
+                args.seed = random.randrange(1 << 32)
+
+            args.ipf  = args.ipf or INSTRUCTIONS_PER_FRAME
+            use_async = args.use_async or args.serve is not None
+            screen    = NullScreen() if args.serve is not None else RENDERERS[args.render]()
+            keyboard  = AsyncKeyboard() if use_async else None
+            chippy    = ChipPy8(screen, keyboard, seed=args.seed)
+
+            chippy.load_rom(FONT_FILE, 0)
+            chippy.load_rom(args.filepath)
+
+            if args.load_state:
+                load_state()
+
+            if args.compile:
+                chippy.enable_compiler()
+
+            first_cycle = chippy.cycles
+            profiler    = Profiler(chippy) if args.profile else None
+            tracer   = Tracer(chippy, args.trace, args.trace_compress) if args.trace else None
+            if tracer is not None:
+                tracer.enable()
+
+            try:
+                if use_async:
+                    asyncio.run(run_async(profiler))
+                else:
+                    run(profiler)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                # As headless, an error still leaves a complete trace behind
+                if tracer is not None:
+                    tracer.close()
+
+            if args.record:
+                # The key events carry the cycle they happened at, the cycle count is the length of the run
+                settings = {'seed': args.seed, 'ipf': args.ipf, 'cycles': chippy.cycles - first_cycle}
+                save_script(args.record, chippy.keyboard.recording, settings)
+
+        if args.dump_frame:
+            print(chippy.screen.dump())
+
+        if args.save_state:
+            with open(args.save_state, 'wb') as state:
+                state.write(chippy.save_state())
+
+        if profiler is not None:
+            profiler.disable()
+            with open(args.profile, 'w') as output:
+                profiler.write(output, args.profile_format)
     else:
         print("Couldn't load ROM at {}! Check your file path and try again.".format(args.filepath))
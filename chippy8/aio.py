@@ -0,0 +1,223 @@
+'''
+Emulator core for asyncio event loops, so a single process can host many independent sessions.
+
+Each Session steps its CPU in per-frame chunks as one task and presents its screen as another.
+All waiting (frame pacing, Fx0A waiting for a key, the refresh interval) is done with asyncio.sleep
+or asyncio events, nothing blocks the loop, so sessions only ever wait for each other for a frame.
+
+    sessions = [create_session('roms/pong.ch8', present=send_frame) for _ in range(32)]
+    await run_sessions(sessions)
+'''
+import asyncio
+import inspect
+from time import monotonic
+
+from chippy8.cpu import CPU
+from chippy8.scheduler import Scheduler
+from chippy8.screen import NullScreen
+from chippy8.keyboard import Keyboard, key_value
+from chippy8.config import FONT_FILE, INSTRUCTIONS_PER_FRAME, REFRESH_RATE
+
+class AsyncKeyboard(Keyboard):
+    '''
+    Keyboard for a session on an event loop.
+
+    Keys are pressed and released by code running on the loop (e.g. a network handler) through
+    press and release, or from the host keyboard after listen, which hands the pynput events over
+    to the loop thread. As with Keyboard, the CPU only sees the keys once the run loop calls advance.
+    '''
+
+    realtime = True # Keys arrive in wall-clock time, so waiting for one blocks
+
+    def __init__(self):
+        self.host_pressed = 0     # Held by the user of the session
+        self.pressed      = 0     # Seen by the CPU
+        self.rewinding    = False # Rewind key held
+        self.recording    = []
+        self.key_down     = asyncio.Event() # Set while any key (or the rewind key) is held
+        self.loop         = None
+
+    def listen(self):
+        '''
+        Follow the host keyboard through pynput. Call from a coroutine on the loop the session runs on.
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.start_listening()
+
+    def on_press(self, key):
+        self.loop.call_soon_threadsafe(self.host_key, key, True)
+
+    def on_release(self, key):
+        self.loop.call_soon_threadsafe(self.host_key, key, False)
+
+    def host_key(self, key, pressed):
+        value = key_value(key)
+
+        if key == self.rewind_key:
+            self.hold_rewind(pressed)
+        elif value != -1 and pressed:
+            self.press(value)
+        elif value != -1:
+            self.release(value)
+
+    def press(self, value):
+        self.host_pressed |= 1 << value
+        self.key_changed()
+
+    def release(self, value):
+        self.host_pressed &= ~(1 << value)
+        self.key_changed()
+
+    def hold_rewind(self, held):
+        self.rewinding = held
+        self.key_changed()
+
+    def key_changed(self):
+        if self.host_pressed or self.rewinding:
+            self.key_down.set()
+        else:
+            self.key_down.clear()
+
+    async def wait_for_key(self, timeout):
+        '''
+        Wait until a key (or the rewind key) is down, for at most timeout seconds. Returns whether one is.
+        '''
+        try:
+            await asyncio.wait_for(self.key_down.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        return self.key_down.is_set()
+
+class AsyncScheduler(Scheduler):
+    '''
+    Scheduler that runs as a task, pacing frames exactly like Scheduler but awaiting instead of sleeping.
+
+    Every frame ends with an await, in turbo mode too, so other tasks get to run between frames.
+    '''
+
+    async def run(self, max_cycles=None):
+        '''
+        Run frames until max_cycles instructions have executed, forever if None (or until cancelled or the ROM exits).
+        '''
+        self.next_frame = monotonic()
+
+        while (max_cycles is None or self.cpu.cycles < max_cycles) and not self.cpu.exited:
+            self.step(max_cycles)
+            await self.sleep(self.pace())
+
+    async def sleep(self, seconds):
+        '''
+        Wait out the rest of the frame, returning early when a key is pressed for a ROM waiting on one.
+        '''
+        if self.cpu.waiting_for_key and self.cpu.keyboard.realtime:
+            await self.cpu.keyboard.wait_for_key(seconds)
+        else:
+            await asyncio.sleep(seconds)
+
+class AsyncPresenter:
+    '''
+    Presents a screen at a fixed refresh rate from a task, see chippy8.presenter.Presenter.
+
+    present is called with each new frame (a snapshot of the pixel buffer) and may be a coroutine
+    function, it defaults to drawing to the terminal with Screen.update. Ticks with nothing new to
+    show are skipped, and ticks missed while presenting took too long are dropped.
+    '''
+
+    def __init__(self, screen, refresh_rate=REFRESH_RATE, present=None):
+        self.screen   = screen
+        self.interval = 1.0 / refresh_rate
+        self.present  = present
+        self.task     = None
+
+        self.presented = 0 # Frames presented
+        self.skipped   = 0 # Ticks dropped because presenting took longer than the interval
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        version    = None
+        next_frame = monotonic()
+
+        while True:
+            if self.screen.version != version:
+                version = self.screen.version
+                await self.show(self.screen.snapshot())
+
+            next_frame += self.interval
+            now         = monotonic()
+
+            if now > next_frame:
+                missed        = int((now - next_frame) / self.interval) + 1
+                next_frame   += missed * self.interval
+                self.skipped += missed
+
+            await asyncio.sleep(next_frame - now)
+
+    async def show(self, frame):
+        # Looked up on every frame, so a profiler wrapping Screen.update sees it
+        if self.present is None:
+            self.screen.update(frame)
+        else:
+            result = self.present(frame)
+            if inspect.isawaitable(result):
+                await result
+
+        self.presented += 1
+
+    async def stop(self):
+        '''
+        Stop presenting and present the final frame.
+        '''
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        await self.show(self.screen.snapshot())
+
+class Session:
+    '''
+    One emulator on the event loop: the CPU stepped by an AsyncScheduler, the screen by an AsyncPresenter.
+    '''
+
+    def __init__(self, cpu, instructions_per_frame=INSTRUCTIONS_PER_FRAME, turbo=False, rewind=None,
+                 refresh_rate=REFRESH_RATE, present=None):
+        self.cpu       = cpu
+        self.scheduler = AsyncScheduler(cpu, instructions_per_frame, turbo=turbo, rewind=rewind)
+        self.presenter = AsyncPresenter(cpu.screen, refresh_rate, present)
+
+    async def run(self, max_cycles=None):
+        '''
+        Run until max_cycles instructions have executed, forever if None. Cancelling stops the session.
+        '''
+        self.presenter.start()
+
+        try:
+            await self.scheduler.run(max_cycles)
+        finally:
+            await self.presenter.stop()
+
+def create_session(filepath, screen=None, keyboard=None, seed=None, **settings):
+    '''
+    Create a Session for the ROM at filepath, with the font loaded.
+
+    screen defaults to a NullScreen (frames only reach present) and keyboard to an AsyncKeyboard,
+    the other settings are passed on to Session.
+    '''
+    screen   = screen if screen is not None else NullScreen()
+    keyboard = keyboard if keyboard is not None else AsyncKeyboard()
+    chippy   = CPU(screen, keyboard, seed)
+
+    chippy.load_rom(FONT_FILE, 0)
+    chippy.load_rom(filepath)
+
+    return Session(chippy, **settings)
+
+async def run_sessions(sessions, max_cycles=None):
+    '''
+    Run every session on the current event loop until all of them have finished.
+    '''
+    await asyncio.gather(*(session.run(max_cycles) for session in sessions))
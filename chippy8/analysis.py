@@ -0,0 +1,352 @@
+'''
+Ahead-of-time analysis of a ROM: control-flow graph, data regions and self-modifying code.
+
+    python -m chippy8.analysis game.ch8
+
+Code is found by following every path from the entry point through jumps, calls and skips, the
+bytes of the ROM no path reaches are data. Fx55 and Fx33 write memory at I, which is followed
+through Annn from block to block, and writes landing on reachable code are self-modifying.
+
+A ROM always analyses the same way, so results are cached on disk keyed by the ROM's content hash.
+'''
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+from chippy8.disassembler import disassemble, lookup
+from chippy8.config import CACHE_DIRECTORY, MAX_MEM0RY, PROGRAM_COUNTER_START
+
+# Bumped whenever the analysis changes, older cache entries are analysed again
+ANALYSIS_VERSION = 3
+
+def successors(address, operand):
+    '''
+    Addresses execution can continue at after the instruction at address, None if only known at run time (Bnnn).
+
+    A call continues at its target and, once it returns, at the next instruction. Returns and exits
+    (00FD) have no successors of their own.
+    '''
+    opcode = operand >> 12
+
+    if operand in (0x00EE, 0x00FD):
+        return ()
+    if opcode == 0x1:
+        return (operand & 0x0FFF,)
+    if opcode == 0x2:
+        return (operand & 0x0FFF, address + 2)
+    if opcode == 0xB:
+        return None
+    if opcode in (0x3, 0x4, 0x5, 0x9) or operand & 0xF0FF in (0xE09E, 0xE0A1):
+        return (address + 2, address + 4)
+
+    return (address + 2,)
+
+def memory_writes(operand, i):
+    '''
+    (start, end) of the memory written by operand with the index register at i, None if it writes nothing.
+    '''
+    if operand & 0xF0FF == 0xF055:
+        return i, i + ((operand & 0x0F00) >> 8) + 1
+    if operand & 0xF0FF == 0xF033:
+        return i, i + 3
+
+    return None
+
+def follow_index(operand, i):
+    '''
+    The index register after operand, given it was i before. None when unknown.
+    '''
+    if operand & 0xF000 == 0xA000:
+        return operand & 0x0FFF
+    if operand & 0xF0FF in (0xF01E, 0xF029, 0xF030):
+        return None
+
+    return i
+
+def ranges(addresses):
+    '''
+    Merge addresses into sorted (start, end) runs.
+    '''
+    runs = []
+
+    for address in sorted(set(addresses)):
+        if runs and runs[-1][1] == address:
+            runs[-1][1] = address + 1
+        else:
+            runs.append([address, address + 1])
+
+    return [tuple(run) for run in runs]
+
+class BasicBlock:
+    '''
+    Straight-line code covering memory[start:end], entered only at start.
+
+    successors are the block starts it can continue at, indirect is set when it ends in Bnnn.
+    '''
+    __slots__ = ('start', 'end', 'successors', 'indirect')
+
+    def __init__(self, start, end, successors, indirect=False):
+        self.start      = start
+        self.end        = end
+        self.successors = successors
+        self.indirect   = indirect
+
+class Analysis:
+    '''
+    What analyse found out about a ROM loaded at start.
+
+    instructions maps every reachable address to its operand. data, writes and self_modifying are
+    sorted (start, end) regions, writes also carrying the address of the writing instruction.
+    Fx55/Fx33 executed with an I the analysis could not follow are listed in unresolved_writes,
+    the targets of undefined instructions in invalid.
+    '''
+
+    def __init__(self, rom_hash, start, size):
+        self.rom_hash = rom_hash
+        self.start    = start
+        self.size     = size
+
+        self.instructions      = {}
+        self.blocks            = {}
+        self.data              = []
+        self.writes            = []
+        self.self_modifying    = []
+        self.unresolved_writes = []
+        self.invalid           = []
+
+    def modified(self, address):
+        '''
+        Whether the instruction at address overlaps a self-modifying region.
+        '''
+        return any(start <= address + 1 and address < end for start, end in self.self_modifying)
+
+    def to_dict(self):
+        return {
+            'version':           ANALYSIS_VERSION,
+            'rom_hash':          self.rom_hash,
+            'start':             self.start,
+            'size':              self.size,
+            'instructions':      sorted(self.instructions.items()),
+            'blocks':            [
+                (block.start, block.end, block.successors, block.indirect) for block in self.blocks.values()
+            ],
+            'data':              self.data,
+            'writes':            self.writes,
+            'self_modifying':    self.self_modifying,
+            'unresolved_writes': self.unresolved_writes,
+            'invalid':           self.invalid
+        }
+
+    @classmethod
+    def from_dict(cls, fields):
+        analysis = cls(fields['rom_hash'], fields['start'], fields['size'])
+
+        analysis.instructions      = {address: operand for address, operand in fields['instructions']}
+        analysis.blocks            = {
+            start: BasicBlock(start, end, successors, indirect) for start, end, successors, indirect in fields['blocks']
+        }
+        analysis.data              = [tuple(region) for region in fields['data']]
+        analysis.writes            = [tuple(region) for region in fields['writes']]
+        analysis.self_modifying    = [tuple(region) for region in fields['self_modifying']]
+        analysis.unresolved_writes = fields['unresolved_writes']
+        analysis.invalid           = fields['invalid']
+
+        return analysis
+
+def rom_hash(rom):
+    return hashlib.sha1(rom).hexdigest()
+
+def analyse(rom, start=PROGRAM_COUNTER_START):
+    '''
+    Analyse rom as loaded at start, entering at start.
+
+    Only the ROM's own bytes are followed, paths leaving it or reaching a 0000 word end as invalid.
+    '''
+    memory = bytearray(MAX_MEM0RY)
+    memory[start:start + len(rom)] = rom
+
+    analysis     = Analysis(rom_hash(rom), start, len(rom))
+    end          = start + len(rom)
+    instructions = analysis.instructions
+    leaders      = {start}
+    invalid      = set()
+
+    # Follow every path from the entry point
+    pending = [start]
+    while pending:
+        address = pending.pop()
+        if address in instructions or address in invalid:
+            continue
+
+        # Past the ROM memory is zeros, and 0000 (SYS 0x000) is padding rather than code
+        if address < start or address + 2 > end:
+            invalid.add(address)
+            continue
+
+        operand = (memory[address] << 8) | memory[address + 1]
+        if operand == 0x0000 or lookup(operand) is None:
+            invalid.add(address)
+            continue
+
+        instructions[address] = operand
+        following             = successors(address, operand)
+
+        if following is not None and following != (address + 2,):
+            leaders.update(following)
+        if following:
+            pending.extend(following)
+
+    # Split the code into basic blocks at every branch and branch target
+    for leader in sorted(leaders):
+        if leader not in instructions:
+            continue
+
+        address = leader
+        while True:
+            following = successors(address, instructions[address])
+            address  += 2
+            if following != (address,) or address not in instructions or address in leaders:
+                break
+
+        block_successors = [target for target in following or () if target in instructions]
+        analysis.blocks[leader] = BasicBlock(leader, address, block_successors, following is None)
+
+    # Follow I through the blocks to find where Fx55 and Fx33 write
+    entry_index = index_at_entry(analysis)
+
+    for block in analysis.blocks.values():
+        i = entry_index.get(block.start)
+
+        for address in range(block.start, block.end, 2):
+            operand = instructions[address]
+            written = memory_writes(operand, i if i is not None else 0)
+
+            if written is not None and i is None:
+                analysis.unresolved_writes.append(address)
+            elif written is not None:
+                analysis.writes.append(written + (address,))
+
+            i = follow_index(operand, i)
+
+    code = {byte for address in instructions for byte in (address, address + 1)}
+
+    analysis.writes.sort()
+    analysis.unresolved_writes.sort()
+    analysis.self_modifying = ranges(
+        byte for write_start, write_end, _ in analysis.writes for byte in range(write_start, write_end) if byte in code
+    )
+    analysis.data    = ranges(set(range(start, start + len(rom))) - code)
+    analysis.invalid = sorted(invalid)
+
+    return analysis
+
+def index_at_entry(analysis):
+    '''
+    The value of I on entering each block, where every path into the block agrees on a known one.
+
+    I is 0 when the ROM starts. A subroutine may change I, so it is unknown after a call returns.
+    '''
+    entry_index = {analysis.start: 0} # Block start -> I, None once paths disagree
+    pending     = [analysis.start]
+
+    while pending:
+        block = analysis.blocks[pending.pop()]
+
+        i = entry_index[block.start]
+        for address in range(block.start, block.end, 2):
+            i = follow_index(analysis.instructions[address], i)
+
+        last = block.end - 2
+        for target in block.successors:
+            value = None if analysis.instructions[last] >> 12 == 0x2 and target == block.end else i
+
+            if target not in entry_index:
+                entry_index[target] = value
+            elif entry_index[target] != value and entry_index[target] is not None:
+                entry_index[target] = None
+            else:
+                continue
+
+            pending.append(target)
+
+    return entry_index
+
+def load_analysis(rom, start=PROGRAM_COUNTER_START, cache_directory=CACHE_DIRECTORY):
+    '''
+    The analysis of rom, from cache_directory when it was analysed before, otherwise analysed and cached there.
+
+    Entries are written to a temporary file and renamed into place, so concurrent runs never read a
+    partial one. An unwritable cache only costs the analysis.
+    '''
+    path = os.path.join(cache_directory, '{}-{:03x}.json'.format(rom_hash(rom), start))
+
+    try:
+        with open(path) as cached:
+            fields = json.load(cached)
+        if fields['version'] == ANALYSIS_VERSION:
+            return Analysis.from_dict(fields)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    analysis = analyse(rom, start)
+
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=cache_directory, suffix='.tmp', delete=False) as entry:
+            json.dump(analysis.to_dict(), entry)
+        os.replace(entry.name, path)
+    except OSError:
+        pass
+
+    return analysis
+
+def listing(analysis, rom):
+    '''
+    Yield the lines of an annotated listing: code by basic block with its successors, data as bytes.
+    '''
+    for block in sorted(analysis.blocks.values(), key=lambda block: block.start):
+        targets = ', '.join('0x{:03X}'.format(target) for target in block.successors)
+        yield 'block 0x{:03X}-0x{:03X}  -> {}{}'.format(
+            block.start, block.end, targets or '(return)', ' + indirect' if block.indirect else ''
+        )
+
+        for address in range(block.start, block.end, 2):
+            operand = analysis.instructions[address]
+            marker  = '*' if analysis.modified(address) else ' '
+            yield '  {:03X} {} {:04X}  {}'.format(address, marker, operand, disassemble(operand))
+
+    for data_start, data_end in analysis.data:
+        offset = data_start - analysis.start
+        yield 'data 0x{:03X}-0x{:03X}  {}'.format(
+            data_start, data_end, ' '.join('{:02X}'.format(byte) for byte in rom[offset:offset + data_end - data_start])
+        )
+
+    for write_start, write_end, writer in analysis.writes:
+        yield 'write 0x{:03X}-0x{:03X} by 0x{:03X}{}'.format(
+            write_start, write_end, writer,
+            ' (self-modifying)' if any(s < write_end and write_start < e for s, e in analysis.self_modifying) else ''
+        )
+    for writer in analysis.unresolved_writes:
+        yield 'write to an unknown address by 0x{:03X}'.format(writer)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse a CHIP-8 ROM: basic blocks, data and self-modifying code.')
+    parser.add_argument('filepath', metavar='F', type=str, help='path to the CHIP-8 ROM')
+    parser.add_argument('--no-cache', action='store_true', help='analyse again instead of using the cache')
+    parser.add_argument('--cache-dir', metavar='DIR', default=CACHE_DIRECTORY,
+                        help='analysis cache (default {})'.format(CACHE_DIRECTORY))
+    args = parser.parse_args(argv)
+
+    with open(args.filepath, 'rb') as rom_file:
+        rom = rom_file.read()
+
+    analysis = analyse(rom) if args.no_cache else load_analysis(rom, cache_directory=args.cache_dir)
+
+    for line in listing(analysis, rom):
+        print(line)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+'''
+Run a directory or manifest of ROMs headless across a process pool and report the results.
+
+    python -m chippy8.batch roms/ --max-cycles 100000 --format csv --output report.csv
+
+A manifest is a text file listing one ROM per line, optionally followed by its own cycle limit.
+Paths are relative to the manifest, # starts a comment.
+'''
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+
+from chippy8.config import REGISTER_COUNT
+from chippy8.headless import create_headless, run_headless
+
+DEFAULT_MAX_CYCLES = 100000
+DEFAULT_SEED       = 0 # Fixed, so frame hashes of ROMs using Cxkk are reproducible
+
+# Report columns, the register fields are the ones shown by CPU.__str__
+REGISTER_FIELDS = ['PC', 'OP'] + ['V{:X}'.format(i) for i in range(REGISTER_COUNT)] + ['I']
+REPORT_FIELDS   = ['rom', 'cycles', 'skipped_cycles', 'wall_time', 'frame_hash'] + REGISTER_FIELDS + ['error']
+
+def find_roms(path, max_cycles):
+    '''
+    List (rom path, cycle limit) pairs from a directory of .ch8 files or a manifest file.
+    '''
+    if os.path.isdir(path):
+        return [
+            (os.path.join(path, name), max_cycles)
+            for name in sorted(os.listdir(path)) if name.lower().endswith('.ch8')
+        ]
+
+    roms = []
+    with open(path) as manifest:
+        for line in manifest:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+
+            rom    = os.path.join(os.path.dirname(path), fields[0])
+            cycles = int(fields[1]) if len(fields) > 1 else max_cycles
+            roms.append((rom, cycles))
+
+    return roms
+
+def run_rom(job, seed=DEFAULT_SEED):
+    '''
+    Run a single ROM headless for its cycle limit, in a worker process.
+
+    A ROM that cannot be loaded gets a result with its error and everything else zeroed, rather than
+    failing the whole batch.
+    '''
+    rom, max_cycles = job
+    result = {'rom': rom, 'error': None}
+    start  = perf_counter()
+    chippy = None
+
+    try:
+        chippy = create_headless(rom, seed=seed)
+        run_headless(chippy, max_cycles)
+    except Exception as error:
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+
+    result['wall_time'] = perf_counter() - start
+
+    if chippy is None:
+        result.update(cycles=0, skipped_cycles=0, frame_hash='0' * 40)
+        result.update(dict.fromkeys(REGISTER_FIELDS, 0))
+
+        return {field: result[field] for field in REPORT_FIELDS}
+
+    result['cycles']         = chippy.cycles
+    result['skipped_cycles'] = chippy.skipped_cycles
+    result['frame_hash']     = hashlib.sha1(chippy.screen.to_bytes()).hexdigest()
+    result.update(chippy.register_dump())
+
+    return {field: result[field] for field in REPORT_FIELDS}
+
+def run_batch(roms, jobs=None, seed=DEFAULT_SEED):
+    '''
+    Run every (rom path, cycle limit) pair across a pool of jobs processes, results come back in order.
+    '''
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(partial(run_rom, seed=seed), roms))
+
+def write_report(results, output, report_format):
+    if report_format == 'json':
+        json.dump(results, output, indent=2)
+        output.write('\n')
+        return
+
+    writer = csv.DictWriter(output, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run CHIP-8 ROMs headless in parallel.')
+    parser.add_argument('path', help='directory of .ch8 files or a manifest listing them')
+    parser.add_argument('--max-cycles', metavar='N', type=int, default=DEFAULT_MAX_CYCLES,
+                        help='instructions to run per ROM (default {})'.format(DEFAULT_MAX_CYCLES))
+    parser.add_argument('--seed', metavar='N', type=int, default=DEFAULT_SEED,
+                        help='random number generator seed for every ROM (default {})'.format(DEFAULT_SEED))
+    parser.add_argument('--jobs', metavar='N', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--format', choices=('json', 'csv'), default='json', help='report format')
+    parser.add_argument('--output', metavar='FILE', default=None, help='write the report to FILE instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = run_batch(find_roms(args.path, args.max_cycles), args.jobs, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_report(results, output, args.format)
+    else:
+        write_report(results, sys.stdout, args.format)
+
+if __name__ == '__main__':
+    main()
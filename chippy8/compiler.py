@@ -0,0 +1,546 @@
+from chippy8.cpu import IdleLoop
+from chippy8.analysis import successors
+from chippy8.config import MAX_MEM0RY
+
+# Longest straight-line run in one basic block, a longer one continues in the next
+MAX_BLOCK_LENGTH = 64
+
+# Most basic blocks and instructions compiled into one region
+MAX_REGION_BLOCKS       = 32
+MAX_REGION_INSTRUCTIONS = 256
+
+# Inlined opcodes that end a basic block (jumps and skips)
+INLINE_TERMINATORS = (0x1, 0x3, 0x4, 0x5, 0x9, 0xB)
+
+def handler_reads(operand):
+    '''
+    What an instruction run through its handler reads from the registers: (registers, I).
+    '''
+    x = (operand & 0x0F00) >> 8
+    y = (operand & 0x00F0) >> 4
+
+    if operand & 0xF000 == 0xD000:
+        return (x, y), True
+    if operand & 0xF000 == 0xE000 or operand & 0xF0FF == 0xF030:
+        return (x,), False
+    if operand & 0xF0FF == 0xF033:
+        return (x,), True
+    if operand & 0xF0FF == 0xF055:
+        return tuple(range(x + 1)), True
+    if operand & 0xF0FF == 0xF075:
+        return tuple(range(x + 1)), False
+
+    return (), False
+
+def handler_writes(operand):
+    '''
+    What an instruction run through its handler may write besides pc: (registers, I, memory).
+    '''
+    x = (operand & 0x0F00) >> 8
+
+    if operand & 0xF000 == 0xD000:
+        return (0xF,), False, False
+    if operand & 0xF0FF == 0xF00A:
+        return (x,), False, False
+    if operand & 0xF0FF == 0xF085:
+        return tuple(range(x + 1)), False, False
+    if operand & 0xF0FF == 0xF030:
+        return (), True, False
+    if operand & 0xF0FF in (0xF033, 0xF055):
+        return (), False, True
+
+    return (), False, False
+
+def handler_continues(operand):
+    '''
+    Whether an instruction run through its handler always goes on to the next one, so it need not end a basic block.
+    '''
+    if operand in (0x00E0, 0x00FB, 0x00FC, 0x00FE, 0x00FF) or operand & 0xFFF0 == 0x00C0:
+        return True
+
+    return operand & 0xF000 == 0xD000 or operand & 0xF0FF in (0xF030, 0xF033, 0xF055, 0xF075, 0xF085)
+
+class Region:
+    '''
+    A compiled region: the basic blocks reachable from start, as a single function.
+
+    blocks holds (start, instructions) for each basic block, covered the addresses of the memory
+    the region was compiled from. valid is cleared when that memory is written, so a region
+    writing over itself (Fx33, Fx55) stops at the instruction that did.
+    '''
+    __slots__ = ('function', 'start', 'blocks', 'covered', 'source', 'valid')
+
+    def __init__(self, start, blocks, covered):
+        self.function = None
+        self.start    = start
+        self.blocks   = blocks
+        self.covered  = covered
+        self.source   = None
+        self.valid    = True
+
+class BlockCompiler:
+    '''
+    Optional execution engine that turns CHIP-8 code into generated Python functions.
+
+    Code is split into basic blocks at every jump, skip and call to a handler that may change pc,
+    and the blocks reachable from where execution enters are compiled together into a region. A
+    region runs as one function looping over its blocks, dispatching on pc, so loops and branches
+    between its blocks stay in the function with the registers in local variables. Register
+    arithmetic (6xkk, 7xkk, 8xyN, Annn, ...) becomes plain local variable arithmetic, anything else
+    is a call to the CPU handler it decodes to, with the registers it reads stored before and the
+    ones it changes read after.
+
+    A region is given the frame's remaining instruction budget and stops exactly when it runs out,
+    inside a block if need be. Regions are cached by entry address and dropped when the memory they
+    cover is written.
+    '''
+
+    def __init__(self, cpu):
+        self.cpu         = cpu
+        self.regions     = {}
+        self.covering    = {}
+        self.interpreted = set() # Addresses where a region would only hold one instruction
+        self.low         = MAX_MEM0RY # Memory[low:high] holds everything regions and interpreted depend on
+        self.high        = 0
+
+    def execute(self, count):
+        '''
+        Execute count instructions, a region at a time where possible.
+
+        An idle loop fast-forwards the rest of the budget.
+        '''
+        cpu         = self.cpu
+        cache       = cpu.decode_cache
+        regions     = self.regions
+        interpreted = self.interpreted
+        left        = count
+
+        while left:
+            state  = cpu.state
+            pc     = state.pc
+            region = regions.get(pc)
+
+            if region is None and pc not in interpreted:
+                region = self.compile(pc)
+
+            try:
+                if region is None:
+                    # CPU.execute_instruction inlined
+                    entry = cache.get(pc)
+                    if entry is None:
+                        entry = cache[pc] = cpu.fetch(pc)
+
+                    cpu.operand, handler, arguments = entry
+                    state.pc = pc + 2
+                    left    -= 1
+
+                    handler(*arguments)
+                else:
+                    left = region.function(left)
+            except IdleLoop as idle:
+                # A region passes the budget left after the jump, the interpreter has already counted it
+                cpu.skip_idle(idle.args[0] if idle.args else left)
+                left = 0
+
+        return count
+
+    def compile(self, start):
+        '''
+        Compile the region entered at start and cache it. Returns None if it would hold a single instruction or none.
+
+        The region also becomes the entry of every other block start in it that has none yet. Entering
+        inside code a region already covers (where a frame's budget ran out) only compiles the rest of
+        that block, as what follows it already has an entry.
+        '''
+        follow  = start not in self.covering
+        blocks  = []
+        starts  = set()
+        pending = [start]
+        length  = 0
+
+        # Breadth first, so the blocks closest to the entry make it in
+        while pending and len(blocks) < MAX_REGION_BLOCKS and length < MAX_REGION_INSTRUCTIONS:
+            block_start = pending.pop(0)
+            if block_start in starts:
+                continue
+
+            instructions = self.scan(block_start)
+            if not instructions:
+                continue
+
+            starts.add(block_start)
+            blocks.append((block_start, instructions))
+            length += len(instructions)
+
+            if not follow:
+                break
+
+            address, operand, handler, arguments = instructions[-1]
+            if handler == self.cpu.idle_jump:
+                pending.append(arguments[0])
+            elif self.ends_block(operand, handler):
+                pending.extend(successors(address, operand) or ())
+            else:
+                pending.append(address + 2)
+
+        if length < 2:
+            self.interpreted.add(start)
+            self.low  = min(self.low, start)
+            self.high = max(self.high, start + 4)
+            return None
+
+        covered = set()
+        for block_start, instructions in blocks:
+            covered.update(range(block_start, instructions[-1][0] + 2))
+
+            # A jump closing an idle loop depends on the loop instructions before it
+            address, _operand, handler, arguments = instructions[-1]
+            if handler == self.cpu.idle_jump:
+                covered.update(range(arguments[0], address))
+
+        region = Region(start, blocks, covered)
+        self.build(region)
+
+        for block_start, _instructions in blocks:
+            self.regions.setdefault(block_start, region)
+
+        for address in covered:
+            self.covering.setdefault(address, set()).add(region)
+
+        self.low  = min(self.low, min(covered))
+        self.high = max(self.high, max(covered) + 1)
+
+        return region
+
+    def scan(self, start):
+        '''
+        The (address, operand, handler, arguments) instructions of the basic block at start, empty if
+        the instruction there is undefined.
+        '''
+        cpu          = self.cpu
+        instructions = []
+        address      = start
+
+        while len(instructions) < MAX_BLOCK_LENGTH and address + 1 < MAX_MEM0RY:
+            try:
+                operand, handler, arguments = cpu.fetch(address)
+            except KeyError:
+                # Leave undefined instructions to the interpreter, which raises for them
+                break
+
+            instructions.append((address, operand, handler, arguments))
+            address += 2
+
+            if self.ends_block(operand, handler):
+                break
+
+        return instructions
+
+    def build(self, region):
+        '''
+        Generate and compile the region's function.
+        '''
+        namespace = {'cpu': self.cpu, 'region': region, 'IdleLoop': IdleLoop}
+        source    = self.generate(region.blocks, namespace)
+        exec(compile(source, '<region 0x{:03X}>'.format(region.start), 'exec'), namespace)
+
+        region.function = namespace['region_function']
+        region.source   = source
+
+    def invalidate(self, start=None, end=None):
+        '''
+        Drop regions overlapping memory[start:end]. Called without arguments, every region is dropped.
+        '''
+        if start is None:
+            for region in self.regions.values():
+                region.valid = False
+
+            self.regions.clear()
+            self.covering.clear()
+            self.interpreted.clear()
+            self.low  = MAX_MEM0RY
+            self.high = 0
+            return
+
+        # Writes mostly land in data, away from all the code seen so far
+        if end <= self.low or start >= self.high:
+            return
+
+        # A single instruction can end where the next one is undefined, which may be written now
+        self.interpreted.difference_update(range(start - 3, end))
+
+        for address in self.covering.keys() & range(start, end):
+            for region in self.covering.pop(address, ()):
+                region.valid = False
+
+                for block_start, _instructions in region.blocks:
+                    if self.regions.get(block_start) is region:
+                        del self.regions[block_start]
+
+                # Code the region covered outside the write counts as unseen again
+                for covered in region.covered:
+                    covering = self.covering.get(covered)
+                    if covering is not None:
+                        covering.discard(region)
+                        if not covering:
+                            del self.covering[covered]
+
+    def inlinable(self, operand, handler=None):
+        '''
+        Whether the instruction is translated to local arithmetic rather than a handler call.
+
+        A jump closing an idle loop keeps its handler, which detects the loop.
+        '''
+        if handler == self.cpu.idle_jump:
+            return False
+
+        opcode = (operand & 0xF000) >> 12
+
+        if opcode == 0x0:
+            # 0nnn is ignored, the 00xx system instructions are not
+            return operand & 0xFF00 != 0x0000
+        if opcode == 0xF:
+            return operand & 0x00FF in (0x07, 0x15, 0x18, 0x1E, 0x29, 0x65)
+
+        return opcode in (0x1, 0x3, 0x4, 0x5, 0x6, 0x7, 0x8, 0x9, 0xA, 0xB, 0xC)
+
+    def ends_block(self, operand, handler):
+        if not self.inlinable(operand, handler):
+            return handler == self.cpu.idle_jump or not handler_continues(operand)
+
+        return (operand & 0xF000) >> 12 in INLINE_TERMINATORS
+
+    def generate(self, blocks, namespace):
+        '''
+        Generate the source of the region function. Handlers for non-inlined instructions are added to namespace.
+
+        The function takes the instruction budget and returns what is left of it.
+        '''
+        used    = set()
+        written = set()
+        index   = []
+
+        def v(register, write=False):
+            used.add(register)
+            if write:
+                written.add(register)
+            return 'v{:X}'.format(register)
+
+        def i():
+            index.append(True)
+            return 'i'
+
+        dispatch = [(block_start, self.block(instructions, namespace, v, i)) for block_start, instructions in blocks]
+
+        write_back = ['V[{0}] = v{0:X}'.format(register) for register in sorted(written)]
+        if index:
+            write_back.append('state.i = i')
+
+        # Every register the region uses is loaded on entry, so all of them are set on every path
+        source = [
+            'def region_function(left):',
+            '    state = cpu.state',
+            '    V = state.v',
+            '    memory = cpu.memory',
+        ]
+        source.extend('    v{0:X} = V[{0}]'.format(register) for register in sorted(used))
+        if index:
+            source.append('    i = state.i')
+        source.append('    pc = state.pc')
+        source.append('    operand = cpu.operand')
+        source.append('    try:')
+        source.append('        while True:')
+        source.extend(self.dispatch(sorted(dispatch), '            '))
+        source.append('    except BaseException:')
+        source.append('        # An idle loop or an error leaves the registers in the CPU state, as the interpreter would')
+        source.extend('        ' + line for line in write_back)
+        source.append('        raise')
+        source.extend('    ' + line for line in write_back)
+        source.append('    state.pc = pc')
+        source.append('    cpu.operand = operand')
+        source.append('    return left')
+
+        return '\n'.join(source) + '\n'
+
+    def dispatch(self, blocks, indent):
+        '''
+        The lines picking the block to run from pc, a binary search over the (start, lines) blocks sorted by start.
+        '''
+        if len(blocks) > 3:
+            middle = len(blocks) // 2
+            return (
+                [indent + 'if pc < {}:'.format(blocks[middle][0])] + self.dispatch(blocks[:middle], indent + '    ') +
+                [indent + 'else:'] + self.dispatch(blocks[middle:], indent + '    ')
+            )
+
+        source = []
+        for position, (block_start, lines) in enumerate(blocks):
+            source.append(indent + '{} pc == {}:'.format('elif' if position else 'if', block_start))
+            source.extend(indent + '    ' + line for line in lines)
+        source.append(indent + 'else:')
+        source.append(indent + '    break')
+
+        return source
+
+    def block(self, instructions, namespace, v, i):
+        '''
+        The lines running a basic block, for the body of its branch in the dispatch loop.
+
+        The whole block runs when the budget covers it. Otherwise the instructions the budget allows
+        run one by one and the region returns, the last instruction (which may jump) is never reached.
+        '''
+        *body, (address, operand, handler, arguments) = instructions
+
+        lines = ['if left < {}:'.format(len(instructions)), '    if not left: break']
+        for position, (body_address, body_operand, body_handler, body_arguments) in enumerate(body):
+            ran      = 'left -= {}'.format(position + 1)
+            straight = self.straight(body_address, body_operand, body_handler, body_arguments, namespace, v, i, ran)
+            lines.extend('    ' + line for line in straight)
+            stop = 'pc = {}; operand = {}; left = 0; break'.format(body_address + 2, body_operand)
+            lines.append('    ' + (stop if position == len(body) - 1 else 'if left == {}: {}'.format(position + 1, stop)))
+
+        lines.append('left -= {}'.format(len(instructions)))
+        for position, (body_address, body_operand, body_handler, body_arguments) in enumerate(body):
+            ran = 'left += {}'.format(len(instructions) - position - 1)
+            lines.extend(self.straight(body_address, body_operand, body_handler, body_arguments, namespace, v, i, ran))
+
+        opcode = (operand & 0xF000) >> 12
+
+        if handler == self.cpu.idle_jump:
+            target, register, kk, skip_equal = arguments
+            lines.append('pc = {}; operand = {}'.format(target, operand))
+            lines.append('delay = state.delay')
+            lines.append('if {} == delay and delay {} {}:'.format(v(register), '!=' if skip_equal else '==', kk))
+            lines.append('    state.pc = pc; cpu.operand = operand')
+            lines.append('    raise IdleLoop(left)')
+        elif not self.inlinable(operand, handler):
+            lines.extend(self.call(address, operand, handler, arguments, namespace, v, i))
+            lines.append('pc = state.pc')
+            if handler_writes(operand)[2]:
+                lines.append('if not region.valid: break')
+        elif opcode == 0x1:
+            lines.append('pc = {}; operand = {}'.format(operand & 0x0FFF, operand))
+        elif opcode in (0x3, 0x4, 0x5, 0x9):
+            lines.append('pc = {} if {} else {}; operand = {}'.format(address + 4, self.condition(operand, v), address + 2, operand))
+        elif opcode == 0xB:
+            lines.append('pc = {} + {}; operand = {}'.format(address + 2 + (operand & 0x0FFF), v(0), operand))
+        else:
+            # A straight run cut at MAX_BLOCK_LENGTH or before an undefined instruction
+            lines.extend(self.inline(operand, v, i))
+            lines.append('pc = {}; operand = {}'.format(address + 2, operand))
+
+        return lines
+
+    def straight(self, address, operand, handler, arguments, namespace, v, i, ran):
+        '''
+        The lines of an instruction inside a basic block, which always goes on to the next one.
+
+        A handler writing over the region stops it after the instruction, ran being the line that
+        leaves the budget as if the block had been cut there.
+        '''
+        if self.inlinable(operand, handler):
+            return self.inline(operand, v, i)
+
+        lines = self.call(address, operand, handler, arguments, namespace, v, i)
+        if handler_writes(operand)[2]:
+            lines.append('if not region.valid: pc = {}; {}; break'.format(address + 2, ran))
+
+        return lines
+
+    def call(self, address, operand, handler, arguments, namespace, v, i):
+        '''
+        The lines calling the handler of a non-inlined instruction. Handlers are added to namespace.
+        '''
+        name            = 'h{:03X}'.format(address)
+        namespace[name] = handler
+
+        # Only what the handler reads has to be stored first, the rest is stored when the region returns
+        reads, reads_index = handler_reads(operand)
+        writes, writes_index, _writes_memory = handler_writes(operand)
+
+        lines = ['V[{}] = {}'.format(register, v(register)) for register in reads]
+        if reads_index:
+            lines.append('state.i = {}'.format(i()))
+        lines.append('state.pc = {}; cpu.operand = operand = {}'.format(address + 2, operand))
+        lines.append('{}({})'.format(name, ', '.join(str(argument) for argument in arguments)))
+        lines.extend('{} = V[{}]'.format(v(register), register) for register in writes)
+        if writes_index:
+            lines.append('{} = state.i'.format(i()))
+
+        return lines
+
+    def condition(self, operand, v):
+        '''
+        The expression under which a 3xkk, 4xkk, 5xy0 or 9xy0 skip is taken.
+        '''
+        opcode = (operand & 0xF000) >> 12
+        x      = (operand & 0x0F00) >> 8
+        y      = (operand & 0x00F0) >> 4
+        kk     = operand & 0x00FF
+
+        if opcode == 0x3:
+            return '{} == {}'.format(v(x), kk)
+        if opcode == 0x4:
+            return '{} != {}'.format(v(x), kk)
+        if opcode == 0x5:
+            return '{} == {}'.format(v(x), v(y))
+
+        return '{} != {}'.format(v(x), v(y))
+
+    def inline(self, operand, v, i):
+        '''
+        The lines of local arithmetic an inlinable instruction that does not end a block translates to.
+
+        v(register, write) and i() name the locals holding the registers and I.
+        '''
+        opcode = (operand & 0xF000) >> 12
+        x      = (operand & 0x0F00) >> 8
+        y      = (operand & 0x00F0) >> 4
+        n      = operand & 0x000F
+        kk     = operand & 0x00FF
+        nnn    = operand & 0x0FFF
+
+        if opcode == 0x0:
+            return []
+        if opcode == 0x6:
+            return ['{} = {}'.format(v(x, True), kk)]
+        if opcode == 0x7:
+            return ['{0} = ({0} + {1}) & 0xFF'.format(v(x, True), kk)]
+        if opcode == 0x8:
+            # Mirror the order of writes in the interpreter, which matters when x or y is VF
+            vx, vy = v(x, True), v(y)
+            vf     = v(0xF, True) if n in (0x4, 0x5, 0x6, 0x7, 0xE) else None
+            if n == 0x0:
+                return ['{} = {}'.format(vx, vy)]
+            if n == 0x1:
+                return ['{0} = {0} | {1}'.format(vx, vy)]
+            if n == 0x2:
+                return ['{0} = {0} & {1}'.format(vx, vy)]
+            if n == 0x3:
+                return ['{0} = {0} ^ {1}'.format(vx, vy)]
+            if n == 0x4:
+                return ['t = {} + {}'.format(vx, vy), '{} = t >> 8'.format(vf), '{} = t & 0xFF'.format(vx)]
+            if n == 0x5:
+                return ['t = {} - {}'.format(vx, vy), '{} = 0 if t < 0 else 1'.format(vf), '{} = t & 0xFF'.format(vx)]
+            if n == 0x6:
+                return ['t = {}'.format(vx), '{} = t & 0x1'.format(vf), '{} = t >> 1'.format(vx)]
+            if n == 0x7:
+                return ['t = {} - {}'.format(vy, vx), '{} = 0 if t < 0 else 1'.format(vf), '{} = t & 0xFF'.format(vx)]
+            return ['t = {}'.format(vx), '{} = (t << 1) & 0xFF'.format(vx), '{} = t >> 7'.format(vf)]
+        if opcode == 0xA:
+            return ['{} = {}'.format(i(), nnn)]
+        if opcode == 0xC:
+            return ['{} = {} & cpu.random.randint(0x00, 0xFF)'.format(v(x, True), kk)]
+        if kk == 0x07:
+            return ['{} = state.delay'.format(v(x, True))]
+        if kk == 0x15:
+            return ['state.delay = {}'.format(v(x))]
+        if kk == 0x18:
+            return ['state.sound = {}'.format(v(x))]
+        if kk == 0x1E:
+            return ['{} += {}'.format(i(), v(x))]
+        if kk == 0x29:
+            return ['{} = ({} & 0xF) * 5'.format(i(), v(x))]
+
+        # Fx65
+        return ['{} = memory[{} + {}]'.format(v(counter, True), i(), counter) for counter in range(x + 1)]
@@ -1,13 +1,30 @@
 import os
-from pynput.keyboard import KeyCode
 
 MAX_MEM0RY            = 0x1000 # 4096
 PROGRAM_COUNTER_START = 0x200
 REGISTER_COUNT        = 0x10   # 16
-STACK_POINTER_START   = 0x52
+STACK_DEPTH           = 16     # Nested subroutine calls
 
-DELAY_TIME_MS         = 10.0
-FONT_FILE             = os.path.join('chippy8', 'chippy8.font')
+FRAME_RATE             = 60     # Emulated frames per second, the timers tick once per frame
+INSTRUCTIONS_PER_FRAME = 10     # Instructions executed per emulated frame
+REFRESH_RATE           = 60     # Frames presented to the terminal per second
+FONT_FILE             = os.path.join(os.path.dirname(__file__), 'chippy8.font')
+LARGE_FONT_START      = 0x50   # SUPER-CHIP 8x10 digits (Fx30), stored in FONT_FILE after the 4x5 ones
+
+LORES_SIZE = (64, 32)  # Screen width and height, CHIP-8 and SUPER-CHIP low resolution (00FE)
+HIRES_SIZE = (128, 64) # SUPER-CHIP high resolution (00FF)
+
+REWIND_MEMORY            = 0x400000    # Bytes of history kept by the rewind buffer (4 MB)
+REWIND_KEYFRAME_INTERVAL = 60          # Frames between full snapshots in the rewind buffer
+REWIND_KEY               = 'backspace' # Host key held to run backwards (pynput Key name)
+
+STREAM_PORT   = 8008   # TCP port of the frame stream (--serve)
+STREAM_BUFFER = 0x1000 # Bytes queued per viewer before its stale frames are dropped
+
+TRACE_BUFFER = 0x100000 # Bytes of execution trace records buffered before each write (1 MB)
+
+# ROM analyses (chippy8.analysis), keyed by the ROM's content hash
+CACHE_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'chippy8')
 
 PIXEL_COLORS = {
     0x00: (  0,   0,   0), # BLACK (off)
@@ -23,28 +40,30 @@ PIXEL_COLORS = {
 # | 7 | 8 | 9 | E |  --/  | A | S | D | F |
 # | A | 0 | B | F |       | Z | X | C | V |
 # -----------------       -----------------
+#
+# Keys are matched by the character they type on the host keyboard
 KEY_MAPPING = {
     # First Row
-    0x1: KeyCode.from_char('1'),
-    0x2: KeyCode.from_char('2'),
-    0x3: KeyCode.from_char('3'),
-    0xC: KeyCode.from_char('4'),
+    0x1: '1',
+    0x2: '2',
+    0x3: '3',
+    0xC: '4',
 
     # Second Row
-    0x4: KeyCode.from_char('q'),
-    0x5: KeyCode.from_char('w'),
-    0x6: KeyCode.from_char('e'),
-    0xD: KeyCode.from_char('r'),
+    0x4: 'q',
+    0x5: 'w',
+    0x6: 'e',
+    0xD: 'r',
 
     # Third Row
-    0x7: KeyCode.from_char('a'),
-    0x8: KeyCode.from_char('s'),
-    0x9: KeyCode.from_char('d'),
-    0xE: KeyCode.from_char('f'),
+    0x7: 'a',
+    0x8: 's',
+    0x9: 'd',
+    0xE: 'f',
 
     # Fourth Row
-    0xA: KeyCode.from_char('z'),
-    0x0: KeyCode.from_char('x'),
-    0xB: KeyCode.from_char('c'),
-    0xF: KeyCode.from_char('v')
+    0xA: 'z',
+    0x0: 'x',
+    0xB: 'c',
+    0xF: 'v'
 }
\ No newline at end of file
@@ -1,22 +1,67 @@
-from random import randint
-from time import sleep
+import struct
+from random import Random
 from chippy8.keyboard import Keyboard
+from chippy8.state import State, StateView
 from chippy8.config import (
-    DELAY_TIME_MS,
+    HIRES_SIZE,
+    LARGE_FONT_START,
+    LORES_SIZE,
     MAX_MEM0RY,
     PROGRAM_COUNTER_START,
     REGISTER_COUNT,
-    STACK_POINTER_START
+    STACK_DEPTH
 )
 
+# Save state layout: this header, then memory, then the screen's packed pixel buffer
+STATE_MAGIC   = b'CH8S'
+STATE_VERSION = 3
+STATE_HEADER  = struct.Struct(
+    '<4sB'  # magic, version
+    'HHB'   # i, pc, sp
+    'BB'    # delay, sound
+    'HQ'    # operand, cycles
+    '16s'   # V0 - VF
+    '16H'   # stack
+    '16s'   # RPL flags
+    'HH'    # screen width, height
+)
+
+# Rows of a 16x16 Dxy0 sprite, two bytes each
+LARGE_SPRITE = struct.Struct('>16H')
+
+# Fx07, 3xkk/4xkk, 1nnn back to the Fx07: a ROM spinning on the delay timer
+IDLE_LOOP_LENGTH = 3
+
+class IdleLoop(Exception):
+    '''
+    Raised by the jump closing an idle loop, when the loop can only repeat until the end of the frame.
+    '''
+
+def format_register_dump(dump, separator='\n'):
+    '''
+    The text CPU.__str__ shows for a register_dump, or for whichever of its values dump has.
+
+    PC and OP share the first line, followed by V0 - VF and I, one per separator.
+    '''
+    registers = ['V{:X}'.format(i) for i in range(REGISTER_COUNT)]
+
+    fields = ['  '.join('{}: {:4X}'.format(name, dump[name]) for name in ('PC', 'OP') if name in dump)]
+    fields.extend('{}: {:2X}'.format(name, dump[name]) for name in registers if name in dump)
+    if 'I' in dump:
+        fields.append('I: {:4X}'.format(dump['I']))
+
+    return separator.join(field for field in fields if field)
+
 class CPU:
 
-    def __init__(self, screen):
-        # Initialize registers and timers
+    def __init__(self, screen, keyboard=None, seed=None):
+        # Initialize registers, timers and stack
         self.reset()
 
+        # Opcodes 0x0, 0x8, 0xE and 0xF are resolved through the secondary lookups below,
+        # 00Cn through system_opcode_Cn. SUPER-CHIP instructions are marked (SCHIP).
         self.OPERATION_LOOKUP = {
-            0x0: self.opcode_0, # See opcode_0 method for subroutines
+            0x0: self.opcode_0, # 0nnn - Jump to machine code routine (ignored)
             0x1: self.opcode_1, # 1nnn - Jump to address
             0x2: self.opcode_2, # 2nnn - Jump to subroutine at address nnn
             0x3: self.opcode_3, # 3xkk - Skip if Vx == kk
@@ -24,14 +69,22 @@ class CPU:
             0x5: self.opcode_5, # 5xy0 - Skip if Vx == Vy
             0x6: self.opcode_6, # 6xkk - Set Vx to kk
             0x7: self.opcode_7, # 7xkk - Add kk to Vx
-            0x8: self.opcode_8, # See logic subroutines
             0x9: self.opcode_9, # 9xy0 - Skip if Vx != Vy
             0xA: self.opcode_A, # Annn - Set index register to nnn
             0xB: self.opcode_B, # Bnnn - Jump to V0 + nnn
             0xC: self.opcode_C, # Cxkk - Random byte AND kk, stored in Vx
-            0xD: self.opcode_D, # Dxyn - Draw n sprite rows at position (Vx, Vy) beginning at i in memory
-            0xE: self.opcode_E, # See opcode_E method for keyboard subroutines
-            0xF: self.opcode_F, # See utility subroutines
+            0xD: self.opcode_D, # Dxyn - Draw n sprite rows at position (Vx, Vy) beginning at i in memory,
+                                # Dxy0 a 16x16 sprite (SCHIP)
+        }
+
+        self.SYSTEM_OPERATION_LOOKUP = {
+            0x00E0: self.system_opcode_E0, # 00E0 - Clear screen
+            0x00EE: self.system_opcode_EE, # 00EE - Return from subroutine
+            0x00FB: self.system_opcode_FB, # 00FB - Scroll right 4 pixels (SCHIP)
+            0x00FC: self.system_opcode_FC, # 00FC - Scroll left 4 pixels (SCHIP)
+            0x00FD: self.system_opcode_FD, # 00FD - Exit the interpreter (SCHIP)
+            0x00FE: self.system_opcode_FE, # 00FE - Low resolution, 64x32 (SCHIP)
+            0x00FF: self.system_opcode_FF  # 00FF - High resolution, 128x64 (SCHIP)
         }
 
         self.LOGICAL_OPERATION_LOOKUP = {
@@ -46,373 +99,451 @@ class CPU:
             0xE: self.logic_opcode_E  # 8xyE - Set Vx bitshift left 1
         }
 
+        self.KEYBOARD_OPERATION_LOOKUP = {
+            0x9E: self.keyboard_opcode_9E, # Ex9E - Skip if key Vx is not pressed
+            0xA1: self.keyboard_opcode_A1  # ExA1 - Skip if key Vx is pressed
+        }
+
         self.UTILITY_OPERATION_LOOKUP = {
             0x07: self.utility_opcode_07, # Fx07 - Set Vx to delay value
-            0x0A: self.utility_opcode_0A, # Fx0A - Set Vx to key press (blocking)
+            0x0A: self.utility_opcode_0A, # Fx0A - Set Vx to key press (waits)
             0x15: self.utility_opcode_15, # Fx15 - Set delay timer to Vx
             0x18: self.utility_opcode_18, # Fx18 - Set sound timer to Vx
             0x1E: self.utility_opcode_1E, # Fx1E - Increment index register by Vx
             0x29: self.utility_opcode_29, # Fx29 - Set index register to hex Vx
+            0x30: self.utility_opcode_30, # Fx30 - Set index register to large digit Vx (SCHIP)
             0x33: self.utility_opcode_33, # Fx33 - Decode Vx into binary-coded decimal
             0x55: self.utility_opcode_55, # Fx55 - Save V0 - Vx to index through index + x
-            0x65: self.utility_opcode_65  # Fx65 - Load V0 - Vx from index through index + x
+            0x65: self.utility_opcode_65, # Fx65 - Load V0 - Vx from index through index + x
+            0x75: self.utility_opcode_75, # Fx75 - Save V0 - Vx to the RPL flags (SCHIP)
+            0x85: self.utility_opcode_85  # Fx85 - Load V0 - Vx from the RPL flags (SCHIP)
         }
 
         self.operand = 0
+        self.cycles = 0 # Instructions run through execute_cycles
+        self.waiting_for_key = False # Set by Fx0A when no key is down, cleared by the scheduler every frame
+        self.exited = False # Set by 00FD, the schedulers stop running frames
+        self.rpl = bytearray(REGISTER_COUNT) # RPL user flags (Fx75/Fx85), kept across reset like on the HP-48
+        self.skipped_cycles = 0 # Cycles of idle loops fast-forwarded instead of executed
+        self.in_cycles = False # Inside execute_cycles, where idle loops are fast-forwarded
         self.memory = bytearray(MAX_MEM0RY)
+        self.decode_cache = {}
+        self.compiler = None
+        self.random = Random(seed) # Cxkk draws from this, a seed makes runs reproducible
         self.screen = screen
-        self.screen.load_emulator_window()
-        self.keyboard = Keyboard()
+        self.keyboard = keyboard if keyboard is not None else Keyboard()
 
-    def opcode_0(self):
-        '''
-        00E0 - Clear screen
-        00EE - Return from subroutine
+    def opcode_0(self, address):
         '''
-        if self.operand == 0x00E0:
-            self.screen.clear_screen()
+        0nnn - Jump to machine code routine at nnn
 
-        if self.operand == 0x00EE:
-            self.registers['sp'] -= 1
-            self.registers['pc'] = self.memory[self.registers['sp']] << 8
-            self.registers['sp'] -= 1
-            self.registers['pc'] += self.memory[self.registers['sp']]
+        Only meaningful on the original hardware, ignored by interpreters
+        '''
+        pass
 
-    def opcode_1(self):
+    def opcode_1(self, address):
         '''
         1nnn - Jump to address nnn
         '''
-        self.registers['pc'] = self.operand & 0x0FFF
+        self.state.pc = address
+
+    def idle_jump(self, address, register, kk, skip_equal):
+        '''
+        1nnn closing an idle loop (Fx07, 3xkk/4xkk, 1nnn back to the Fx07 at nnn)
 
-    def opcode_2(self):
+        The delay timer only changes between frames, so while Vx holds it and the skip (taken when the
+        timer equals kk for 3xkk, differs from it for 4xkk) stays in the loop, every further iteration
+        is the same until the frame ends. The jump can also be reached from outside the loop, so the
+        skip is checked rather than assumed.
+        '''
+        self.state.pc = address
+
+        # Single steps run the loop as is, only execute_cycles knows how much of it to skip
+        delay = self.state.delay
+        if self.in_cycles and self.state.v[register] == delay and (delay == kk) != skip_equal:
+            raise IdleLoop()
+
+    def skip_idle(self, count):
+        '''
+        Account for count instructions of the idle loop starting at pc without running them all.
+
+        Whole iterations change nothing, only the leftover instructions are executed.
+        '''
+        iterations = count // IDLE_LOOP_LENGTH
+        self.skipped_cycles += iterations * IDLE_LOOP_LENGTH
+
+        for _ in range(count % IDLE_LOOP_LENGTH):
+            self.execute_instruction()
+
+    def opcode_2(self, address):
         '''
         2nnn - Jump to subroutine at address nnn
         '''
-        self.memory[self.registers['sp']] = self.registers['pc'] & 0x00FF
-        self.registers['sp'] += 1
-        self.memory[self.registers['sp']] = (self.registers['pc'] & 0xFF00) >> 8
-        self.registers['sp'] += 1
-        self.registers['pc'] = self.operand & 0x0FFF
+        state = self.state
+
+        if state.sp == STACK_DEPTH:
+            raise IndexError('Stack overflow, more than {} nested calls'.format(STACK_DEPTH))
+
+        state.stack[state.sp] = state.pc
+        state.sp += 1
+        state.pc  = address
 
-    def opcode_3(self):
+    def opcode_3(self, register, value):
         '''
         3xkk - Skip next instruction if Vx == kk
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = self.operand & 0x00FF
+        if self.state.v[register] == value:
+            self.state.pc += 2
 
-        if self.registers['v'][register] == value:
-            self.registers['pc'] += 2
-
-    def opcode_4(self):
+    def opcode_4(self, register, value):
         '''
         4xkk - Skip next instruction if Vx != kk
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = self.operand & 0x00FF
-
-        if self.registers['v'][register] != value:
-            self.registers['pc'] += 2
+        if self.state.v[register] != value:
+            self.state.pc += 2
 
-    def opcode_5(self):
+    def opcode_5(self, register1, register2):
         '''
         5xy0 - Skip next instruction if Vx == Vy
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        if self.registers['v'][register1] == self.registers['v'][register2]:
-            self.registers['pc'] += 2
+        if v[register1] == v[register2]:
+            self.state.pc += 2
 
-    def opcode_6(self):
+    def opcode_6(self, register, value):
         '''
         6xkk - Set register Vx to kk
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = self.operand & 0x00FF
+        self.state.v[register] = value
 
-        self.registers['v'][register] = value
-
-    def opcode_7(self):
+    def opcode_7(self, register, value):
         '''
         7xkk - Add kk to register Vx
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = self.operand & 0x00FF
-        current  = self.registers['v'][register]
-        target   = value + current
+        v = self.state.v
 
-        self.registers['v'][register] = target % 0x100 # Constrain to (0x00, 0xFF)
+        current  = v[register]
+        target   = value + current
 
-    def opcode_8(self):
-        secondary_opcode = self.operand & 0x000F
-        self.LOGICAL_OPERATION_LOOKUP[secondary_opcode]()
+        v[register] = target % 0x100 # Constrain to (0x00, 0xFF)
 
-    def opcode_9(self):
+    def opcode_9(self, register1, register2):
         '''
         9xy0 - Skip next instruction if Vx == Vy
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        if self.registers['v'][register1] != self.registers['v'][register2]:
-            self.registers['pc'] += 2
+        if v[register1] != v[register2]:
+            self.state.pc += 2
 
-    def opcode_A(self):
+    def opcode_A(self, value):
         '''
         Annn - Set index register to nnn
         '''
-        value = self.operand & 0x0FFF
+        self.state.i = value
 
-        self.registers['i'] = value
-
-    def opcode_B(self):
+    def opcode_B(self, value):
         '''
         Bnnn - Jump to V0 + nnn
         '''
-        value = self.operand & 0x0FFF
-
-        self.registers['pc'] += (value + self.registers['v'][0])
+        self.state.pc += (value + self.state.v[0])
 
-    def opcode_C(self):
+    def opcode_C(self, register, value):
         '''
         Cxkk - Random byte AND kk, stored in Vx
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = (self.operand & 0x00FF) & randint(0x00, 0xFF)
+        self.state.v[register] = value & self.random.randint(0x00, 0xFF)
 
-        self.registers['v'][register] = value
-
-    def opcode_D(self):
+    def opcode_D(self, x_reg_value, y_reg_value, size):
         '''
         Dxyn - Display n-byte sprite at position (Vx, Vy) starting at memory location given by index register
+
+        Dxy0 (SCHIP) displays a 16x16 sprite instead, each row two bytes
         '''
+        v = self.state.v
+
         # Load X position from Vx
-        x_reg_value = (self.operand & 0x0F00) >> 8
-        x = self.registers['v'][x_reg_value]
+        x = v[x_reg_value]
 
         # Load Y position from Vy
-        y_reg_value = (self.operand & 0x00F0) >> 4
-        y = self.registers['v'][y_reg_value]
+        y = v[y_reg_value]
+
+        # Each sprite row is one byte of memory, starting at the index register
+        i = self.state.i
+
+        if size == 0 and i + LARGE_SPRITE.size <= MAX_MEM0RY:
+            sprite       = LARGE_SPRITE.unpack_from(self.memory, i)
+            sprite_width = 16
+        elif size == 0:
+            # Rows past the end of memory are dropped
+            data         = self.memory[i:i + LARGE_SPRITE.size]
+            sprite       = [int.from_bytes(data[offset:offset + 2], 'big') for offset in range(0, len(data) - 1, 2)]
+            sprite_width = 16
+        else:
+            sprite       = self.memory[i:i + size]
+            sprite_width = 8
 
-        # Load the pixel size and initialize the blank sprite
-        size = self.operand & 0x000F
-        sprite_array = []
+        # Place sprite, check for collision and store result in VF
+        v[0xF] = 0x0
+        collision = self.screen.place_sprite(sprite, x, y, sprite_width)
+        v[0xF] = collision
 
-        # Load the pixel data into the sprite buffer
-        for i in range(0, size):
-            pixel_bytes = self.memory[self.registers['i'] + i]
-            # Split the byte into an iterable list of 1's and 0's
-            pixel_row = [int(bit) for bit in '{0:08b}'.format(pixel_bytes)]
+    def system_opcode_E0(self):
+        '''
+        00E0 - Clear screen
+        '''
+        self.screen.clear_screen()
+
+    def system_opcode_EE(self):
+        '''
+        00EE - Return from subroutine
+        '''
+        state = self.state
 
-            sprite_array.append(pixel_row)
+        if state.sp == 0:
+            raise IndexError('Stack underflow, return without a call')
 
-        # Place sprite, check for collision and store result in VF
-        self.registers['v'][0xF] = 0x0
-        collision = self.screen.place_sprite(sprite_array, x, y)
-        self.registers['v'][0xF] = collision
+        state.sp -= 1
+        state.pc  = state.stack[state.sp]
+
+    def system_opcode_Cn(self, count):
+        '''
+        00Cn - Scroll the display down n rows (SCHIP)
+        '''
+        self.screen.scroll_down(count)
+
+    def system_opcode_FB(self):
+        '''
+        00FB - Scroll the display right 4 pixels (SCHIP)
+        '''
+        self.screen.scroll_right(4)
+
+    def system_opcode_FC(self):
+        '''
+        00FC - Scroll the display left 4 pixels (SCHIP)
+        '''
+        self.screen.scroll_left(4)
+
+    def system_opcode_FD(self):
+        '''
+        00FD - Exit the interpreter (SCHIP)
+
+        Stays on this instruction like Fx0A waiting for a key, the schedulers stop once they see exited.
+        '''
+        self.state.pc -= 2
+        self.exited    = True
+
+    def system_opcode_FE(self):
+        '''
+        00FE - Switch to low resolution, 64x32 (SCHIP)
+
+        The display is cleared
+        '''
+        self.screen.set_resolution(*LORES_SIZE)
 
-    def opcode_E(self):
+    def system_opcode_FF(self):
+        '''
+        00FF - Switch to high resolution, 128x64 (SCHIP)
+
+        The display is cleared
+        '''
+        self.screen.set_resolution(*HIRES_SIZE)
+
+    def keyboard_opcode_9E(self, register):
         '''
         Ex9E - Skip next instruction if key with value of Vx is not pressed
-        ExA1 - Skip next instruction if key with value of Vx is pressed
 
-        Both functions are non-blocking
+        Non-blocking
         '''
-        secondary_opcode = self.operand & 0x00FF
-        register = (self.operand & 0x0F00) >> 8
-        value    = self.registers['v'][register]
+        if not self.keyboard.is_pressed(self.state.v[register]):
+            self.state.pc += 2
 
-        if secondary_opcode == 0x9E:
-            if not self.keyboard.is_pressed(value):
-                self.registers['pc'] += 2
-        elif secondary_opcode == 0xA1:
-            if self.keyboard.is_pressed(value):
-                self.registers['pc'] += 2
+    def keyboard_opcode_A1(self, register):
+        '''
+        ExA1 - Skip next instruction if key with value of Vx is pressed
 
-    def opcode_F(self):
-        secondary_opcode = self.operand & 0x00FF
-        self.UTILITY_OPERATION_LOOKUP[secondary_opcode]()
+        Non-blocking
+        '''
+        if self.keyboard.is_pressed(self.state.v[register]):
+            self.state.pc += 2
 
-    def logic_opcode_0(self):
+    def logic_opcode_0(self, register1, register2):
         '''
         8xy0 - Set Vx = Vy
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        self.registers['v'][register1] = self.registers['v'][register2]
+        v[register1] = v[register2]
 
-    def logic_opcode_1(self):
+    def logic_opcode_1(self, register1, register2):
         '''
         8xy1 - Set Vx = Vx OR Vy
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        value1 = self.registers['v'][register1]
-        value2 = self.registers['v'][register2]
+        value1 = v[register1]
+        value2 = v[register2]
 
-        self.registers['v'][register1] = value1 | value2
+        v[register1] = value1 | value2
 
-    def logic_opcode_2(self):
+    def logic_opcode_2(self, register1, register2):
         '''
         8xy2 - Set Vx = Vx AND Vy
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        value1 = self.registers['v'][register1]
-        value2 = self.registers['v'][register2]
+        value1 = v[register1]
+        value2 = v[register2]
 
-        self.registers['v'][register1] = value1 & value2
+        v[register1] = value1 & value2
 
-    def logic_opcode_3(self):
+    def logic_opcode_3(self, register1, register2):
         '''
         8xy3 - Set Vx = Vx XOR Vy
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        value1 = self.registers['v'][register1]
-        value2 = self.registers['v'][register2]
+        value1 = v[register1]
+        value2 = v[register2]
 
-        self.registers['v'][register1] = value1 ^ value2
+        v[register1] = value1 ^ value2
 
-    def logic_opcode_4(self):
+    def logic_opcode_4(self, register1, register2):
         '''
         8xy4 - Set Vx = Vx + Vy, VF = carry
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        value1 = self.registers['v'][register1]
-        value2 = self.registers['v'][register2]
+        value1 = v[register1]
+        value2 = v[register2]
 
         target_value = value1 + value2
 
         # Handle carry bit
-        self.registers['v'][0xF] = 0
+        v[0xF] = 0
         if target_value > 0xFF:
             target_value = target_value % 0x100
-            self.registers['v'][0xF] = 1
+            v[0xF] = 1
 
-        self.registers['v'][register1] = target_value
+        v[register1] = target_value
 
-    def logic_opcode_5(self):
+    def logic_opcode_5(self, register1, register2):
         '''
         8xy5 - Set Vx = Vx - Vy, VF = NOT borrow
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        value1 = self.registers['v'][register1]
-        value2 = self.registers['v'][register2]
+        value1 = v[register1]
+        value2 = v[register2]
 
         # Handle borrow bit
-        self.registers['v'][0xF] = 1
+        v[0xF] = 1
         if value2 > value1:
             target_value = (0x100 + value1) - value2
-            self.registers['v'][0xF] = 0
+            v[0xF] = 0
         else:
             target_value = value1 - value2
 
-        self.registers['v'][register1] = target_value
+        v[register1] = target_value
 
-    def logic_opcode_6(self):
+    def logic_opcode_6(self, register1, register2):
         '''
         8xy6 - Set Vx bitshift right 1
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
-        value     = self.registers['v'][register1]
+        v = self.state.v
 
-        self.registers['v'][0xF]       = value & 0x1
-        self.registers['v'][register1] = value >> 1
+        value = v[register1]
 
-    def logic_opcode_7(self):
+        v[0xF]       = value & 0x1
+        v[register1] = value >> 1
+
+    def logic_opcode_7(self, register1, register2):
         '''
         8xy7 - Set Vx = Vy - Vx, VF = NOT borrow
         '''
-        register1 = (self.operand & 0x0F00) >> 8
-        register2 = (self.operand & 0x00F0) >> 4
+        v = self.state.v
 
-        value1 = self.registers['v'][register1]
-        value2 = self.registers['v'][register2]
+        value1 = v[register1]
+        value2 = v[register2]
 
         # Handle borrow bit
-        self.registers['v'][0xF] = 1
+        v[0xF] = 1
         if value1 > value2:
             target_value = (0x100 + value2) - value1
-            self.registers['v'][0xF] = 0
+            v[0xF] = 0
         else:
             target_value = value2 - value1
 
-        self.registers['v'][register1] = target_value
+        v[register1] = target_value
 
-    def logic_opcode_E(self):
+    def logic_opcode_E(self, register1, register2):
         '''
         8xyE - Set Vx bitshift left 1
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = self.registers['v'][register]
+        v = self.state.v
+
+        value = v[register1]
 
-        self.registers['v'][register] = (value << 1) % 0x100 # Bitshift left and handle overflows
-        self.registers['v'][0xF]      = (value & 0x80) >> 7
+        v[register1] = (value << 1) % 0x100 # Bitshift left and handle overflows
+        v[0xF]       = (value & 0x80) >> 7
 
-    def utility_opcode_07(self):
+    def utility_opcode_07(self, register):
         '''
         Fx07 - Set Vx to delay value
         '''
-        register = (self.operand & 0x0F00) >> 8
+        self.state.v[register] = self.state.delay
 
-        self.registers['v'][register] = self.timers['delay']
-
-    def utility_opcode_0A(self):
+    def utility_opcode_0A(self, register):
         '''
-        Fx0A - Set Vx to key press (blocking)
+        Fx0A - Set Vx to key press
+
+        Waits by running this instruction again until a key is pressed, so the run loop
+        keeps control (timers, scripted input) while the ROM is waiting. The key state only
+        changes between frames, so the scheduler blocks on the keyboard instead of spinning.
         '''
-        register = (self.operand & 0x0F00) >> 8
+        value = self.keyboard.mapped_key_value()
+
+        if value == -1:
+            self.state.pc -= 2
+            self.waiting_for_key = True
+            return
 
-        # Block until something is pressed
-        while not self.keyboard.current_key:
-            pass
-        
-        self.registers['v'][register] = self.keyboard.mapped_key_value()
+        self.state.v[register] = value
 
-    def utility_opcode_15(self):
+    def utility_opcode_15(self, register):
         '''
         Fx15 - Set delay timer to Vx
         '''
-        register = (self.operand & 0x0F00) >> 8
+        self.state.delay = self.state.v[register]
 
-        self.timers['delay'] = self.registers['v'][register]
-
-    def utility_opcode_18(self):
+    def utility_opcode_18(self, register):
         '''
         Fx18 - Set sound timer to Vx
         '''
-        register = (self.operand & 0x0F00) >> 8
-
-        self.timers['sound'] = self.registers['v'][register]
+        self.state.sound = self.state.v[register]
 
-    def utility_opcode_1E(self):
+    def utility_opcode_1E(self, register):
         '''
         Fx1E - Increment index register by Vx
         '''
-        register = (self.operand & 0x0F00) >> 8
+        self.state.i += self.state.v[register]
 
-        self.registers['i'] += self.registers['v'][register]
-
-    def utility_opcode_29(self):
+    def utility_opcode_29(self, register):
         '''
         Fx29 - Set index register to hex Vx (font character location)
+
+        The small font is loaded at 0, 5 bytes per digit, ahead of the large digits Fx30 points at.
         '''
-        register = (self.operand & 0x0F00) >> 8
+        self.state.i = (self.state.v[register] & 0xF) * 5
 
-        self.registers['i'] = self.registers['v'][register] + PROGRAM_COUNTER_START
+    def utility_opcode_30(self, register):
+        '''
+        Fx30 - Set index register to the large (8x10) digit for Vx (SCHIP)
+        '''
+        self.state.i = LARGE_FONT_START + (self.state.v[register] & 0xF) * 10
 
-    def utility_opcode_33(self):
+    def utility_opcode_33(self, register):
         '''
         Fx33 - Decode Vx into binary-coded decimal
 
@@ -422,97 +553,310 @@ class CPU:
 
         Does not increment i (remains unchanged from start of function)
         '''
-        register = (self.operand & 0x0F00) >> 8
-        value    = '{:3d}'.format(self.registers['v'][register])
-        i        = self.registers['i']
+        value    = self.state.v[register]
+        i        = self.state.i
+
+        self.memory[i    ] = value // 100
+        self.memory[i + 1] = (value // 10) % 10
+        self.memory[i + 2] = value % 10
 
-        self.memory[i    ] = int(value[0])
-        self.memory[i + 1] = int(value[1])
-        self.memory[i + 2] = int(value[2])
+        self.invalidate(i, i + 3)
 
-    def utility_opcode_55(self):
+    def utility_opcode_55(self, value):
         '''
         Fx55 - Save V0 - Vx to index through index + x
         '''
-        value = (self.operand & 0x0F00) >> 8
-        i     = self.registers['i']
+        i = self.state.i
+        v = self.state.v
 
         for counter in range(value + 1):
-            self.memory[i + counter] = self.registers['v'][counter]
+            self.memory[i + counter] = v[counter]
+
+        self.invalidate(i, i + value + 1)
 
-    def utility_opcode_65(self):
+    def utility_opcode_65(self, value):
         '''
         Fx65 - Load V0 - Vx from index through index + x
         '''
-        value = (self.operand & 0x0F00) >> 8
-        i     = self.registers['i']
+        i = self.state.i
+        v = self.state.v
 
         for counter in range(value + 1):
-            self.registers['v'][counter] = self.memory[i + counter]
+            v[counter] = self.memory[i + counter]
+
+    def utility_opcode_75(self, value):
+        '''
+        Fx75 - Save V0 - Vx to the RPL user flags (SCHIP)
+        '''
+        self.rpl[:value + 1] = self.state.v[:value + 1]
+
+    def utility_opcode_85(self, value):
+        '''
+        Fx85 - Load V0 - Vx from the RPL user flags (SCHIP)
+        '''
+        self.state.v[:value + 1] = self.rpl[:value + 1]
+
+    def decode(self, operand):
+        '''
+        Split a 2 byte operand into its handler and the operand fields that handler takes.
+
+        Returns a (handler, arguments) tuple, call as handler(*arguments).
+        '''
+        opcode = (operand & 0xF000) >> 12
+        x      = (operand & 0x0F00) >> 8
+        y      = (operand & 0x00F0) >> 4
+        n      = operand & 0x000F
+        kk     = operand & 0x00FF
+        nnn    = operand & 0x0FFF
+
+        if opcode == 0x0:
+            if operand in self.SYSTEM_OPERATION_LOOKUP:
+                return self.SYSTEM_OPERATION_LOOKUP[operand], ()
+            if operand & 0xFFF0 == 0x00C0:
+                return self.system_opcode_Cn, (n,)
+            return self.OPERATION_LOOKUP[opcode], (nnn,)
+        if opcode == 0x8:
+            return self.LOGICAL_OPERATION_LOOKUP[n], (x, y)
+        if opcode == 0xE:
+            return self.KEYBOARD_OPERATION_LOOKUP[kk], (x,)
+        if opcode == 0xF:
+            return self.UTILITY_OPERATION_LOOKUP[kk], (x,)
+        if opcode == 0xD:
+            return self.OPERATION_LOOKUP[opcode], (x, y, n)
+        if opcode in (0x5, 0x9):
+            return self.OPERATION_LOOKUP[opcode], (x, y)
+        if opcode in (0x1, 0x2, 0xA, 0xB):
+            return self.OPERATION_LOOKUP[opcode], (nnn,)
+
+        # 3xkk, 4xkk, 6xkk, 7xkk, Cxkk
+        return self.OPERATION_LOOKUP[opcode], (x, kk)
+
+    def fetch(self, address):
+        '''
+        Read and decode the 2 byte operand at address.
+
+        Returns an (operand, handler, arguments) tuple as stored in the decode cache.
+        '''
+        operand = (self.memory[address] << 8) | self.memory[address + 1]
+
+        if operand & 0xF000 == 0x1000 and operand & 0x0FFF == address - 4:
+            skip = self.idle_loop_skip(address - 4)
+            if skip is not None:
+                return operand, self.idle_jump, (address - 4, (skip & 0x0F00) >> 8, skip & 0x00FF, skip < 0x4000)
+
+        return (operand,) + self.decode(operand)
+
+    def idle_loop_skip(self, start):
+        '''
+        The skip of the idle loop starting at start (Fx07, 3xkk/4xkk on the same Vx), None if there is none.
+        '''
+        if start < 0:
+            return None
+
+        load = (self.memory[start] << 8) | self.memory[start + 1]
+        skip = (self.memory[start + 2] << 8) | self.memory[start + 3]
+        x    = (load & 0x0F00) >> 8
+
+        if load & 0xF0FF == 0xF007 and skip & 0xF000 in (0x3000, 0x4000) and (skip & 0x0F00) >> 8 == x:
+            return skip
+
+        return None
+
+    def invalidate(self, start=None, end=None):
+        '''
+        Drop cached instructions and compiled blocks overlapping memory[start:end].
+        Must be called after any write to memory.
+
+        An instruction at address a spans a and a + 1, so the one starting just before start is dropped too.
+        A jump closing an idle loop also depends on the 4 bytes before it, so jumps up to end + 3 are dropped.
+        Called without arguments, the whole cache is cleared.
+        '''
+        if self.compiler is not None:
+            self.compiler.invalidate(start, end)
+
+        if start is None:
+            self.decode_cache.clear()
+            return
+
+        for address in range(start - 1, end + 4):
+            self.decode_cache.pop(address, None)
 
     def execute_instruction(self):
         '''
         Read program memory 2 bytes at a time. Afterwards, the program counter is incremented by 2.
+
+        Each address is only decoded once, later visits dispatch straight from the decode cache.
         '''
-        
-        # Read most significant byte
-        self.operand = int(self.memory[self.registers['pc']])
-        # Bitshift left by 8
-        self.operand = self.operand << 8
-        # Read least significant byte
-        self.operand += int(self.memory[self.registers['pc'] + 1])
-        self.registers['pc'] += 2
+        state = self.state
+        pc    = state.pc
+        entry = self.decode_cache.get(pc)
+
+        if entry is None:
+            entry = self.decode_cache[pc] = self.fetch(pc)
+
+        self.operand, handler, arguments = entry
+        state.pc = pc + 2
 
-        # Opcode is most significant byte from our two byte operand
-        opcode = (self.operand & 0xF000) >> 12
-        self.OPERATION_LOOKUP[opcode]()
+        handler(*arguments)
 
         return self.operand
 
+    def execute_cycles(self, count):
+        '''
+        Execute count instructions, through compiled blocks when a compiler is attached.
+
+        Once an idle loop is detected, the rest of count is fast-forwarded through skip_idle.
+        '''
+        self.in_cycles = True
+
+        try:
+            if self.compiler is not None:
+                count = self.compiler.execute(count)
+            else:
+                try:
+                    for executed in range(count):
+                        self.execute_instruction()
+                except IdleLoop:
+                    self.skip_idle(count - executed - 1)
+        finally:
+            self.in_cycles = False
+
+        self.cycles += count
+
+        return count
+
+    def enable_compiler(self):
+        '''
+        Attach a block compiler, see chippy8.compiler.
+        '''
+        from chippy8.compiler import BlockCompiler
+
+        self.compiler = BlockCompiler(self)
+
     def reset(self):
         '''
         Reset (or initialize) registers, timers, stack pointer, and program counter.
         '''
-        # Initialize index, program counter, stack pointer, and registers
-        self.registers = {
-            'i':   0,
-            'pc':  PROGRAM_COUNTER_START,
-            'sp':  STACK_POINTER_START,
-            'v':   [0] * REGISTER_COUNT
-        }
+        self.state = State()
 
-        # Initialize delay and sound timers
-        self.timers = {
-            'delay': 0,
-            'sound': 0
-        }
+    @property
+    def registers(self):
+        '''
+        The i, pc, sp and v fields of state as a dict-style view, as they were stored before State.
+        '''
+        return StateView(self.state, ('i', 'pc', 'sp', 'v'))
+
+    @property
+    def timers(self):
+        '''
+        The delay and sound fields of state as a dict-style view.
+        '''
+        return StateView(self.state, ('delay', 'sound'))
 
     def load_rom(self, filename, offset=PROGRAM_COUNTER_START):
         '''
-        Load ROM binary from file.
+        Load ROM binary from file. Returns the bytes loaded.
+        '''
+        with open(filename, 'rb') as rom:
+            romdata = rom.read()
+
+        # A slice assignment past the end would grow memory instead of failing
+        if offset + len(romdata) > MAX_MEM0RY:
+            raise ValueError('ROM of {} bytes does not fit in memory at 0x{:03X}'.format(len(romdata), offset))
+
+        self.memory[offset:offset + len(romdata)] = romdata
+        self.invalidate(offset, offset + len(romdata))
+
+        return romdata
+
+    def save_state(self):
+        '''
+        Snapshot memory, registers, timers, RPL flags, operand, cycle count and the screen into a versioned binary blob.
+        '''
+        state  = self.state
+        pixels = self.screen.to_bytes()
+        blob   = bytearray(STATE_HEADER.size + MAX_MEM0RY + len(pixels))
+
+        STATE_HEADER.pack_into(
+            blob, 0,
+            STATE_MAGIC, STATE_VERSION,
+            state.i, state.pc, state.sp,
+            state.delay, state.sound,
+            self.operand, self.cycles,
+            bytes(state.v),
+            *state.stack,
+            bytes(self.rpl),
+            self.screen.width, self.screen.height
+        )
+
+        view = memoryview(blob)
+        view[STATE_HEADER.size:STATE_HEADER.size + MAX_MEM0RY] = self.memory
+        view[STATE_HEADER.size + MAX_MEM0RY:]                 = pixels
+
+        return bytes(blob)
+
+    def load_state(self, blob):
+        '''
+        Restore a blob made by save_state.
+
+        Cached decodes and compiled blocks are only dropped when memory actually differs.
         '''
-        romdata = open(filename, 'rb').read()
-        for index, val in enumerate(romdata):
-            self.memory[offset + index] = val
+        view   = memoryview(blob)
+        fields = STATE_HEADER.unpack_from(view)
+
+        magic, version, i, pc, sp, delay, sound, operand, cycles, v = fields[:10]
+        stack, (rpl, width, height) = fields[10:10 + STACK_DEPTH], fields[10 + STACK_DEPTH:]
 
-    def delay(self):
-        sleep(DELAY_TIME_MS / 1000.0)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError('Not a version {} ChipPy8 save state'.format(STATE_VERSION))
+        if (width, height) != (self.screen.width, self.screen.height):
+            self.screen.set_resolution(width, height)
+
+        memory = view[STATE_HEADER.size:STATE_HEADER.size + MAX_MEM0RY]
+        if memory != self.memory:
+            self.memory[:] = memory
+            self.invalidate()
+
+        state = self.state
+
+        state.i        = i
+        state.pc       = pc
+        state.sp       = sp
+        state.v[:]     = v
+        state.stack[:] = stack
+        state.delay    = delay
+        state.sound    = sound
+        self.rpl[:]    = rpl
+        self.operand   = operand
+        self.cycles    = cycles
+
+        self.screen.from_bytes(view[STATE_HEADER.size + MAX_MEM0RY:])
 
     def decrement_timers(self):
         '''
         Decrement the delay and sound timers.
         '''
+        state = self.state
 
-        for timer in self.timers.keys():
-            if self.timers[timer] != 0:
-                self.timers[timer] -= 1
+        if state.delay != 0:
+            state.delay -= 1
+        if state.sound != 0:
+            state.sound -= 1
 
-    def __str__(self):
-        val = 'PC: {:4X}  OP: {:4X}\n'.format(
-            self.registers['pc'] - 2, self.operand)
+    def register_dump(self):
+        '''
+        The values shown by __str__, by name.
+        '''
+        dump = {
+            'PC': self.state.pc - 2,
+            'OP': self.operand
+        }
 
         for i in range(REGISTER_COUNT):
-            val += 'V{:X}: {:2X}\n'.format(i, self.registers['v'][i])
-        val += 'I: {:4X}\n'.format(self.registers['i'])
+            dump['V{:X}'.format(i)] = self.state.v[i]
+        dump['I'] = self.state.i
 
-        return val
\ No newline at end of file
+        return dump
+
+    def __str__(self):
+        return format_register_dump(self.register_dump()) + '\n'
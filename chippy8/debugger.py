@@ -0,0 +1,524 @@
+'''
+Breakpoints, memory watchpoints and stepping, with an interactive prompt.
+
+    python -m chippy8.debugger game.ch8 --seed 1 --input keys.txt
+
+Nothing is checked per instruction. A breakpoint swaps the decoded instruction at its address for a
+trap, which stops before the instruction runs (once its condition holds, if it has one, evaluated with
+pc at the breakpoint) and otherwise runs it as usual. Watchpoints swap wrappers in for the handlers of
+the instructions accessing memory at I (Fx33 and Fx55 writing, Fx65 and Dxyn reading) and stop right
+after an access overlapping them. The stack lives in the CPU state rather than in memory, so memory
+watchpoints never see 2nnn and 00EE; the stack watch wraps those two instead and stops after each.
+All of them are only installed while any exist, without them the CPU runs its plain handlers.
+
+Execution goes through the interpreter a frame at a time like the Scheduler, with the timers ticking
+every instructions_per_frame instructions and scripted input applied at its cycle, so a run stopped
+and continued any number of times ends in the same state as one that was never stopped.
+'''
+import argparse
+import cmd
+import operator
+import re
+import sys
+
+from chippy8.cpu import LARGE_SPRITE
+from chippy8.analysis import memory_writes
+from chippy8.headless import create_headless
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.disassembler import disassemble
+from chippy8.config import INSTRUCTIONS_PER_FRAME, MAX_MEM0RY, REGISTER_COUNT
+
+# Handlers wrapped while watchpoints exist: (lookup table, key)
+WATCHED_HANDLERS = (
+    ('UTILITY_OPERATION_LOOKUP', 0x33), # Fx33 - writes I through I + 2
+    ('UTILITY_OPERATION_LOOKUP', 0x55), # Fx55 - writes I through I + x
+    ('UTILITY_OPERATION_LOOKUP', 0x65), # Fx65 - reads I through I + x
+    ('OPERATION_LOOKUP', 0xD)           # Dxyn - reads n sprite rows at I, 32 bytes for Dxy0
+)
+
+# Handlers wrapped while the stack is watched
+STACK_HANDLERS = (
+    ('OPERATION_LOOKUP', 0x2),             # 2nnn - pushes the return address
+    ('SYSTEM_OPERATION_LOOKUP', 0x00EE)    # 00EE - pops it
+)
+
+CONDITION_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<':  operator.lt,
+    '<=': operator.le,
+    '>':  operator.gt,
+    '>=': operator.ge
+}
+
+CONDITION = re.compile(r'^\s*(v[0-9a-f]|i|pc|sp|delay|sound)\s*(==|!=|<=|>=|<|>)\s*(\w+)\s*$', re.IGNORECASE)
+
+class Stop(Exception):
+    '''
+    Raised by a trap to stop execution. completed is 1 when the instruction raising it has run, 0 if it has not.
+    '''
+
+    def __init__(self, message, completed=0):
+        super().__init__(message)
+        self.completed = completed
+
+def memory_access(operand, i):
+    '''
+    (start, end, kind) of the memory operand accesses with the index register at i, kind 'r' or 'w'.
+    None for instructions not accessing memory at I.
+    '''
+    written = memory_writes(operand, i)
+    if written is not None:
+        return written + ('w',)
+
+    if operand & 0xF0FF == 0xF065:
+        return i, i + ((operand & 0x0F00) >> 8) + 1, 'r'
+    if operand & 0xF000 == 0xD000:
+        return i, i + ((operand & 0x000F) or LARGE_SPRITE.size), 'r'
+
+    return None
+
+def parse_condition(text):
+    '''
+    Turn "<register> <operator> <value>" (e.g. "v3 == 0x10", "i >= 0x300") into a function of the CPU state.
+    '''
+    match = CONDITION.match(text)
+    if match is None:
+        raise ValueError('Conditions look like "v3 == 0x10", on V0 - VF, i, pc, sp, delay or sound')
+
+    name, symbol, value = match.group(1).lower(), match.group(2), int(match.group(3), 0)
+    compare             = CONDITION_OPERATORS[symbol]
+
+    if name.startswith('v'):
+        register  = int(name[1], 16)
+        condition = lambda state: compare(state.v[register], value)
+    else:
+        condition = lambda state: compare(getattr(state, name), value)
+
+    condition.text = '{} {} 0x{:X}'.format(name, symbol, value)
+
+    return condition
+
+def describe_condition(condition, template):
+    '''
+    condition as text placed in template, an empty string without one.
+    '''
+    if condition is None:
+        return ''
+
+    return template.format(getattr(condition, 'text', 'condition'))
+
+class Debugger:
+    '''
+    Runs a CPU with breakpoints and watchpoints.
+
+    breakpoints maps an address to its condition (None to always stop), watchpoints are
+    (start, end, kinds) memory ranges, kinds being 'r', 'w' or 'rw', and watching_stack stops after
+    every call and return. frames counts the frames run and position the instructions executed in the
+    current one.
+    '''
+
+    def __init__(self, cpu, instructions_per_frame=INSTRUCTIONS_PER_FRAME):
+        self.cpu                    = cpu
+        self.instructions_per_frame = instructions_per_frame
+
+        self.breakpoints    = {}
+        self.watchpoints    = []
+        self.watching_stack = False
+        self.tables         = None # Original lookup tables while the watch handlers are installed
+        self.passing        = None # Breakpoint address resumed from, its trap lets the instruction run once
+        self.fetch_plain    = None # CPU.fetch while the breakpoint fetch is installed
+
+        self.frames   = 0
+        self.position = 0
+
+    def add_breakpoint(self, address, condition=None):
+        if not self.breakpoints:
+            # The cached decodes are made through fetch, the instance attribute shadows the method
+            self.fetch_plain = self.cpu.fetch
+            self.cpu.fetch   = self.fetch
+
+        self.breakpoints[address] = condition
+        self.cpu.invalidate(address, address + 2)
+
+    def remove_breakpoint(self, address):
+        del self.breakpoints[address]
+        self.cpu.invalidate(address, address + 2)
+
+        if not self.breakpoints:
+            del self.cpu.fetch
+
+    def add_watchpoint(self, start, end, kinds='w'):
+        self.watchpoints.append((start, end, kinds))
+
+        if len(self.watchpoints) == 1:
+            self.install_handlers()
+
+    def remove_watchpoint(self, start):
+        watched          = bool(self.watchpoints)
+        self.watchpoints = [watchpoint for watchpoint in self.watchpoints if watchpoint[0] != start]
+
+        if watched and not self.watchpoints:
+            self.install_handlers()
+
+    def watch_stack(self, watching=True):
+        if watching != self.watching_stack:
+            self.watching_stack = watching
+            self.install_handlers()
+
+    def install_handlers(self):
+        '''
+        Swap in lookup tables with the handlers wrapped for the watches that exist, or put the plain ones back.
+        '''
+        cpu = self.cpu
+
+        if self.tables is not None:
+            for name, table in self.tables.items():
+                setattr(cpu, name, table)
+            self.tables = None
+
+        wrapped = []
+        if self.watchpoints:
+            wrapped += [(name, key, self.watched) for name, key in WATCHED_HANDLERS]
+        if self.watching_stack:
+            wrapped += [(name, key, self.stack_watched) for name, key in STACK_HANDLERS]
+
+        if wrapped:
+            self.tables = {name: getattr(cpu, name) for name, _, _ in wrapped}
+            for name, table in self.tables.items():
+                setattr(cpu, name, dict(table))
+            for name, key, wrap in wrapped:
+                getattr(cpu, name)[key] = wrap(getattr(cpu, name)[key])
+
+        # Cached decodes still point at the handlers they were made with
+        cpu.invalidate()
+
+    def clear(self):
+        '''
+        Remove every breakpoint and watchpoint, leaving the CPU with its plain handlers.
+        '''
+        for address in list(self.breakpoints):
+            self.remove_breakpoint(address)
+        for start, _, _ in list(self.watchpoints):
+            self.remove_watchpoint(start)
+        self.watch_stack(False)
+
+    def fetch(self, address):
+        '''
+        CPU.fetch while breakpoints exist: instructions at breakpoints decode to a trap.
+        '''
+        entry = self.fetch_plain(address)
+
+        if address in self.breakpoints:
+            return entry[0], self.trap, (address,) + entry[1:]
+
+        return entry
+
+    def trap(self, address, handler, arguments):
+        cpu = self.cpu
+
+        if address == self.passing:
+            self.passing = None
+        else:
+            # The condition sees the machine as the instruction will, pc still at the breakpoint
+            condition    = self.breakpoints.get(address)
+            cpu.state.pc = address
+
+            if condition is None or condition(cpu.state):
+                raise Stop('Breakpoint at 0x{:03X}{}'.format(address, describe_condition(condition, ' ({})')))
+
+            cpu.state.pc = address + 2
+
+        handler(*arguments)
+
+    def watched(self, handler):
+        '''
+        Wrap a memory accessing handler to stop after it touches a watched range.
+        '''
+        cpu = self.cpu
+
+        def watched(*arguments):
+            start, end, kind = memory_access(cpu.operand, cpu.state.i)
+
+            hits = [
+                watchpoint for watchpoint in self.watchpoints
+                if watchpoint[0] < end and start < watchpoint[1] and kind in watchpoint[2]
+            ]
+            if not hits:
+                return handler(*arguments)
+
+            before = bytes(cpu.memory[start:end])
+            handler(*arguments)
+
+            message = 'Watchpoint 0x{:03X}-0x{:03X}: {} at 0x{:03X} {} 0x{:03X}-0x{:03X}'.format(
+                hits[0][0], hits[0][1], disassemble(cpu.operand), cpu.state.pc - 2,
+                'read' if kind == 'r' else 'wrote', start, end
+            )
+            if kind == 'w':
+                message += ' ({} -> {})'.format(before.hex(' '), bytes(cpu.memory[start:end]).hex(' '))
+
+            raise Stop(message, completed=1)
+
+        return watched
+
+    def stack_watched(self, handler):
+        '''
+        Wrap 2nnn or 00EE to stop after it pushes to or pops from the stack.
+        '''
+        cpu = self.cpu
+
+        def watched(*arguments):
+            address, sp = cpu.state.pc - 2, cpu.state.sp
+            handler(*arguments)
+
+            raise Stop('Stack: {} at 0x{:03X}, SP {} -> {}, continuing at 0x{:03X}'.format(
+                disassemble(cpu.operand), address, sp, cpu.state.sp, cpu.state.pc
+            ), completed=1)
+
+        return watched
+
+    def execute(self, count):
+        '''
+        Execute up to count instructions. Returns the number executed and the Stop ending them early, if any.
+        '''
+        execute_instruction = self.cpu.execute_instruction
+        executed            = 0
+        stop                = None
+
+        try:
+            for executed in range(count):
+                execute_instruction()
+            executed = count
+        except Stop as caught:
+            stop      = caught
+            executed += caught.completed
+        except KeyboardInterrupt:
+            stop = Stop('Interrupted')
+        finally:
+            self.cpu.cycles += executed
+
+        return executed, stop
+
+    def run(self, cycles=None, frames=None):
+        '''
+        Run until a breakpoint or watchpoint stops it, the ROM exits (00FD), cycles instructions have
+        executed or frames frames have ended, whichever comes first.
+
+        Returns the Stop, None when cycles or frames ran out.
+        '''
+        cpu      = self.cpu
+        keyboard = cpu.keyboard
+
+        # Resuming from a breakpoint runs the instruction it stopped before
+        self.passing = cpu.state.pc if cpu.state.pc in self.breakpoints else None
+
+        while not cpu.exited:
+            if self.position == 0:
+                cpu.waiting_for_key = False
+
+            keyboard.advance(cpu.cycles)
+            pending = keyboard.next_event()
+
+            budget = self.instructions_per_frame - self.position
+            if cycles is not None:
+                budget = min(budget, cycles)
+            if pending is not None:
+                budget = min(budget, pending - cpu.cycles)
+
+            executed, stop = self.execute(budget)
+
+            self.position += executed
+            if cycles is not None:
+                cycles -= executed
+
+            if self.position == self.instructions_per_frame:
+                cpu.decrement_timers()
+                self.frames  += 1
+                self.position = 0
+
+                if frames is not None:
+                    frames -= 1
+
+            if stop is not None:
+                return stop
+            if cycles == 0 or frames == 0:
+                return None
+
+        return Stop('Exited (00FD)')
+
+    def step(self, count=1):
+        return self.run(cycles=count)
+
+    def finish_frame(self, count=1):
+        '''
+        Run to the end of the current frame, and count - 1 frames after it.
+        '''
+        return self.run(frames=count)
+
+def format_registers(cpu, frames):
+    state = cpu.state
+
+    return '\n'.join((
+        'PC {:03X}  I {:03X}  SP {}  DT {:02X}  ST {:02X}  cycle {}  frame {}'.format(
+            state.pc, state.i, state.sp, state.delay, state.sound, cpu.cycles, frames
+        ),
+        '  '.join('V{:X} {:02X}'.format(register, state.v[register]) for register in range(REGISTER_COUNT)),
+    ))
+
+def format_instruction(cpu, address):
+    if address + 1 >= MAX_MEM0RY:
+        return '{:03X}  ----'.format(address)
+
+    operand = (cpu.memory[address] << 8) | cpu.memory[address + 1]
+
+    return '{:03X}  {:04X}  {}'.format(address, operand, disassemble(operand))
+
+def parse_range(text):
+    '''
+    "300" or "300-310" (hex, end exclusive) into (start, end).
+    '''
+    start, _, end = text.partition('-')
+    start         = int(start, 16)
+
+    return start, int(end, 16) if end else start + 1
+
+class DebuggerShell(cmd.Cmd):
+    '''
+    Interactive prompt over a Debugger. Addresses are hex, counts decimal.
+    '''
+    intro  = 'ChipPy8 debugger, "help" lists the commands.'
+    prompt = '(chippy8) '
+
+    def __init__(self, debugger, **arguments):
+        super().__init__(**arguments)
+        self.debugger = debugger
+        self.cpu      = debugger.cpu
+
+    def report(self, stop):
+        if stop is not None:
+            self.stdout.write('{}\n'.format(stop))
+
+        self.stdout.write('{}\n'.format(format_instruction(self.cpu, self.cpu.state.pc)))
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except (ValueError, KeyError, IndexError) as error:
+            self.stdout.write('Error: {}\n'.format(error))
+
+    def do_break(self, argument):
+        '''break ADDRESS [if REGISTER OP VALUE] - stop before the instruction at ADDRESS, e.g. break 2a4 if v3 == 0x10'''
+        address, _, condition = argument.partition(' if ')
+        self.debugger.add_breakpoint(int(address, 16), parse_condition(condition) if condition else None)
+
+    def do_delete(self, argument):
+        '''delete ADDRESS - remove the breakpoint at ADDRESS'''
+        self.debugger.remove_breakpoint(int(argument, 16))
+
+    def do_watch(self, argument):
+        '''watch START[-END] [r|w|rw] - stop after memory in the range is read or written (default w)
+watch stack - stop after every call (2nnn) and return (00EE), which memory watchpoints do not see'''
+        if argument.strip() == 'stack':
+            self.debugger.watch_stack()
+            return
+
+        text, _, kinds = argument.partition(' ')
+        kinds          = kinds.strip() or 'w'
+
+        if kinds not in ('r', 'w', 'rw'):
+            raise ValueError('Watch kinds are r, w or rw')
+
+        self.debugger.add_watchpoint(*parse_range(text), kinds)
+
+    def do_unwatch(self, argument):
+        '''unwatch START|stack - remove the watchpoints starting at START, or the stack watch'''
+        if argument.strip() == 'stack':
+            self.debugger.watch_stack(False)
+            return
+
+        self.debugger.remove_watchpoint(int(argument, 16))
+
+    def do_info(self, argument):
+        '''info - list the breakpoints and watchpoints'''
+        for address, condition in sorted(self.debugger.breakpoints.items()):
+            self.stdout.write('break 0x{:03X}{}\n'.format(address, describe_condition(condition, ' if {}')))
+        for start, end, kinds in self.debugger.watchpoints:
+            self.stdout.write('watch 0x{:03X}-0x{:03X} {}\n'.format(start, end, kinds))
+        if self.debugger.watching_stack:
+            self.stdout.write('watch stack\n')
+
+    def do_step(self, argument):
+        '''step [N] - execute N instructions (default 1)'''
+        self.report(self.debugger.step(int(argument or 1)))
+
+    def do_continue(self, argument):
+        '''continue - run until a breakpoint, a watchpoint or the ROM exits (Ctrl-C interrupts)'''
+        self.report(self.debugger.run())
+
+    def do_frame(self, argument):
+        '''frame [N] - run to the end of the current frame, and N - 1 more (default 1)'''
+        self.report(self.debugger.finish_frame(int(argument or 1)))
+
+    def do_regs(self, argument):
+        '''regs - show the registers, timers, cycle and frame count'''
+        self.stdout.write('{}\n'.format(format_registers(self.cpu, self.debugger.frames)))
+
+    def do_mem(self, argument):
+        '''mem START[-END] - dump memory (16 bytes by default)'''
+        start, end = parse_range(argument)
+        if '-' not in argument:
+            end = start + 16
+
+        for row in range(start, min(end, MAX_MEM0RY), 16):
+            self.stdout.write('{:03X}  {}\n'.format(row, self.cpu.memory[row:min(row + 16, end)].hex(' ')))
+
+    def do_dis(self, argument):
+        '''dis [ADDRESS] [N] - disassemble N instructions (default 8) from ADDRESS (default PC)'''
+        fields  = argument.split()
+        address = int(fields[0], 16) if fields else self.cpu.state.pc
+        count   = int(fields[1]) if len(fields) > 1 else 8
+
+        for offset in range(0, count * 2, 2):
+            self.stdout.write('{}\n'.format(format_instruction(self.cpu, address + offset)))
+
+    def do_screen(self, argument):
+        '''screen - print the frame as text'''
+        self.stdout.write('{}\n'.format(self.cpu.screen.dump()))
+
+    def do_quit(self, argument):
+        '''quit - leave the debugger'''
+        return True
+
+    def do_EOF(self, argument):
+        self.stdout.write('\n')
+        return True
+
+    # Short forms
+    do_b = do_break
+    do_s = do_step
+    do_c = do_continue
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Debug a CHIP-8 ROM: breakpoints, watchpoints and stepping.')
+    parser.add_argument('filepath', metavar='F', type=str, help='path to the CHIP-8 ROM')
+    parser.add_argument('--ipf', metavar='N', type=int, default=INSTRUCTIONS_PER_FRAME,
+                        help='instructions per frame (default {})'.format(INSTRUCTIONS_PER_FRAME))
+    parser.add_argument('--seed', metavar='N', type=int, default=None, help='seed the random number generator (Cxkk)')
+    parser.add_argument('--input', metavar='SCRIPT', type=str, default=None,
+                        help='key presses, one "<cycle> <key> <down|up>" event per line')
+    parser.add_argument('--load-state', metavar='FILE', type=str, default=None, help='start from a save state')
+    args = parser.parse_args(argv)
+
+    keyboard = ScriptedKeyboard.load(args.input) if args.input else ScriptedKeyboard()
+    chippy   = create_headless(args.filepath, keyboard, args.seed)
+
+    if args.load_state:
+        with open(args.load_state, 'rb') as state:
+            chippy.load_state(state.read())
+
+    shell = DebuggerShell(Debugger(chippy, args.ipf))
+    shell.report(None)
+    shell.cmdloop()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,459 @@
+'''
+Differential testing: run an engine in lockstep with a reference interpreter and report the first divergence.
+
+    python -m chippy8.difftest roms/ --engine compiled --max-cycles 1000000
+    python -m chippy8.difftest roms/pong.ch8 --engine cached --every instruction --input keys.txt
+
+The reference is chippy8.reference.ReferenceCPU, a separate interpreter sharing no code with CPU or
+Screen, so a bug in the handlers every engine is built on is caught too. The engine under test loads
+the same ROM and gets the same seed and scripted input. Both are compared at every frame boundary, or after every
+instruction with --every instruction: registers, stack, timers, RPL flags, memory and the framebuffer.
+
+The first difference ends the run. A divergence seen at a frame boundary is narrowed down to the
+instruction by running the ROM again up to that frame, comparing after every instruction. If that
+run agrees (e.g. a bug in fast-forwarding, which only happens a frame at a time) the frame is reported.
+'''
+import argparse
+import hashlib
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from random import Random
+
+from chippy8.cpu import CPU
+from chippy8.screen import NullScreen
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.reference import ReferenceCPU
+from chippy8.analysis import analyse
+from chippy8.batch import DEFAULT_MAX_CYCLES, DEFAULT_SEED, find_roms
+from chippy8.disassembler import disassemble
+from chippy8.config import FONT_FILE, INSTRUCTIONS_PER_FRAME, PROGRAM_COUNTER_START, REGISTER_COUNT
+
+# Memory addresses listed per divergence, the rest are only counted
+MEMORY_DIFF_LIMIT = 8
+
+class ReferenceEngine:
+    '''
+    The chippy8.reference.ReferenceCPU the engines are checked against. An exception stops it.
+    '''
+
+    def __init__(self, rom, seed, events):
+        self.machine  = ReferenceCPU(ScriptedKeyboard(events), seed)
+        self.keyboard = self.machine.keyboard
+        self.cycles   = 0
+        self.error    = None
+
+        for filename, offset in ((FONT_FILE, 0), (rom, PROGRAM_COUNTER_START)):
+            with open(filename, 'rb') as data:
+                self.machine.load(data.read(), offset)
+
+    @property
+    def stopped(self):
+        return self.error is not None or self.machine.exited
+
+    def execute(self, count):
+        self.keyboard.advance(self.cycles)
+        self.cycles += count
+
+        try:
+            self.machine.execute_cycles(count)
+        except Exception as error:
+            self.error = '{}: {}'.format(type(error).__name__, error)
+
+    def end_frame(self):
+        self.machine.decrement_timers()
+
+    def snapshot(self):
+        machine = self.machine
+
+        return {
+            'pc':         machine.pc,
+            'i':          machine.i,
+            'sp':         machine.sp,
+            'v':          bytes(machine.v),
+            'stack':      tuple(machine.stack[:machine.sp]),
+            'delay':      machine.delay,
+            'sound':      machine.sound,
+            'rpl':        bytes(machine.rpl),
+            'resolution': (machine.width, machine.height),
+            'stopped':    self.stopped,
+            'memory':     bytes(machine.memory),
+            'frame':      machine.frame()
+        }
+
+class CPUEngine:
+    '''
+    A CPU (or subclass) stepped by the harness. An exception stops it, like the ROM exiting (00FD).
+    '''
+
+    def __init__(self, cpu):
+        self.cpu      = cpu
+        self.keyboard = cpu.keyboard
+        self.cycles   = 0
+        self.error    = None
+
+    @property
+    def stopped(self):
+        return self.error is not None or self.cpu.exited
+
+    def execute(self, count):
+        self.keyboard.advance(self.cycles)
+        self.cycles += count
+
+        try:
+            self.cpu.execute_cycles(count)
+        except Exception as error:
+            self.error = '{}: {}'.format(type(error).__name__, error)
+
+    def end_frame(self):
+        self.cpu.decrement_timers()
+
+    def snapshot(self):
+        cpu   = self.cpu
+        state = cpu.state
+
+        return {
+            'pc':         state.pc,
+            'i':          state.i,
+            'sp':         state.sp,
+            'v':          bytes(state.v),
+            'stack':      tuple(state.stack[:state.sp]),
+            'delay':      state.delay,
+            'sound':      state.sound,
+            'rpl':        bytes(cpu.rpl),
+            'resolution': (cpu.screen.width, cpu.screen.height),
+            'stopped':    self.stopped,
+            'memory':     bytes(cpu.memory),
+            'frame':      cpu.screen.to_bytes()
+        }
+
+class SeededDraws:
+    '''
+    Stands in for the numpy generator of a single instance VectorCPU, drawing Cxkk bytes the way
+    CPU.opcode_C does so both see the same random numbers.
+    '''
+
+    def __init__(self, seed):
+        self.random = Random(seed)
+
+    def integers(self, low, high, size):
+        import numpy as np
+
+        return np.array([self.random.randint(low, high - 1) for _ in range(size)], dtype=np.int64)
+
+class VectorEngine:
+    '''
+    A single instance chippy8.vector.VectorCPU stepped by the harness. A fault stops it.
+    '''
+
+    def __init__(self, cpu, seed):
+        from chippy8.vector import VectorCPU, SCREEN_WIDTH, SCREEN_HEIGHT
+
+        self.resolution    = (SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.vector        = VectorCPU.from_cpu(cpu, 1)
+        self.vector.random = SeededDraws(seed)
+        self.keyboard      = cpu.keyboard
+        self.cycles        = 0
+        self.error         = None
+
+    @property
+    def stopped(self):
+        return not self.vector.active[0]
+
+    def execute(self, count):
+        self.keyboard.advance(self.cycles)
+        self.vector.keys[0] = self.keyboard.pressed
+        self.cycles        += count
+
+        self.vector.execute_cycles(count)
+        if self.vector.faulted[0]:
+            self.error = 'fault'
+
+    def end_frame(self):
+        self.vector.decrement_timers()
+
+    def snapshot(self):
+        vector = self.vector
+        sp     = int(vector.sp[0])
+
+        return {
+            'pc':         int(vector.pc[0]),
+            'i':          int(vector.i[0]),
+            'sp':         sp,
+            'v':          vector.v[0].tobytes(),
+            'stack':      tuple(int(address) for address in vector.stack[0, :sp]),
+            'delay':      int(vector.delay[0]),
+            'sound':      int(vector.sound[0]),
+            'rpl':        bytes(REGISTER_COUNT),
+            'resolution': self.resolution,
+            'stopped':    self.stopped,
+            'memory':     vector.memory[0].tobytes(),
+            'frame':      b''.join(int(row).to_bytes(self.resolution[0] // 8, 'big') for row in vector.pixels[0])
+        }
+
+def load_cpu(cpu_class, rom, seed, events):
+    chippy = cpu_class(NullScreen(), ScriptedKeyboard(events), seed)
+
+    chippy.load_rom(FONT_FILE, 0)
+    chippy.load_rom(rom)
+
+    return chippy
+
+def create_cached(rom, seed, events):
+    return CPUEngine(load_cpu(CPU, rom, seed, events))
+
+def create_compiled(rom, seed, events):
+    chippy = load_cpu(CPU, rom, seed, events)
+    chippy.enable_compiler()
+
+    return CPUEngine(chippy)
+
+def predecode(chippy, analysis):
+    '''
+    Fill the decode cache with the instructions a chippy8.analysis.Analysis of the loaded ROM found.
+
+    Self-modifying code is left to be decoded when it runs. Nothing runs faster for it, the engine
+    only checks that filling the cache up front agrees with filling it as instructions execute.
+    '''
+    modified = {byte for start, end in analysis.self_modifying for byte in range(start - 1, end)}
+
+    for address in analysis.instructions:
+        if address not in modified:
+            chippy.decode_cache[address] = chippy.fetch(address)
+
+def create_predecoded(rom, seed, events):
+    chippy = load_cpu(CPU, rom, seed, events)
+
+    with open(rom, 'rb') as rom_file:
+        predecode(chippy, analyse(rom_file.read()))
+
+    return CPUEngine(chippy)
+
+def create_vector(rom, seed, events):
+    return VectorEngine(load_cpu(CPU, rom, seed, events), seed)
+
+# Engines that can be tested against the reference, by name
+ENGINES = {
+    'cached':     create_cached,     # CPU as it runs by default: decode cache and idle loop fast-forwarding
+    'compiled':   create_compiled,   # Block compiler
+    'predecoded': create_predecoded, # Decode cache filled from the ROM's analysis
+    'vector':     create_vector      # NumPy lockstep engine, one instance (requires numpy)
+}
+
+def differences(reference, candidate):
+    '''
+    Names of the snapshot fields that differ.
+    '''
+    return [field for field in reference if reference[field] != candidate[field]]
+
+def lockstep(rom, engine='cached', max_cycles=DEFAULT_MAX_CYCLES, instructions_per_frame=INSTRUCTIONS_PER_FRAME,
+             seed=DEFAULT_SEED, events=(), every_instruction=False):
+    '''
+    Run rom on the reference and on engine side by side for max_cycles instructions.
+
+    Returns a dict with the status ('match', 'stopped' when both stopped at the same point, or
+    'diverged'), the cycles and frames run. A divergence also has where it was found ('instruction',
+    'frame', or 'frame end' for the timers ticking), the snapshots before and after it and the
+    fields that differ.
+    '''
+    reference = ReferenceEngine(rom, seed, events)
+    candidate = ENGINES[engine](rom, seed, events)
+    keyboard  = reference.keyboard
+    frames    = 0
+    before    = reference.snapshot()
+
+    def diverged(after, fields, where):
+        return {
+            'status':    'diverged',
+            'cycles':    reference.cycles,
+            'frames':    frames,
+            'where':     where,
+            'before':    before,
+            'reference': after,
+            'candidate': candidate.snapshot(),
+            'fields':    fields
+        }
+
+    while reference.cycles < max_cycles:
+        budget = min(instructions_per_frame, max_cycles - reference.cycles)
+
+        while budget > 0:
+            # Split at scripted key events, as Scheduler.run_frame does
+            keyboard.advance(reference.cycles)
+            pending = keyboard.next_event()
+            count   = budget if pending is None else min(budget, pending - reference.cycles)
+            if every_instruction:
+                count = 1
+
+            reference.execute(count)
+            candidate.execute(count)
+            budget -= count
+
+            if every_instruction:
+                after  = reference.snapshot()
+                fields = differences(after, candidate.snapshot())
+                if fields and not (reference.error and candidate.error):
+                    return diverged(after, fields, 'instruction')
+                before = after
+
+            if reference.stopped:
+                break
+
+        reference.end_frame()
+        candidate.end_frame()
+        frames += 1
+
+        # Past an error the state is undefined, stopping at the same point is all that has to match
+        after  = reference.snapshot()
+        fields = differences(after, candidate.snapshot())
+        if fields and not (reference.error and candidate.error):
+            return diverged(after, fields, 'frame end' if every_instruction else 'frame')
+        if reference.stopped:
+            return {'status': 'stopped', 'cycles': reference.cycles, 'frames': frames, 'error': reference.error}
+
+        before = after
+
+    return {'status': 'match', 'cycles': reference.cycles, 'frames': frames}
+
+def locate(rom, result, engine, instructions_per_frame, seed, events):
+    '''
+    Narrow a divergence found at a frame boundary down to the instruction, by running again up to that frame.
+    '''
+    exact = lockstep(rom, engine, result['cycles'], instructions_per_frame, seed, events, every_instruction=True)
+
+    return exact if exact['status'] == 'diverged' else result
+
+def run_rom(job, engine='cached', instructions_per_frame=INSTRUCTIONS_PER_FRAME, seed=DEFAULT_SEED, events=(),
+            every_instruction=False):
+    '''
+    Test a single ROM for its cycle limit, in a worker process. Returns the lockstep result with the rom added.
+
+    A ROM that cannot be loaded gets an 'error' result with nothing run, rather than failing the whole run.
+    '''
+    rom, max_cycles = job
+
+    try:
+        result = lockstep(rom, engine, max_cycles, instructions_per_frame, seed, events, every_instruction)
+        if result['status'] == 'diverged' and not every_instruction:
+            result = locate(rom, result, engine, instructions_per_frame, seed, events)
+    except Exception as error:
+        result = {'status': 'error', 'cycles': 0, 'frames': 0, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+    result['rom'] = rom
+
+    return result
+
+def describe(result):
+    '''
+    Yield the lines of a text report for a lockstep result.
+    '''
+    if result['status'] == 'match':
+        yield 'match     {}  {} cycles'.format(result['rom'], result['cycles'])
+        return
+    if result['status'] == 'stopped':
+        yield 'stopped   {}  both at cycle {}: {}'.format(result['rom'], result['cycles'], result['error'] or 'exit')
+        return
+    if result['status'] == 'error':
+        yield 'ERROR     {}  {}'.format(result['rom'], result['error'])
+        return
+
+    before, reference, candidate = result['before'], result['reference'], result['candidate']
+
+    pc      = before['pc']
+    memory  = before['memory']
+    operand = (memory[pc] << 8) | memory[pc + 1] if pc + 1 < len(memory) else 0
+
+    yield 'DIVERGED  {}  at cycle {} (frame {})'.format(result['rom'], result['cycles'], result['frames'])
+    if result['where'] == 'instruction':
+        yield '  instruction 0x{:03X}: {:04X}  {}'.format(pc, operand, disassemble(operand))
+    elif result['where'] == 'frame':
+        yield '  in the frame starting at 0x{:03X}: {:04X}  {}'.format(pc, operand, disassemble(operand))
+    else:
+        yield '  when the timers ticked at the end of the frame, before 0x{:03X}: {:04X}  {}'.format(
+            pc, operand, disassemble(operand)
+        )
+
+    yield '  {:<12} {:>16} {:>16} {:>16}'.format('field', 'before', 'reference', 'candidate')
+
+    for field in result['fields']:
+        if field == 'v':
+            for register in range(REGISTER_COUNT):
+                values = (before['v'][register], reference['v'][register], candidate['v'][register])
+                if values[1] != values[2]:
+                    yield '  {:<12} {:>16} {:>16} {:>16}'.format('V{:X}'.format(register), *map(hex, values))
+        elif field == 'memory':
+            changed = [
+                address for address in range(len(reference['memory']))
+                if reference['memory'][address] != candidate['memory'][address]
+            ]
+            for address in changed[:MEMORY_DIFF_LIMIT]:
+                values = (before['memory'][address], reference['memory'][address], candidate['memory'][address])
+                yield '  {:<12} {:>16} {:>16} {:>16}'.format('[0x{:03X}]'.format(address), *map(hex, values))
+            if len(changed) > MEMORY_DIFF_LIMIT:
+                yield '  ... {} more bytes of memory differ'.format(len(changed) - MEMORY_DIFF_LIMIT)
+        elif field == 'frame':
+            values = (before['frame'], reference['frame'], candidate['frame'])
+            yield '  {:<12} {:>16} {:>16} {:>16}'.format(
+                'frame sha1', *(hashlib.sha1(frame).hexdigest()[:12] for frame in values)
+            )
+        else:
+            yield '  {:<12} {:>16} {:>16} {:>16}'.format(field, *(str(snapshot[field]) for snapshot in (before, reference, candidate)))
+
+def summary(result):
+    '''
+    JSON-friendly copy of a lockstep result, the snapshots reduced to the fields that differ.
+    '''
+    entry = {key: value for key, value in result.items() if key not in ('before', 'reference', 'candidate')}
+
+    if result['status'] == 'diverged':
+        entry['pc'] = result['before']['pc']
+        for name in ('before', 'reference', 'candidate'):
+            snapshot    = result[name]
+            entry[name] = {
+                field: hashlib.sha1(snapshot[field]).hexdigest() if field in ('memory', 'frame') else
+                       snapshot[field].hex() if isinstance(snapshot[field], bytes) else snapshot[field]
+                for field in result['fields']
+            }
+
+    return entry
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Test an engine against the reference interpreter, ROM by ROM.')
+    parser.add_argument('path', help='a .ch8 file, a directory of them or a manifest listing them')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='cached', help='engine to test (default cached)')
+    parser.add_argument('--every', choices=('frame', 'instruction'), default='frame',
+                        help='compare at every frame boundary (default) or after every instruction')
+    parser.add_argument('--max-cycles', metavar='N', type=int, default=DEFAULT_MAX_CYCLES,
+                        help='instructions to run per ROM (default {})'.format(DEFAULT_MAX_CYCLES))
+    parser.add_argument('--ipf', metavar='N', type=int, default=INSTRUCTIONS_PER_FRAME,
+                        help='instructions per frame (default {})'.format(INSTRUCTIONS_PER_FRAME))
+    parser.add_argument('--seed', metavar='N', type=int, default=DEFAULT_SEED,
+                        help='random number generator seed for every ROM (default {})'.format(DEFAULT_SEED))
+    parser.add_argument('--input', metavar='SCRIPT', default=None, help='key presses fed to every ROM')
+    parser.add_argument('--jobs', metavar='N', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--format', choices=('text', 'json'), default='text', help='report format')
+    args = parser.parse_args(argv)
+
+    roms   = [(args.path, args.max_cycles)] if args.path.lower().endswith('.ch8') else find_roms(args.path, args.max_cycles)
+    events = ScriptedKeyboard.load(args.input).events if args.input else ()
+    test   = partial(
+        run_rom, engine=args.engine, instructions_per_frame=args.ipf, seed=args.seed, events=events,
+        every_instruction=args.every == 'instruction'
+    )
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(test, roms))
+
+    if args.format == 'json':
+        json.dump([summary(result) for result in results], sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for result in results:
+            for line in describe(result):
+                print(line)
+
+    return 1 if any(result['status'] in ('diverged', 'error') for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
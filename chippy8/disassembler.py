@@ -0,0 +1,122 @@
+'''
+CHIP-8 and SUPER-CHIP disassembler, turns operands into mnemonics.
+
+Mnemonics describe what the emulator does, which for the Ex9E/ExA1 key skips is the opposite of
+the usual SKP/SKNP.
+
+    python -m chippy8.disassembler game.ch8
+'''
+import argparse
+import sys
+
+from chippy8.config import MAX_MEM0RY, PROGRAM_COUNTER_START
+
+# (mask, value, pattern, mnemonic) - the first entry where operand & mask == value wins
+INSTRUCTIONS = [
+    (0xFFFF, 0x00E0, '00E0', 'CLS'),
+    (0xFFFF, 0x00EE, '00EE', 'RET'),
+    (0xFFF0, 0x00C0, '00Cn', 'SCD {n}'),
+    (0xFFFF, 0x00FB, '00FB', 'SCR'),
+    (0xFFFF, 0x00FC, '00FC', 'SCL'),
+    (0xFFFF, 0x00FD, '00FD', 'EXIT'),
+    (0xFFFF, 0x00FE, '00FE', 'LOW'),
+    (0xFFFF, 0x00FF, '00FF', 'HIGH'),
+    (0xF000, 0x0000, '0nnn', 'SYS 0x{nnn:03X}'),
+    (0xF000, 0x1000, '1nnn', 'JP 0x{nnn:03X}'),
+    (0xF000, 0x2000, '2nnn', 'CALL 0x{nnn:03X}'),
+    (0xF000, 0x3000, '3xkk', 'SE V{x:X}, 0x{kk:02X}'),
+    (0xF000, 0x4000, '4xkk', 'SNE V{x:X}, 0x{kk:02X}'),
+    (0xF00F, 0x5000, '5xy0', 'SE V{x:X}, V{y:X}'),
+    (0xF000, 0x6000, '6xkk', 'LD V{x:X}, 0x{kk:02X}'),
+    (0xF000, 0x7000, '7xkk', 'ADD V{x:X}, 0x{kk:02X}'),
+    (0xF00F, 0x8000, '8xy0', 'LD V{x:X}, V{y:X}'),
+    (0xF00F, 0x8001, '8xy1', 'OR V{x:X}, V{y:X}'),
+    (0xF00F, 0x8002, '8xy2', 'AND V{x:X}, V{y:X}'),
+    (0xF00F, 0x8003, '8xy3', 'XOR V{x:X}, V{y:X}'),
+    (0xF00F, 0x8004, '8xy4', 'ADD V{x:X}, V{y:X}'),
+    (0xF00F, 0x8005, '8xy5', 'SUB V{x:X}, V{y:X}'),
+    (0xF00F, 0x8006, '8xy6', 'SHR V{x:X}'),
+    (0xF00F, 0x8007, '8xy7', 'SUBN V{x:X}, V{y:X}'),
+    (0xF00F, 0x800E, '8xyE', 'SHL V{x:X}'),
+    (0xF00F, 0x9000, '9xy0', 'SNE V{x:X}, V{y:X}'),
+    (0xF000, 0xA000, 'Annn', 'LD I, 0x{nnn:03X}'),
+    (0xF000, 0xB000, 'Bnnn', 'JP V0, 0x{nnn:03X}'),
+    (0xF000, 0xC000, 'Cxkk', 'RND V{x:X}, 0x{kk:02X}'),
+    (0xF00F, 0xD000, 'Dxy0', 'DRW V{x:X}, V{y:X}, 0'),
+    (0xF000, 0xD000, 'Dxyn', 'DRW V{x:X}, V{y:X}, {n}'),
+    # Swapped from the usual SKP/SKNP: this interpreter skips on Ex9E when the key is up, on ExA1 when it is down
+    (0xF0FF, 0xE09E, 'Ex9E', 'SKNP V{x:X}'),
+    (0xF0FF, 0xE0A1, 'ExA1', 'SKP V{x:X}'),
+    (0xF0FF, 0xF007, 'Fx07', 'LD V{x:X}, DT'),
+    (0xF0FF, 0xF00A, 'Fx0A', 'LD V{x:X}, K'),
+    (0xF0FF, 0xF015, 'Fx15', 'LD DT, V{x:X}'),
+    (0xF0FF, 0xF018, 'Fx18', 'LD ST, V{x:X}'),
+    (0xF0FF, 0xF01E, 'Fx1E', 'ADD I, V{x:X}'),
+    (0xF0FF, 0xF029, 'Fx29', 'LD F, V{x:X}'),
+    (0xF0FF, 0xF030, 'Fx30', 'LD HF, V{x:X}'),
+    (0xF0FF, 0xF033, 'Fx33', 'LD B, V{x:X}'),
+    (0xF0FF, 0xF055, 'Fx55', 'LD [I], V{x:X}'),
+    (0xF0FF, 0xF065, 'Fx65', 'LD V{x:X}, [I]'),
+    (0xF0FF, 0xF075, 'Fx75', 'LD R, V{x:X}'),
+    (0xF0FF, 0xF085, 'Fx85', 'LD V{x:X}, R')
+]
+
+def lookup(operand):
+    '''
+    The (pattern, mnemonic) entry for operand, None for undefined instructions.
+    '''
+    for mask, value, pattern, mnemonic in INSTRUCTIONS:
+        if operand & mask == value:
+            return pattern, mnemonic
+
+    return None
+
+def pattern(operand):
+    '''
+    The instruction pattern operand belongs to (e.g. 8xy4), or the operand itself in hex if it is undefined.
+    '''
+    entry = lookup(operand)
+
+    return entry[0] if entry else '{:04X}'.format(operand)
+
+def disassemble(operand):
+    '''
+    Mnemonic for a single 2 byte operand, e.g. 0x8124 -> ADD V1, V2. Undefined operands become DW 0xXXXX.
+    '''
+    entry = lookup(operand)
+    if entry is None:
+        return 'DW 0x{:04X}'.format(operand)
+
+    return entry[1].format(
+        x   = (operand & 0x0F00) >> 8,
+        y   = (operand & 0x00F0) >> 4,
+        n   = operand & 0x000F,
+        kk  = operand & 0x00FF,
+        nnn = operand & 0x0FFF
+    )
+
+def disassemble_memory(memory, start=PROGRAM_COUNTER_START, end=None):
+    '''
+    Yield (address, operand, mnemonic) for every 2 byte word of memory[start:end].
+
+    This is a linear sweep, data in between instructions is disassembled as if it were code.
+    '''
+    end = min(end if end is not None else len(memory), MAX_MEM0RY) - 1
+
+    for address in range(start, end, 2):
+        operand = (memory[address] << 8) | memory[address + 1]
+        yield address, operand, disassemble(operand)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Disassemble a CHIP-8 ROM.')
+    parser.add_argument('filepath', metavar='F', type=str, help='path to the CHIP-8 ROM')
+    args = parser.parse_args(argv)
+
+    with open(args.filepath, 'rb') as rom:
+        memory = bytearray(PROGRAM_COUNTER_START) + rom.read()
+
+    for address, operand, mnemonic in disassemble_memory(memory):
+        print('{:03X}  {:04X}  {}'.format(address, operand, mnemonic))
+
+if __name__ == '__main__':
+    sys.exit(main())
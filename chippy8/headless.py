@@ -0,0 +1,32 @@
+from chippy8.cpu import CPU
+from chippy8.scheduler import Scheduler
+from chippy8.screen import NullScreen
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.config import FONT_FILE, INSTRUCTIONS_PER_FRAME
+
+def create_headless(filepath, keyboard=None, seed=None):
+    '''
+    Create a CPU with a null screen and scripted keyboard, with the font and the ROM at filepath loaded.
+
+    Nothing touches the terminal or the host keyboard, so this works without a display.
+    With a seed and the same script, every run is identical.
+    '''
+    keyboard = keyboard if keyboard is not None else ScriptedKeyboard()
+    chippy   = CPU(NullScreen(), keyboard, seed)
+
+    chippy.load_rom(FONT_FILE, 0)
+    chippy.load_rom(filepath)
+
+    return chippy
+
+def run_headless(chippy, max_cycles=None, instructions_per_frame=INSTRUCTIONS_PER_FRAME):
+    '''
+    Run max_cycles instructions (forever if None, or until the ROM exits) as fast as possible, feeding scripted
+    input as the cycles pass.
+
+    Timers still tick once per emulated frame of instructions_per_frame instructions.
+    '''
+    scheduler = Scheduler(chippy, instructions_per_frame, turbo=True)
+    scheduler.run(max_cycles)
+
+    return scheduler
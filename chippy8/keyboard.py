@@ -1,31 +1,184 @@
-from chippy8.config import KEY_MAPPING
-from pynput.keyboard import Listener
+import threading
+from chippy8.config import KEY_MAPPING, REWIND_KEY
+
+# Host character to CHIP-8 key value
+KEY_VALUES = {char: value for value, char in KEY_MAPPING.items()}
+
+def key_value(key):
+    '''
+    CHIP-8 key value of a pynput key, -1 for unmapped keys.
+    '''
+    try:
+        return KEY_VALUES[key.char.lower()]
+    except (AttributeError, KeyError):
+        return -1
+
+def save_script(filename, events, settings=None):
+    '''
+    Write (cycle, key value, pressed) events in the format read by ScriptedKeyboard.load.
+
+    settings are written first as "<name> <value>" lines (e.g. the seed a recording was made with).
+    '''
+    with open(filename, 'w') as script:
+        for name, value in (settings or {}).items():
+            script.write('{} {}\n'.format(name, value))
+
+        for cycle, value, pressed in events:
+            script.write('{} {:x} {}\n'.format(cycle, value, 'down' if pressed else 'up'))
+
+def lowest_key(pressed):
+    '''
+    Lowest key value set in a pressed bitmask, -1 when no key is down.
+    '''
+    return (pressed & -pressed).bit_length() - 1
 
 class Keyboard:
+    '''
+    Interactive keyboard, listens to the host keyboard through pynput.
+
+    The state of all 16 keys is a bitmask (bit n set while key n is down). Host key presses arrive
+    on the listener thread at any time, the CPU only sees them once the run loop calls advance.
+    Every change is therefore tied to a cycle count, and recorded as (cycle, key value, pressed)
+    events in the ScriptedKeyboard format for replaying.
+    '''
+
+    realtime = True # Keys arrive in wall-clock time, so waiting for one blocks
+
     def __init__(self):
-        self.current_key = None
+        self.host_pressed = 0     # Held on the host keyboard
+        self.pressed      = 0     # Seen by the CPU
+        self.rewinding    = False # Rewind key held
+        self.recording    = []
+        self.changed      = threading.Condition()
         self.start_listening()
 
     def start_listening(self):
-        self.listener = Listener(
-            on_press   = self.on_press, 
+        # pynput needs a display server, so it is only imported once a real keyboard is used
+        from pynput.keyboard import Key, Listener
+
+        self.rewind_key = getattr(Key, REWIND_KEY)
+        self.listener   = Listener(
+            on_press   = self.on_press,
             on_release = self.on_release
         )
         self.listener.start()
 
     def on_press(self, key):
-        self.current_key = key
+        with self.changed:
+            if key == self.rewind_key:
+                self.rewinding = True
+            else:
+                value = key_value(key)
+                if value != -1:
+                    self.host_pressed |= 1 << value
+
+            self.changed.notify_all()
+
+    def on_release(self, key):
+        with self.changed:
+            if key == self.rewind_key:
+                self.rewinding = False
+            else:
+                value = key_value(key)
+                if value != -1:
+                    self.host_pressed &= ~(1 << value)
+
+            self.changed.notify_all()
+
+    def wait_for_key(self, timeout):
+        '''
+        Block until a key (or the rewind key) is down, for at most timeout seconds. Returns whether one is.
+        '''
+        with self.changed:
+            return self.changed.wait_for(lambda: self.host_pressed or self.rewinding, timeout)
+
+    def advance(self, cycle):
+        '''
+        Hand the host key state to the CPU and record the changes at cycle.
+        '''
+        host_pressed = self.host_pressed
+        changed      = host_pressed ^ self.pressed
+
+        while changed:
+            value    = lowest_key(changed)
+            changed &= changed - 1
+            self.recording.append((cycle, value, bool(host_pressed >> value & 1)))
+
+        self.pressed = host_pressed
 
-    def on_release(self, _key):
-        self.current_key = None
+    def next_event(self):
+        return None
 
     def is_pressed(self, value):
-        return self.mapped_key_value() == value
+        return self.pressed >> value & 1
 
     def mapped_key_value(self):
-        try:
-            key_code = self.current_key.value.vk
+        return lowest_key(self.pressed)
 
-            return KEY_MAPPING[key_code].value.vk
-        except (AttributeError, KeyError):
-            return -1
\ No newline at end of file
+class ScriptedKeyboard:
+    '''
+    Keyboard fed from a script instead of the host keyboard, for headless runs.
+
+    The script is a list of (cycle, key value, pressed) events. The run loop calls advance
+    with the current cycle count, which applies every event scheduled up to that cycle.
+    '''
+
+    realtime = False # Keys arrive by cycle count, waiting in wall-clock time never brings one
+
+    def __init__(self, events=(), settings=None):
+        self.events    = sorted(events)
+        self.settings  = settings or {}
+        self.position  = 0
+        self.pressed   = 0     # Bitmask, bit n set while key n is down
+        self.rewinding = False # Scripts never rewind
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load a script with one "<cycle> <key> <down|up>" event per line, the key in hex. # starts a comment.
+
+        Lines of the form "<name> <value>" are settings stored with recordings (seed, ipf, cycles).
+        '''
+        events   = []
+        settings = {}
+
+        with open(filename) as script:
+            for line in script:
+                fields = line.split('#')[0].split()
+                if not fields:
+                    continue
+
+                if len(fields) == 2:
+                    name, value    = fields
+                    settings[name] = int(value)
+                    continue
+
+                cycle, key, state = fields
+                events.append((int(cycle), int(key, 16), state.lower() == 'down'))
+
+        return cls(events, settings)
+
+    def advance(self, cycle):
+        while self.position < len(self.events) and self.events[self.position][0] <= cycle:
+            _, value, pressed = self.events[self.position]
+            self.position += 1
+
+            if pressed:
+                self.pressed |= 1 << value
+            else:
+                self.pressed &= ~(1 << value)
+
+    def next_event(self):
+        '''
+        Cycle of the next scheduled event, None once the script is exhausted.
+        '''
+        if self.position < len(self.events):
+            return self.events[self.position][0]
+
+        return None
+
+    def is_pressed(self, value):
+        return self.pressed >> value & 1
+
+    def mapped_key_value(self):
+        return lowest_key(self.pressed)
@@ -0,0 +1,51 @@
+import threading
+from time import monotonic
+from chippy8.config import REFRESH_RATE
+
+class Presenter(threading.Thread):
+    '''
+    Presents the screen to the terminal from its own thread at a fixed refresh rate.
+
+    Every tick takes a snapshot of the pixel buffer (the CPU keeps drawing into the back buffer)
+    and renders it. Draws made between two ticks are coalesced into one frame, ticks with nothing
+    new to show are skipped, and ticks missed while the terminal was busy are dropped rather than
+    replayed, so the presenter never falls further behind than a single frame.
+    '''
+
+    def __init__(self, screen, refresh_rate=REFRESH_RATE):
+        super().__init__(name='chippy8-presenter', daemon=True)
+
+        self.screen   = screen
+        self.interval = 1.0 / refresh_rate
+        self.stopped  = threading.Event()
+
+        self.presented = 0 # Frames written to the terminal
+        self.skipped   = 0 # Ticks dropped because presenting took longer than the interval
+
+    def run(self):
+        version    = None
+        next_frame = monotonic()
+
+        while not self.stopped.is_set():
+            if self.screen.version != version:
+                version = self.screen.version
+                self.screen.update(self.screen.snapshot())
+                self.presented += 1
+
+            next_frame += self.interval
+            now         = monotonic()
+
+            if now > next_frame:
+                missed        = int((now - next_frame) / self.interval) + 1
+                next_frame   += missed * self.interval
+                self.skipped += missed
+
+            self.stopped.wait(next_frame - now)
+
+    def stop(self):
+        '''
+        Stop presenting and draw the final frame.
+        '''
+        self.stopped.set()
+        self.join()
+        self.screen.update()
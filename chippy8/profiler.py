@@ -0,0 +1,264 @@
+'''
+Instrumentation for the interpreter: executions per opcode, hot program counters and where the wall time goes.
+
+Profiling costs nothing while it is off. Enabling it swaps counting wrappers into the CPU's operation
+lookups and timing wrappers over the CPU, screen and scheduler methods, disabling it puts the originals back.
+'''
+import json
+from collections import Counter
+from inspect import iscoroutinefunction
+from time import perf_counter
+
+from chippy8.cpu import IDLE_LOOP_LENGTH
+from chippy8.disassembler import disassemble, pattern
+
+# CPU tables whose handlers are wrapped while profiling
+LOOKUP_TABLES = (
+    'OPERATION_LOOKUP',
+    'SYSTEM_OPERATION_LOOKUP',
+    'LOGICAL_OPERATION_LOOKUP',
+    'KEYBOARD_OPERATION_LOOKUP',
+    'UTILITY_OPERATION_LOOKUP'
+)
+
+# json, collapsed stacks of executions, collapsed stacks of microseconds per phase
+REPORT_FORMATS = ('json', 'collapsed', 'collapsed-time')
+
+# Wall time split: execute (excluding draw), draw (Dxyn), present (Screen.update) and sleep (Scheduler.sleep)
+PHASES = ('execute', 'draw', 'present', 'sleep')
+
+class Profiler:
+    '''
+    Profiles a CPU, and optionally the scheduler running it.
+
+    Executions are counted per (pc, operand) pair, opcode counts and the PC heatmap are both derived
+    from that when reporting. Compiled blocks inline most instructions, so an attached compiler is
+    set aside while profiling and everything runs through the interpreter.
+    '''
+
+    def __init__(self, cpu, scheduler=None):
+        self.cpu       = cpu
+        self.scheduler = scheduler
+        self.enabled   = False
+
+        self.executions = Counter()                  # (pc, operand) -> executions
+        self.times      = dict.fromkeys(PHASES, 0.0) # phase -> seconds, execute includes draw until reported
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *_exception):
+        self.disable()
+
+    def enable(self):
+        '''
+        Swap in the instrumented lookups and timing wrappers.
+        '''
+        if self.enabled:
+            return
+
+        cpu = self.cpu
+
+        self.tables = {name: getattr(cpu, name) for name in LOOKUP_TABLES}
+        for name, table in self.tables.items():
+            setattr(cpu, name, {key: self.counted(handler) for key, handler in table.items()})
+
+        cpu.OPERATION_LOOKUP[0xD] = self.timed('draw', cpu.OPERATION_LOOKUP[0xD])
+
+        # Instance attributes shadow the methods until they are deleted again
+        cpu.idle_jump        = self.counted(cpu.idle_jump)
+        cpu.system_opcode_Cn = self.counted(cpu.system_opcode_Cn)
+        cpu.skip_idle        = self.skip_counted(cpu.skip_idle)
+        cpu.execute_cycles   = self.timed('execute', cpu.execute_cycles)
+        cpu.screen.update    = self.timed('present', cpu.screen.update)
+        if self.scheduler is not None:
+            self.scheduler.sleep = self.timed('sleep', self.scheduler.sleep)
+
+        # Cached decodes still point at the plain handlers
+        self.compiler, cpu.compiler = cpu.compiler, None
+        cpu.invalidate()
+
+        self.enabled = True
+
+    def disable(self):
+        '''
+        Put the original lookups and methods back. The statistics are kept.
+        '''
+        if not self.enabled:
+            return
+
+        cpu = self.cpu
+
+        for name, table in self.tables.items():
+            setattr(cpu, name, table)
+
+        del cpu.idle_jump
+        del cpu.system_opcode_Cn
+        del cpu.skip_idle
+        del cpu.execute_cycles
+        del cpu.screen.update
+        if self.scheduler is not None:
+            del self.scheduler.sleep
+
+        cpu.compiler = self.compiler
+        cpu.invalidate()
+
+        self.enabled = False
+
+    def reset(self):
+        '''
+        Clear the statistics. They are cleared in place, the installed wrappers keep counting into them.
+        '''
+        self.executions.clear()
+        for phase in PHASES:
+            self.times[phase] = 0.0
+
+    def counted(self, handler):
+        '''
+        Wrap an operation handler to count its executions. The CPU has already moved pc past the instruction.
+        '''
+        cpu        = self.cpu
+        executions = self.executions
+
+        def counted(*arguments):
+            executions[cpu.state.pc - 2, cpu.operand] += 1
+            return handler(*arguments)
+
+        return counted
+
+    def skip_counted(self, skip_idle):
+        '''
+        Wrap CPU.skip_idle to count the idle loop iterations it fast-forwards as executions of the loop instructions.
+        '''
+        cpu        = self.cpu
+        executions = self.executions
+
+        def skip_counted(count):
+            iterations = count // IDLE_LOOP_LENGTH
+            start      = cpu.state.pc
+
+            if iterations:
+                for address in range(start, start + IDLE_LOOP_LENGTH * 2, 2):
+                    executions[address, (cpu.memory[address] << 8) | cpu.memory[address + 1]] += iterations
+
+            return skip_idle(count)
+
+        return skip_counted
+
+    def timed(self, phase, function):
+        '''
+        Wrap function to add the time spent in it to phase.
+        '''
+        times = self.times
+
+        # Coroutines (chippy8.aio) are timed from the first step until they finish
+        if iscoroutinefunction(function):
+            async def timed(*arguments):
+                start = perf_counter()
+                try:
+                    return await function(*arguments)
+                finally:
+                    times[phase] += perf_counter() - start
+
+            return timed
+
+        def timed(*arguments):
+            start = perf_counter()
+            try:
+                return function(*arguments)
+            finally:
+                times[phase] += perf_counter() - start
+
+        return timed
+
+    def opcode_counts(self):
+        '''
+        Executions per opcode family (first hex digit) and per instruction pattern within it.
+        '''
+        families = {}
+
+        for (_pc, operand), count in self.executions.items():
+            family = families.setdefault('{:X}'.format(operand >> 12), {'count': 0, 'patterns': Counter()})
+            family['count'] += count
+            family['patterns'][pattern(operand)] += count
+
+        return families
+
+    def hot_pcs(self, top=20, labels=True):
+        '''
+        The top most executed addresses as (pc, executions, mnemonic) tuples, mnemonic is None without labels.
+
+        An address executing more than one operand (self-modifying code) is labelled with the most frequent one.
+        '''
+        pcs      = Counter()
+        operands = {}
+
+        for (pc, operand), count in self.executions.items():
+            pcs[pc] += count
+            if count > operands.get(pc, (0, None))[0]:
+                operands[pc] = (count, operand)
+
+        return [
+            (pc, count, disassemble(operands[pc][1]) if labels else None)
+            for pc, count in pcs.most_common(top)
+        ]
+
+    def time_split(self):
+        '''
+        Seconds spent per phase, execute excluding the time spent drawing.
+        '''
+        split = dict(self.times)
+        split['execute'] = max(split['execute'] - split['draw'], 0.0)
+
+        return split
+
+    def report(self, top=20, labels=True):
+        '''
+        Everything collected, as a JSON serializable dict.
+        '''
+        families = self.opcode_counts()
+
+        return {
+            'instructions': sum(self.executions.values()),
+            'opcodes': {
+                family: {'count': entry['count'], 'patterns': dict(entry['patterns'].most_common())}
+                for family, entry in sorted(families.items())
+            },
+            'hot_pcs': [
+                {'pc': '0x{:03X}'.format(pc), 'count': count, 'instruction': mnemonic}
+                for pc, count, mnemonic in self.hot_pcs(top, labels)
+            ],
+            'time': self.time_split()
+        }
+
+    def collapsed(self, metric='count'):
+        '''
+        Collapsed stack lines as read by flame graph tools.
+
+        metric 'count' gives opcode family;pattern;address executions, 'time' gives microseconds per phase.
+        '''
+        if metric == 'time':
+            split = self.time_split()
+            return [
+                '{} {}'.format('execute;draw' if phase == 'draw' else phase, round(seconds * 1e6))
+                for phase, seconds in split.items()
+            ]
+
+        return [
+            '{:X};{};0x{:03X} {} {}'.format(operand >> 12, pattern(operand), pc, disassemble(operand), count)
+            for (pc, operand), count in sorted(self.executions.items())
+        ]
+
+    def write(self, output, report_format='json'):
+        '''
+        Write the report to output in one of REPORT_FORMATS.
+        '''
+        if report_format == 'json':
+            json.dump(self.report(), output, indent=2)
+            output.write('\n')
+            return
+
+        metric = 'time' if report_format == 'collapsed-time' else 'count'
+        for line in self.collapsed(metric):
+            output.write(line + '\n')
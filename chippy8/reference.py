@@ -0,0 +1,269 @@
+'''
+A self-contained CHIP-8 and SUPER-CHIP interpreter, the reference chippy8.difftest checks the engines against.
+
+It shares no code with CPU or Screen. Every instruction is read from memory and decoded by a single
+chain of comparisons each time it runs, registers are plain lists and the framebuffer holds one int
+per pixel, drawn a pixel at a time. Only the ROM, the seed and the keys held down come from outside,
+so a bug in the CPU's handlers, its decode cache, the block compiler or Screen's bit packing shows up
+as a divergence instead of being shared by both sides.
+
+Semantics follow the interpreter, quirks included: Bnnn jumps to V0 + nnn past the next instruction,
+8xy6/8xyE shift Vx, Fx55/Fx65 leave I alone, 00FB/00FC scroll 4 pixels at either resolution, and
+Ex9E skips when the key is up, ExA1 when it is down.
+'''
+from random import Random
+
+from chippy8.config import (
+    HIRES_SIZE,
+    LARGE_FONT_START,
+    LORES_SIZE,
+    MAX_MEM0RY,
+    PROGRAM_COUNTER_START,
+    REGISTER_COUNT,
+    STACK_DEPTH
+)
+
+class ReferenceCPU:
+    '''
+    The reference machine. keyboard only has to provide pressed, the bitmask of the keys held down.
+
+    Errors a CPU raises are raised here too, at the same instruction: IndexError for the stack and
+    memory past its end, KeyError for an undefined instruction.
+    '''
+
+    def __init__(self, keyboard, seed=None):
+        self.keyboard = keyboard
+        self.random   = Random(seed) # Drawn from exactly as CPU does, one randint per Cxkk
+
+        self.memory = bytearray(MAX_MEM0RY)
+        self.v      = [0] * REGISTER_COUNT
+        self.stack  = [0] * STACK_DEPTH
+        self.rpl    = [0] * REGISTER_COUNT
+        self.pc     = PROGRAM_COUNTER_START
+        self.i      = 0
+        self.sp     = 0
+        self.delay  = 0
+        self.sound  = 0
+        self.exited = False
+
+        self.set_resolution(*LORES_SIZE)
+
+    def load(self, data, offset=PROGRAM_COUNTER_START):
+        if offset + len(data) > MAX_MEM0RY:
+            raise ValueError('{} bytes do not fit in memory at 0x{:03X}'.format(len(data), offset))
+
+        self.memory[offset:offset + len(data)] = data
+
+    def set_resolution(self, width, height):
+        self.width  = width
+        self.height = height
+        self.pixels = [[0] * width for _ in range(height)]
+
+    def frame(self):
+        '''
+        The framebuffer packed as Screen.to_bytes packs it, one bit per pixel, row by row.
+        '''
+        row_size = (self.width + 7) // 8
+        packed   = bytearray()
+
+        for row in self.pixels:
+            value = 0
+            for pixel in row:
+                value = value << 1 | pixel
+            packed += value.to_bytes(row_size, 'big')
+
+        return bytes(packed)
+
+    def decrement_timers(self):
+        self.delay = max(self.delay - 1, 0)
+        self.sound = max(self.sound - 1, 0)
+
+    def execute_cycles(self, count):
+        for _ in range(count):
+            self.step()
+
+    def draw(self, rows, sprite_width, x, y):
+        '''
+        XOR rows (ints sprite_width bits wide) onto the framebuffer at (x, y), wrapping around both
+        edges. Returns 1 if a lit pixel was switched off.
+        '''
+        collision = 0
+
+        for row_offset, row in enumerate(rows):
+            pixel_row = self.pixels[(y + row_offset) % self.height]
+
+            for column in range(sprite_width):
+                if row >> (sprite_width - 1 - column) & 1:
+                    column_x  = (x + column) % self.width
+                    collision = collision or pixel_row[column_x]
+                    pixel_row[column_x] ^= 1
+
+        return collision
+
+    def step(self):
+        '''
+        Execute the instruction at pc.
+        '''
+        memory  = self.memory
+        v       = self.v
+        operand = memory[self.pc] << 8 | memory[self.pc + 1]
+        x       = operand >> 8 & 0xF
+        y       = operand >> 4 & 0xF
+        n       = operand & 0xF
+        kk      = operand & 0xFF
+        nnn     = operand & 0xFFF
+
+        self.pc += 2
+
+        if operand == 0x00E0:
+            self.set_resolution(self.width, self.height)
+        elif operand == 0x00EE:
+            if self.sp == 0:
+                raise IndexError('Stack underflow')
+            self.sp -= 1
+            self.pc  = self.stack[self.sp]
+        elif operand & 0xFFF0 == 0x00C0:
+            rows        = min(n, self.height)
+            self.pixels = [[0] * self.width for _ in range(rows)] + self.pixels[:self.height - rows]
+        elif operand == 0x00FB:
+            self.pixels = [[0] * 4 + row[:-4] for row in self.pixels]
+        elif operand == 0x00FC:
+            self.pixels = [row[4:] + [0] * 4 for row in self.pixels]
+        elif operand == 0x00FD:
+            self.pc    -= 2
+            self.exited = True
+        elif operand == 0x00FE:
+            self.set_resolution(*LORES_SIZE)
+        elif operand == 0x00FF:
+            self.set_resolution(*HIRES_SIZE)
+        elif operand >> 12 == 0x0:
+            pass # 0nnn, machine code routines are ignored
+        elif operand >> 12 == 0x1:
+            self.pc = nnn
+        elif operand >> 12 == 0x2:
+            if self.sp == STACK_DEPTH:
+                raise IndexError('Stack overflow')
+            self.stack[self.sp] = self.pc
+            self.sp += 1
+            self.pc  = nnn
+        elif operand >> 12 == 0x3:
+            if v[x] == kk:
+                self.pc += 2
+        elif operand >> 12 == 0x4:
+            if v[x] != kk:
+                self.pc += 2
+        elif operand >> 12 == 0x5:
+            if v[x] == v[y]:
+                self.pc += 2
+        elif operand >> 12 == 0x6:
+            v[x] = kk
+        elif operand >> 12 == 0x7:
+            v[x] = (v[x] + kk) & 0xFF
+        elif operand >> 12 == 0x8:
+            self.arithmetic(n, x, y)
+        elif operand >> 12 == 0x9:
+            if v[x] != v[y]:
+                self.pc += 2
+        elif operand >> 12 == 0xA:
+            self.i = nnn
+        elif operand >> 12 == 0xB:
+            self.pc += nnn + v[0]
+        elif operand >> 12 == 0xC:
+            v[x] = kk & self.random.randint(0x00, 0xFF)
+        elif operand >> 12 == 0xD:
+            if n == 0:
+                data  = memory[self.i:self.i + 32]
+                rows  = [data[offset] << 8 | data[offset + 1] for offset in range(0, len(data) - 1, 2)]
+                width = 16
+            else:
+                rows  = memory[self.i:self.i + n]
+                width = 8
+            v[0xF] = self.draw(rows, width, v[x] % self.width, v[y])
+        elif operand & 0xF0FF == 0xE09E:
+            if not self.keyboard.pressed >> v[x] & 1:
+                self.pc += 2
+        elif operand & 0xF0FF == 0xE0A1:
+            if self.keyboard.pressed >> v[x] & 1:
+                self.pc += 2
+        elif operand >> 12 == 0xF:
+            self.utility(kk, x)
+        else:
+            raise KeyError(operand)
+
+    def arithmetic(self, n, x, y):
+        '''
+        8xyN. Where both are written, VF comes before Vx except for 8xyE, which matters when x is F.
+        '''
+        v = self.v
+
+        if n == 0x0:
+            v[x] = v[y]
+        elif n == 0x1:
+            v[x] |= v[y]
+        elif n == 0x2:
+            v[x] &= v[y]
+        elif n == 0x3:
+            v[x] ^= v[y]
+        elif n == 0x4:
+            total  = v[x] + v[y]
+            v[0xF] = 1 if total > 0xFF else 0
+            v[x]   = total & 0xFF
+        elif n == 0x5:
+            difference = v[x] - v[y]
+            v[0xF]     = 1 if difference >= 0 else 0
+            v[x]       = difference & 0xFF
+        elif n == 0x6:
+            value  = v[x]
+            v[0xF] = value & 1
+            v[x]   = value >> 1
+        elif n == 0x7:
+            difference = v[y] - v[x]
+            v[0xF]     = 1 if difference >= 0 else 0
+            v[x]       = difference & 0xFF
+        elif n == 0xE:
+            value  = v[x]
+            v[x]   = value << 1 & 0xFF
+            v[0xF] = value >> 7
+        else:
+            raise KeyError(0x8000 | x << 8 | y << 4 | n)
+
+    def utility(self, kk, x):
+        '''
+        FxKK
+        '''
+        v      = self.v
+        memory = self.memory
+
+        if kk == 0x07:
+            v[x] = self.delay
+        elif kk == 0x0A:
+            pressed = self.keyboard.pressed
+            if pressed:
+                v[x] = (pressed & -pressed).bit_length() - 1
+            else:
+                self.pc -= 2 # Wait, running this instruction again
+        elif kk == 0x15:
+            self.delay = v[x]
+        elif kk == 0x18:
+            self.sound = v[x]
+        elif kk == 0x1E:
+            self.i += v[x]
+        elif kk == 0x29:
+            self.i = (v[x] & 0xF) * 5
+        elif kk == 0x30:
+            self.i = LARGE_FONT_START + (v[x] & 0xF) * 10
+        elif kk == 0x33:
+            for offset, digit in enumerate((v[x] // 100, v[x] // 10 % 10, v[x] % 10)):
+                memory[self.i + offset] = digit
+        elif kk == 0x55:
+            for register in range(x + 1):
+                memory[self.i + register] = v[register]
+        elif kk == 0x65:
+            for register in range(x + 1):
+                v[register] = memory[self.i + register]
+        elif kk == 0x75:
+            self.rpl[:x + 1] = v[:x + 1]
+        elif kk == 0x85:
+            v[:x + 1] = self.rpl[:x + 1]
+        else:
+            raise KeyError(0xF000 | x << 8 | kk)
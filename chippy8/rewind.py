@@ -0,0 +1,133 @@
+import re
+import struct
+from chippy8.config import REWIND_KEYFRAME_INTERVAL, REWIND_MEMORY
+
+# Changed byte runs in an XOR of two states, bridging up to 3 unchanged bytes (cheaper than a new run header)
+CHANGED_RUN = re.compile(b'[^\\x00](?:\\x00{0,3}[^\\x00])*')
+
+# Each run in a delta is stored as (offset, length) followed by length XOR bytes
+RUN_HEADER = struct.Struct('<HH')
+
+def xor_bytes(a, b):
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+def encode_delta(previous, state):
+    '''
+    Run-length encode the bytes that differ between two equally sized states.
+    '''
+    difference = xor_bytes(previous, state)
+
+    return b''.join(
+        RUN_HEADER.pack(run.start(), run.end() - run.start()) + run.group()
+        for run in CHANGED_RUN.finditer(difference)
+    )
+
+def apply_delta(state, delta):
+    '''
+    Apply a delta made by encode_delta to a bytearray in place. XOR works both ways, so this also undoes it.
+    '''
+    position = 0
+
+    while position < len(delta):
+        start, length = RUN_HEADER.unpack_from(delta, position)
+        position     += RUN_HEADER.size
+
+        state[start:start + length] = xor_bytes(state[start:start + length], delta[position:position + length])
+        position += length
+
+class RewindBuffer:
+    '''
+    Ring buffer of per-frame CPU checkpoints, for stepping back in time.
+
+    Every keyframe_interval frames a full save state is kept, the frames in between only store the
+    run-length encoded XOR against the previous frame (a few dozen bytes for most CHIP-8 frames).
+    When the history grows past max_bytes, the oldest keyframe and its deltas are dropped together.
+    '''
+
+    def __init__(self, cpu, max_bytes=REWIND_MEMORY, keyframe_interval=REWIND_KEYFRAME_INTERVAL):
+        self.cpu               = cpu
+        self.max_bytes         = max_bytes
+        self.keyframe_interval = keyframe_interval
+
+        self.entries  = [] # (is keyframe, full state or delta), oldest first, always starting with a keyframe
+        self.size     = 0  # Bytes held by entries
+        self.previous = None
+        self.deltas   = 0  # Deltas recorded since the last keyframe
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self):
+        '''
+        Checkpoint the CPU, called once per emulated frame.
+        '''
+        state = self.cpu.save_state()
+
+        if (self.previous is None or len(state) != len(self.previous)
+                or self.deltas + 1 >= self.keyframe_interval):
+            entry       = (True, state)
+            self.deltas = 0
+        else:
+            entry        = (False, encode_delta(self.previous, state))
+            self.deltas += 1
+
+        self.entries.append(entry)
+        self.size    += len(entry[1])
+        self.previous = state
+
+        self.trim()
+
+    def trim(self):
+        '''
+        Drop the oldest keyframe groups until the history fits in max_bytes. The newest group is always kept.
+        '''
+        while self.size > self.max_bytes:
+            end = next((index for index in range(1, len(self.entries)) if self.entries[index][0]), None)
+            if end is None:
+                return
+
+            self.size -= sum(len(data) for _, data in self.entries[:end])
+            del self.entries[:end]
+
+    def keyframe_before(self, index):
+        '''
+        Index of the keyframe entry index is rebuilt from.
+        '''
+        while not self.entries[index][0]:
+            index -= 1
+
+        return index
+
+    def state_at(self, index):
+        '''
+        Rebuild the full save state of entry index, from the nearest keyframe before it.
+        '''
+        keyframe = self.keyframe_before(index)
+
+        state = bytearray(self.entries[keyframe][1])
+        for _, delta in self.entries[keyframe + 1:index + 1]:
+            apply_delta(state, delta)
+
+        return bytes(state)
+
+    def step_back(self, frames=1):
+        '''
+        Restore the CPU to the checkpoint frames before the latest one and forget everything after it.
+
+        Returns the number of frames actually stepped back, which is less when the history runs out.
+        '''
+        if not self.entries:
+            return 0
+
+        target = max(len(self.entries) - 1 - frames, 0)
+        state  = self.state_at(target)
+
+        self.size -= sum(len(data) for _, data in self.entries[target + 1:])
+        stepped    = len(self.entries) - 1 - target
+        del self.entries[target + 1:]
+
+        self.previous = state
+        self.deltas   = target - self.keyframe_before(target)
+        self.cpu.load_state(state)
+
+        return stepped
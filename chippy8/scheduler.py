@@ -0,0 +1,113 @@
+from time import monotonic, sleep
+from chippy8.config import FRAME_RATE, INSTRUCTIONS_PER_FRAME
+
+class Scheduler:
+    '''
+    Runs the CPU in emulated frames on a monotonic clock.
+
+    Each frame executes a fixed budget of instructions and ticks the timers once, so the timers
+    run at exactly frame_rate Hz of emulated time. In real time mode the scheduler sleeps once per
+    frame for whatever is left of it; when the host falls more than a frame behind, the schedule is
+    reset instead of bursting to catch up. Turbo mode never sleeps and runs frames back to back.
+
+    A ROM waiting in Fx0A cannot make progress before the key state changes, so instead of sleeping
+    (or, in turbo mode, spinning through frames) the scheduler blocks on the keyboard until a key
+    goes down or the frame is over.
+
+    With a rewind buffer attached every frame is checkpointed, and while the keyboard's rewind key is
+    held the frames step backwards through the history instead.
+    '''
+
+    def __init__(self, cpu, instructions_per_frame=INSTRUCTIONS_PER_FRAME, frame_rate=FRAME_RATE, turbo=False,
+                 rewind=None):
+        self.cpu                    = cpu
+        self.instructions_per_frame = instructions_per_frame
+        self.interval               = 1.0 / frame_rate
+        self.turbo                  = turbo
+        self.rewind                 = rewind
+
+        self.frames     = 0
+        self.next_frame = None # Monotonic time the next frame is due, set when running
+
+    def run_frame(self, budget=None):
+        '''
+        Execute one frame worth of instructions (or budget, for a partial frame) and tick the timers.
+
+        Scripted input is applied at the exact cycle it is scheduled for, so the budget is split at
+        pending key events.
+        '''
+        cpu      = self.cpu
+        keyboard = cpu.keyboard
+        budget   = budget if budget is not None else self.instructions_per_frame
+
+        cpu.waiting_for_key = False
+
+        while budget > 0:
+            keyboard.advance(cpu.cycles)
+            pending = keyboard.next_event()
+
+            count = budget if pending is None else min(budget, pending - cpu.cycles)
+            budget -= cpu.execute_cycles(count)
+
+        cpu.decrement_timers()
+        self.frames += 1
+
+        if self.rewind is not None:
+            self.rewind.record()
+
+    def run(self, max_cycles=None):
+        '''
+        Run frames until max_cycles instructions have executed, forever if None, or the ROM exits (00FD).
+        '''
+        self.next_frame = monotonic()
+
+        while (max_cycles is None or self.cpu.cycles < max_cycles) and not self.cpu.exited:
+            self.step(max_cycles)
+
+            delay = self.pace()
+            if delay > 0:
+                self.sleep(delay)
+
+    def step(self, max_cycles=None):
+        '''
+        Run one frame, cut short at max_cycles, or step one frame back while the rewind key is held.
+        '''
+        cpu    = self.cpu
+        budget = self.instructions_per_frame
+        if max_cycles is not None:
+            budget = min(budget, max_cycles - cpu.cycles)
+
+        if self.rewind is not None and cpu.keyboard.rewinding:
+            self.rewind.step_back(1)
+        else:
+            self.run_frame(budget)
+
+    def pace(self):
+        '''
+        Seconds to wait before the next frame, 0 to go straight on.
+        '''
+        cpu = self.cpu
+
+        if self.turbo:
+            if cpu.waiting_for_key and cpu.keyboard.realtime:
+                return self.interval
+            return 0
+
+        self.next_frame += self.interval
+        now              = monotonic()
+
+        if now < self.next_frame:
+            return self.next_frame - now
+        elif now - self.next_frame > self.interval:
+            self.next_frame = now
+
+        return 0
+
+    def sleep(self, seconds):
+        '''
+        Wait out the rest of the frame, returning early when a key is pressed for a ROM waiting on one.
+        '''
+        if self.cpu.waiting_for_key and self.cpu.keyboard.realtime:
+            self.cpu.keyboard.wait_for_key(seconds)
+        else:
+            sleep(seconds)
@@ -1,51 +1,445 @@
 import os
+import re
 import sys
+import threading
+from itertools import groupby
 from chippy8.config import PIXEL_COLORS
 
+# Unchanged cells between two changed runs are redrawn rather than skipped with a cursor move
+# when the gap is at most this wide, which is shorter than the escape sequence
+MERGE_GAP = 2
+
+# Runs of changed cells in a row diff string ('1' = changed), bridging gaps up to MERGE_GAP
+CHANGED_RUN = re.compile('1(?:0{{0,{}}}1)*'.format(MERGE_GAP))
+
 class Screen:
 
     def __init__(self, width=64, height=32, symbol="██"):
-        self.width  = width
-        self.height = height
         self.symbol = symbol
-        
-        self.blank_pixel_buffer()
 
-    def update(self):
-        output = "\033[H\n"                                                  # Move the cursor to the home position, add a little border
-        for pixel_row in self.pixels:
-            output += "  "                                                   # Add a bit of border in case cursor causes line to wrap
-            for pixel in pixel_row:
-                output += "\033[38;2;{};{};{}m".format(*PIXEL_COLORS[pixel]) # Set the cell to the pixel color
-                output += self.symbol                                        # Draw the pixel
-                output += "\033[37m"                                         # Reset the color
+        # Escape sequence setting the foreground to each pixel color
+        self.color_codes = {
+            pixel: "\033[38;2;{};{};{}m".format(*color) for pixel, color in PIXEL_COLORS.items()
+        }
+
+        # The frame as it was last written to the terminal, None forces a full redraw
+        self.presented = None
+
+        # Drawing happens on the CPU thread, presenting may happen on another (see chippy8.presenter).
+        # The lock guards the pixel buffer, version counts the changes made to it.
+        self.lock    = threading.Lock()
+        self.version = 0
+
+        self.set_resolution(width, height)
+
+    def set_resolution(self, width, height):
+        '''
+        Switch to a width x height pixel buffer (SUPER-CHIP 00FE/00FF), which starts out blank.
+        '''
+        with self.lock:
+            self.width  = width
+            self.height = height
+
+            # Each row of the pixel buffer is a single int, the leftmost pixel being the most significant bit
+            self.row_mask   = (1 << width) - 1
+            self.row_format = '0{}b'.format(width)
+
+            # Terminal columns and lines the frame takes up
+            self.columns = width * len(self.symbol)
+            self.lines   = height
+
+            self.blank_pixel_buffer()
+            self.version += 1
+
+    def update(self, frame=None):
+        '''
+        Draw the cells of frame that changed since the last update, frame defaults to a snapshot of the pixel buffer.
+
+        Changed cells are grouped into runs per row, each run costs one cursor move and one
+        color code per stretch of equal pixels. Everything is sent in a single write.
+        '''
+        if frame is None:
+            frame = self.snapshot()
+
+        # A snapshot taken before a resolution change, the next one has the new size
+        if len(frame) != self.height:
+            return
+
+        previous = self.presented
+        output   = []
+        color    = None
+
+        if previous is not None and len(previous) != len(frame):
+            output.append("\033[2J") # Wipe the frame drawn at the other resolution
+            previous = None
+
+        for y, pixel_row in enumerate(frame):
+            if previous is not None and previous[y] == pixel_row:
+                continue
+
+            cells = format(pixel_row, self.row_format)
+
+            for start, end in self.changed_runs(pixel_row, previous[y] if previous is not None else None):
+                # Rows start on the second line, cells after a 2 column border
+                output.append("\033[{};{}H".format(y + 2, start * len(self.symbol) + 3))
+
+                for cell, run in groupby(cells[start:end]):
+                    pixel = int(cell)
+                    if pixel != color:
+                        output.append(self.color_codes[pixel])
+                        color = pixel
+                    output.append(self.symbol * len(list(run)))
+
+        self.presented = frame
+
+        if not output:
+            return
+
+        output.append("\033[37m")                          # Reset the color
+        output.append("\033[{};1H".format(self.lines + 2)) # Park the cursor below the frame
+
+        sys.stdout.write("".join(output))
+        sys.stdout.flush()
+
+    def changed_runs(self, pixel_row, previous_row):
+        '''
+        Yield (start, end) column ranges of pixel_row that differ from previous_row.
+        '''
+        if previous_row is None:
+            yield 0, self.width
+            return
 
-            output += " \n"
+        for run in CHANGED_RUN.finditer(format(pixel_row ^ previous_row, self.row_format)):
+            yield run.span()
 
-        sys.stdout.write(output)
+    def snapshot(self):
+        '''
+        Copy of the pixel buffer, safe to render while the CPU keeps drawing.
+        '''
+        with self.lock:
+            return list(self.pixels)
 
-    def place_sprite(self, sprite, x, y):
+    def get_pixel(self, x, y):
+        return (self.pixels[y] >> (self.width - 1 - x)) & 0x1
+
+    def place_sprite(self, sprite, x, y, sprite_width=8):
+        '''
+        XOR sprite onto the pixel buffer at (x, y), wrapping around the edges of the screen.
+
+        sprite is a sequence of rows, each an int sprite_width bits wide (e.g. the bytes of a Dxyn sprite).
+        Every row is shifted into place and applied with a single XOR, its collision test is a single AND.
+        Returns 1 if any lit pixel was switched off, otherwise 0.
+
+        Does not redraw, the frame is presented separately.
+        '''
+        width     = self.width
+        x         = x % width
+        shift     = width - sprite_width - x
         collision = 0
 
-        for y_offset, pixel_row in enumerate(sprite):
-            for x_offset, pixel in enumerate(pixel_row):
-                abs_y = (y + y_offset) % self.height
-                abs_x = (x + x_offset) % self.width
+        with self.lock:
+            pixels = self.pixels
+
+            for y_offset, sprite_row in enumerate(sprite):
+                if shift >= 0:
+                    bits = sprite_row << shift
+                else:
+                    # Part of the sprite hangs off the right edge and wraps around to the left
+                    bits = ((sprite_row >> -shift) | (sprite_row << (width + shift))) & self.row_mask
+
+                abs_y   = (y + y_offset) % self.height
+                current = pixels[abs_y]
+
+                if current & bits:
+                    collision = 1
 
-                current_pixel = self.pixels[abs_y][abs_x]
-                self.pixels[abs_y][abs_x] = current_pixel ^ pixel
-                collision = current_pixel & pixel
+                pixels[abs_y] = current ^ bits
 
-        self.update()
+            self.version += 1
 
         return collision
 
     def clear_screen(self):
-        self.blank_pixel_buffer()
+        with self.lock:
+            self.blank_pixel_buffer()
+            self.version += 1
+
+    def scroll_down(self, count):
+        '''
+        Move every row down count rows, blank rows scroll in at the top (SUPER-CHIP 00Cn).
+        '''
+        count = min(count, self.height)
+
+        with self.lock:
+            self.pixels[count:] = self.pixels[:self.height - count]
+            self.pixels[:count] = [0] * count
+            self.version += 1
+
+    def scroll_right(self, count=4):
+        '''
+        Shift every row count pixels right, the pixels pushed off the edge are lost (SUPER-CHIP 00FB).
+        '''
+        with self.lock:
+            self.pixels = [pixel_row >> count for pixel_row in self.pixels]
+            self.version += 1
+
+    def scroll_left(self, count=4):
+        '''
+        Shift every row count pixels left, the pixels pushed off the edge are lost (SUPER-CHIP 00FC).
+        '''
+        row_mask = self.row_mask
+
+        with self.lock:
+            self.pixels = [(pixel_row << count) & row_mask for pixel_row in self.pixels]
+            self.version += 1
 
     def load_emulator_window(self):
         os.system('cls||clear')
-        os.system('mode con: cols={} lines={}'.format(self.width * 2 + 5, self.height + 3))
+        os.system('mode con: cols={} lines={}'.format(self.columns + 5, self.lines + 3))
+
+        # The terminal was wiped, everything has to be drawn again
+        self.presented = None
+
+    def to_bytes(self):
+        '''
+        Export the pixel buffer as packed bytes, one bit per pixel, row by row.
+        '''
+        row_size = (self.width + 7) // 8
+
+        with self.lock:
+            return b''.join(pixel_row.to_bytes(row_size, 'big') for pixel_row in self.pixels)
+
+    def from_bytes(self, data):
+        '''
+        Replace the pixel buffer with packed bytes as exported by to_bytes.
+        '''
+        row_size = (self.width + 7) // 8
+
+        with self.lock:
+            self.pixels = [
+                int.from_bytes(data[offset:offset + row_size], 'big')
+                for offset in range(0, self.height * row_size, row_size)
+            ]
+            self.version += 1
+
+    def dump(self, on='#', off='.'):
+        '''
+        Plain text rendering of the pixel buffer, one line per row.
+        '''
+        rows = self.snapshot()
+
+        return '\n'.join(
+            format(pixel_row, self.row_format).replace('1', on).replace('0', off) for pixel_row in rows
+        )
 
     def blank_pixel_buffer(self):
-        self.pixels = [[0 for _ in range(self.width)] for _ in range(self.height)]
\ No newline at end of file
+        self.pixels = [0] * self.height
+
+class NullScreen(Screen):
+    '''
+    Screen that keeps the pixel buffer but never touches the terminal, for headless runs.
+    '''
+
+    def update(self, frame=None):
+        pass
+
+    def load_emulator_window(self):
+        pass
+
+
+class PackedScreen(Screen):
+    '''
+    Screen packing cell_width by cell_height pixels into each terminal cell, see HalfBlockScreen and BrailleScreen.
+
+    The frame is diffed a line of cells at a time, and each run of changed cells is drawn by draw_cells.
+    With the default 1x1 cell every pixel is a single █, half the width of Screen's.
+    '''
+
+    cell_width  = 1
+    cell_height = 1
+
+    def __init__(self, width=64, height=32):
+        super().__init__(width, height, symbol=' ')
+
+    def set_resolution(self, width, height):
+        super().set_resolution(width, height)
+
+        self.cells   = -(-width // self.cell_width)
+        self.padding = self.cells * self.cell_width - width # Pixels padding the last cell of a row
+        self.columns = self.cells
+        self.lines   = -(-height // self.cell_height)
+
+    def update(self, frame=None):
+        '''
+        Draw the cells of frame that changed since the last update, frame defaults to a snapshot of the pixel buffer.
+
+        As with Screen.update, changed cells are grouped into runs with one cursor move each, color
+        codes are only sent when the color changes and everything is sent in a single write.
+        '''
+        if frame is None:
+            frame = self.snapshot()
+
+        if len(frame) != self.height:
+            return
+
+        previous = self.presented
+        output   = []
+        colors   = [None, None] # Foreground and background currently set
+
+        if previous is not None and len(previous) != len(frame):
+            output.append("\033[2J")
+            previous = None
+
+        for line in range(self.lines):
+            band = self.band(frame, line)
+
+            if previous is None:
+                difference = self.row_mask
+            else:
+                difference = 0
+                for pixel_row, previous_row in zip(band, self.band(previous, line)):
+                    difference |= pixel_row ^ previous_row
+
+                if not difference:
+                    continue
+
+            for start, end in self.cell_runs(difference):
+                output.append("\033[{};{}H".format(line + 2, start + 3))
+                self.draw_cells(output, band, start, end, colors)
+
+        self.presented = frame
+
+        if not output:
+            return
+
+        output.append("\033[0m")                           # Reset the colors
+        output.append("\033[{};1H".format(self.lines + 2)) # Park the cursor below the frame
+
+        sys.stdout.write("".join(output))
+        sys.stdout.flush()
+
+    def band(self, frame, line):
+        '''
+        The cell_height pixel rows drawn on terminal line, padded with blank rows past the bottom.
+        '''
+        top  = line * self.cell_height
+        band = list(frame[top:top + self.cell_height])
+
+        return band + [0] * (self.cell_height - len(band))
+
+    def cell_runs(self, difference):
+        '''
+        Yield (start, end) cell ranges covering the pixels set in difference.
+        '''
+        changed = format(difference << self.padding, '0{}b'.format(self.cells * self.cell_width))
+        if self.cell_width > 1:
+            changed = ''.join(
+                '1' if '1' in changed[x:x + self.cell_width] else '0' for x in range(0, len(changed), self.cell_width)
+            )
+
+        for run in CHANGED_RUN.finditer(changed):
+            yield run.span()
+
+    def draw_cells(self, output, band, start, end, colors):
+        '''
+        Append the cells start to end of a line to output, updating colors with the codes sent.
+
+        Subclasses with larger cells override it, here a cell is one pixel drawn in its color.
+        '''
+        pixel_row, = band
+
+        for x in range(start, end):
+            pixel = pixel_row >> (self.width - 1 - x) & 1
+
+            if pixel != colors[0]:
+                output.append(self.color_codes[pixel])
+                colors[0] = pixel
+            output.append('█')
+
+class HalfBlockScreen(PackedScreen):
+    '''
+    Screen drawing two pixel rows per terminal line, the upper pixel as the foreground of ▀ and the lower one as its background.
+
+    A cell is drawn as ▀, ▄, a full block or a space, whichever needs the fewest color changes.
+    '''
+
+    cell_height = 2
+
+    def __init__(self, width=64, height=32):
+        super().__init__(width, height)
+
+        # Escape sequence setting the background to each pixel color
+        self.background_codes = {
+            pixel: "\033[48;2;{};{};{}m".format(*color) for pixel, color in PIXEL_COLORS.items()
+        }
+
+    def draw_cells(self, output, band, start, end, colors):
+        upper_row, lower_row = band
+
+        for x in range(start, end):
+            shift = self.width - 1 - x
+            upper = upper_row >> shift & 1
+            lower = lower_row >> shift & 1
+
+            if upper == lower and upper == colors[1]:
+                output.append(' ')
+                continue
+            if upper == lower:
+                if upper != colors[0]:
+                    output.append(self.color_codes[upper])
+                    colors[0] = upper
+                output.append('█')
+                continue
+            if colors == [lower, upper]:
+                output.append('▄')
+                continue
+
+            if upper != colors[0]:
+                output.append(self.color_codes[upper])
+                colors[0] = upper
+            if lower != colors[1]:
+                output.append(self.background_codes[lower])
+                colors[1] = lower
+            output.append('▀')
+
+# Braille dot bits for the left and right pixel of each of the 4 rows in a cell
+BRAILLE_DOTS = ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80))
+
+# Dots set by a pair of pixels (left pixel the high bit) on each row
+BRAILLE_ROW_DOTS = tuple(
+    tuple((left if pair & 2 else 0) | (right if pair & 1 else 0) for pair in range(4)) for left, right in BRAILLE_DOTS
+)
+
+class BrailleScreen(PackedScreen):
+    '''
+    Monochrome screen drawing 2x4 pixels per terminal cell as a braille pattern, lit pixels as dots.
+
+    Only the foreground is colored, off pixels show the terminal's own background.
+    '''
+
+    cell_width  = 2
+    cell_height = 4
+
+    def draw_cells(self, output, band, start, end, colors):
+        if colors[0] != 1:
+            output.append(self.color_codes[1])
+            colors[0] = 1
+
+        rows  = [pixel_row << self.padding for pixel_row in band]
+        cells = []
+
+        for x in range(start, end):
+            shift = (self.cells - 1 - x) * 2
+            dots  = 0
+            for row_dots, pixel_row in zip(BRAILLE_ROW_DOTS, rows):
+                dots |= row_dots[pixel_row >> shift & 3]
+            cells.append(chr(0x2800 | dots))
+
+        output.append(''.join(cells))
+
+# Screen classes by the name of their rendering mode
+RENDERERS = {
+    'blocks':  Screen,
+    'half':    HalfBlockScreen,
+    'braille': BrailleScreen
+}
@@ -0,0 +1,69 @@
+from collections.abc import MutableMapping
+from chippy8.config import PROGRAM_COUNTER_START, REGISTER_COUNT, STACK_DEPTH
+
+class State:
+    '''
+    Registers, timers and call stack of a CPU.
+
+    V0 - VF are a bytearray, which rejects values outside 0x00 - 0xFF rather than wrapping them, so
+    arithmetic is still masked to 8 bits before it is stored. The stack is a fixed list of STACK_DEPTH
+    return addresses, sp counts the entries in use.
+    '''
+    __slots__ = ('pc', 'i', 'sp', 'v', 'stack', 'delay', 'sound')
+
+    def __init__(self):
+        self.pc    = PROGRAM_COUNTER_START
+        self.i     = 0
+        self.sp    = 0
+        self.v     = bytearray(REGISTER_COUNT)
+        self.stack = [0] * STACK_DEPTH
+        self.delay = 0
+        self.sound = 0
+
+    def copy(self):
+        state = State()
+
+        state.pc    = self.pc
+        state.i     = self.i
+        state.sp    = self.sp
+        state.v     = bytearray(self.v)
+        state.stack = list(self.stack)
+        state.delay = self.delay
+        state.sound = self.sound
+
+        return state
+
+class StateView(MutableMapping):
+    '''
+    Dict-style access to some State attributes, for code written against the old registers and timers dicts.
+
+    Assigning 'v' copies into the existing bytearray.
+    '''
+
+    def __init__(self, state, names):
+        self.state = state
+        self.names = names
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+
+        return getattr(self.state, name)
+
+    def __setitem__(self, name, value):
+        if name not in self.names:
+            raise KeyError(name)
+
+        if name == 'v':
+            self.state.v[:] = value
+        else:
+            setattr(self.state, name, value)
+
+    def __delitem__(self, name):
+        raise TypeError('CPU state fields cannot be removed')
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
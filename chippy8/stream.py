@@ -0,0 +1,312 @@
+'''
+Stream a session's frames over TCP to any number of viewers, and take their key presses back.
+
+    python chippy8.py roms/pong.ch8 --serve 8008
+    python -m chippy8.stream localhost 8008
+
+On connecting the server sends a hello (magic, protocol version, screen width and height), then one
+message per presented frame: a header (kind, frame number, payload length) followed by the payload.
+A keyframe carries the screen width and height followed by the whole frame packed one bit per pixel
+as Screen.to_bytes does, a delta carries the runs of bytes that changed since the previous frame,
+encoded as in chippy8.rewind. A change of resolution (SUPER-CHIP 00FE/00FF) is always sent as a
+keyframe. Viewers send two byte key events back, the key value and 1 for down or 0 for up.
+
+Each frame is encoded once and the same bytes are written to every viewer. A viewer that cannot keep
+up only ever has the latest frame waiting for it, older ones are dropped, and as its next delta would
+then be relative to a frame it never got, it is sent a keyframe instead.
+'''
+import argparse
+import asyncio
+import struct
+
+from chippy8.rewind import encode_delta, apply_delta
+from chippy8.screen import RENDERERS
+from chippy8.keyboard import key_value, lowest_key
+from chippy8.config import KEY_MAPPING, STREAM_BUFFER, STREAM_PORT
+
+STREAM_MAGIC   = b'CH8F'
+STREAM_VERSION = 2
+
+HELLO_HEADER = struct.Struct('<4sBHH') # magic, version, width, height
+FRAME_HEADER = struct.Struct('<BIH')   # kind, frame number, payload length
+RESOLUTION   = struct.Struct('<HH')    # width, height, at the start of a keyframe's payload
+KEY_EVENT    = struct.Struct('<BB')    # key value, pressed
+
+KEYFRAME = 0
+DELTA    = 1
+
+def pack_frame(frame, width):
+    '''
+    Pack a frame (one int per row) into bytes, as Screen.to_bytes does with the pixel buffer.
+    '''
+    row_size = (width + 7) // 8
+
+    return b''.join(pixel_row.to_bytes(row_size, 'big') for pixel_row in frame)
+
+def unpack_frame(data, width):
+    row_size = (width + 7) // 8
+
+    return [int.from_bytes(data[offset:offset + row_size], 'big') for offset in range(0, len(data), row_size)]
+
+class EncodedFrame:
+    '''
+    A frame encoded for sending: the keyframe message, and the delta message unless it is no smaller.
+
+    previous is the EncodedFrame published before, deltas are only made against one of the same size.
+    '''
+
+    def __init__(self, number, packed, width, height, previous=None):
+        self.number   = number
+        self.packed   = packed
+        self.size     = (width, height)
+        self.keyframe = (
+            FRAME_HEADER.pack(KEYFRAME, number, RESOLUTION.size + len(packed)) + RESOLUTION.pack(width, height) + packed
+        )
+        self.delta    = None
+
+        if previous is not None and previous.size == self.size:
+            delta = encode_delta(previous.packed, packed)
+            if len(delta) < len(packed):
+                self.delta = FRAME_HEADER.pack(DELTA, number, len(delta)) + delta
+
+class Viewer:
+    '''
+    A connected viewer, with the latest frame waiting to be written to it.
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader  = reader
+        self.writer  = writer
+        self.pending = None            # Latest frame not written yet
+        self.ready   = asyncio.Event() # Set while pending holds a frame
+        self.sent    = None            # Number of the last frame written
+        self.held    = 0               # Keys this viewer holds down, bitmask
+        self.handler = asyncio.current_task()
+
+        self.dropped = 0 # Frames replaced before they were written
+
+    def offer(self, frame):
+        if self.pending is not None:
+            self.dropped += 1
+
+        self.pending = frame
+        self.ready.set()
+
+    async def send_frames(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+
+            frame, self.pending = self.pending, None
+
+            if frame.delta is not None and self.sent == frame.number - 1:
+                self.writer.write(frame.delta)
+            else:
+                self.writer.write(frame.keyframe)
+            self.sent = frame.number
+
+            # Frames published while this waits replace each other in pending
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                return # The key reader sees the connection close and cleans up
+
+class FrameServer:
+    '''
+    Publishes the frames of a chippy8.aio Session to TCP viewers, whose keys go to its AsyncKeyboard.
+
+    The server becomes the presenter's present callback, so frames are published at the refresh rate
+    and only when they changed. All viewers share the keyboard, a key is down while any of them holds it.
+    '''
+
+    def __init__(self, session, host='localhost', port=STREAM_PORT, buffer_size=STREAM_BUFFER):
+        self.session     = session
+        self.keyboard    = session.cpu.keyboard
+        self.screen      = session.cpu.screen
+        self.host        = host
+        self.port        = port
+        self.buffer_size = buffer_size
+
+        self.viewers = set()
+        self.latest  = None # Last EncodedFrame published
+        self.server  = None
+
+        session.presenter.present = self.publish
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port   = self.server.sockets[0].getsockname()[1] # In case port 0 picked a free one
+
+    async def stop(self):
+        '''
+        Stop accepting viewers and disconnect the ones connected.
+        '''
+        self.server.close()
+
+        handlers = [viewer.handler for viewer in self.viewers]
+        for viewer in self.viewers:
+            viewer.writer.close()
+
+        # Closing the connection ends each handler's key reader
+        if handlers:
+            await asyncio.wait(handlers)
+        await self.server.wait_closed()
+
+    def publish(self, frame):
+        '''
+        Encode frame once and offer it to every viewer.
+
+        The session runs on this loop, so the screen's resolution is still the one frame was drawn at.
+        '''
+        width, height = self.screen.width, self.screen.height
+        number        = self.latest.number + 1 if self.latest is not None else 0
+
+        self.latest = EncodedFrame(number, pack_frame(frame, width), width, height, self.latest)
+
+        for viewer in self.viewers:
+            viewer.offer(self.latest)
+
+    async def serve(self, reader, writer):
+        # A small write buffer makes drain wait early, so a slow viewer drops frames instead of queueing them
+        writer.transport.set_write_buffer_limits(high=self.buffer_size)
+        writer.write(HELLO_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, self.screen.width, self.screen.height))
+
+        viewer = Viewer(reader, writer)
+        self.viewers.add(viewer)
+        if self.latest is not None:
+            viewer.offer(self.latest)
+
+        sender = asyncio.ensure_future(viewer.send_frames())
+
+        try:
+            await self.receive_keys(viewer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            sender.cancel()
+
+            # Keys still held by a viewer that left would otherwise stay down
+            while viewer.held:
+                self.set_key(viewer, lowest_key(viewer.held), False)
+
+            writer.close()
+
+    async def receive_keys(self, viewer):
+        while True:
+            value, pressed = KEY_EVENT.unpack(await viewer.reader.readexactly(KEY_EVENT.size))
+
+            if value < len(KEY_MAPPING):
+                self.set_key(viewer, value, bool(pressed))
+
+    def set_key(self, viewer, value, pressed):
+        if pressed:
+            viewer.held |= 1 << value
+            self.keyboard.press(value)
+            return
+
+        viewer.held &= ~(1 << value)
+        if not any(other.held >> value & 1 for other in self.viewers):
+            self.keyboard.release(value)
+
+class FrameClient:
+    '''
+    Viewer side of the protocol: receives frames and sends key events.
+    '''
+
+    def __init__(self, reader, writer, width, height):
+        self.reader = reader
+        self.writer = writer
+        self.width  = width
+        self.height = height
+        self.packed = bytearray((width + 7) // 8 * height)
+        self.number = None # Number of the last frame received
+
+    @classmethod
+    async def connect(cls, host='localhost', port=STREAM_PORT):
+        reader, writer = await asyncio.open_connection(host, port)
+
+        magic, version, width, height = HELLO_HEADER.unpack(await reader.readexactly(HELLO_HEADER.size))
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            writer.close()
+            raise ValueError('Not a ChipPy8 frame stream (or an unsupported version)')
+
+        return cls(reader, writer, width, height)
+
+    async def receive(self):
+        '''
+        Wait for the next frame, returns it as a list of rows like Screen.pixels.
+
+        width and height follow the resolution of the latest keyframe.
+        '''
+        kind, number, length = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+        payload = await self.reader.readexactly(length)
+
+        if kind == KEYFRAME:
+            self.width, self.height = RESOLUTION.unpack_from(payload)
+            self.packed[:]          = payload[RESOLUTION.size:]
+        else:
+            apply_delta(self.packed, payload)
+        self.number = number
+
+        return unpack_frame(self.packed, self.width)
+
+    async def send_key(self, value, pressed):
+        self.writer.write(KEY_EVENT.pack(value, int(pressed)))
+        await self.writer.drain()
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def view(host, port, render='blocks'):
+    '''
+    Show a stream in the terminal and send the host keyboard's CHIP-8 keys back.
+    '''
+    # pynput needs a display server, so it is only imported by the viewer
+    from pynput.keyboard import Listener
+
+    client = await FrameClient.connect(host, port)
+    screen = RENDERERS[render](client.width, client.height)
+    loop   = asyncio.get_running_loop()
+
+    def forward(pressed):
+        def on_key(key):
+            value = key_value(key)
+            if value != -1:
+                asyncio.run_coroutine_threadsafe(client.send_key(value, pressed), loop)
+
+        return on_key
+
+    listener = Listener(on_press=forward(True), on_release=forward(False))
+    listener.start()
+    screen.load_emulator_window()
+
+    try:
+        while True:
+            frame = await client.receive()
+
+            if (client.width, client.height) != (screen.width, screen.height):
+                screen.set_resolution(client.width, client.height)
+            screen.update(frame)
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        listener.stop()
+        await client.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='View a ChipPy8 frame stream (see chippy8.py --serve).')
+    parser.add_argument('host', nargs='?', default='localhost', help='server host (default localhost)')
+    parser.add_argument('port', nargs='?', type=int, default=STREAM_PORT, help='server port (default {})'.format(STREAM_PORT))
+    parser.add_argument('--render', choices=sorted(RENDERERS), default='blocks',
+                        help='terminal rendering: a block per pixel, half blocks or braille')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(view(args.host, args.port, args.render))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+'''
+Execution traces: a record per instruction written while running, and queries over the file afterwards.
+
+    python chippy8.py roms/pong.ch8 --headless --max-cycles 1000000 --trace pong.trace
+    python -m chippy8.trace pong.trace --first 2a4 --loops 10 --vf --dump 5000
+
+A trace file is a header (magic, version, compression, record size) followed by fixed-width records:
+the cycle, PC and operand of each instruction executed, then Vx (x from the operand, the register
+most instructions write), VF and I after it ran. Records are packed into a preallocated buffer and
+written TRACE_BUFFER bytes at a time, through zlib when compressed.
+
+Uncompressed traces are read through mmap, records are looked up by cycle with a binary search and
+scanned a buffer at a time, so a trace far larger than memory can be queried. Compressed traces are
+smaller but can only be scanned front to back.
+'''
+import argparse
+import mmap
+import struct
+import sys
+import zlib
+from collections import Counter
+
+from chippy8.cpu import format_register_dump
+from chippy8.disassembler import disassemble
+from chippy8.config import TRACE_BUFFER
+
+TRACE_MAGIC   = b'CH8T'
+TRACE_VERSION = 1
+
+TRACE_HEADER = struct.Struct('<4sBBH') # magic, version, compression, record size
+RECORD       = struct.Struct('<QHHBBH') # cycle, pc, operand, Vx, VF, I
+PC_OFFSET    = struct.calcsize('<Q')    # Of the PC field in a record
+
+UNCOMPRESSED = 0
+ZLIB         = 1
+
+# Fast over small, the trace is written while the ROM runs
+COMPRESSION_LEVEL = 1
+
+class Tracer:
+    '''
+    Records every instruction a CPU executes to a trace file.
+
+    Enabling it swaps a tracing execute_cycles onto the CPU, which steps the interpreter with the
+    record written inline after each instruction. Disabling it puts the original back, so tracing
+    costs nothing while it is off. Idle loops are run out rather than fast-forwarded and compiled
+    blocks are not used, so every instruction gets its record.
+    '''
+
+    def __init__(self, cpu, path, compress=False, buffer_size=TRACE_BUFFER):
+        self.cpu      = cpu
+        self.path     = path
+        self.compress = compress
+        self.enabled  = False
+
+        self.buffer     = bytearray(buffer_size - buffer_size % RECORD.size)
+        self.offset     = 0    # Bytes of records in buffer not written yet
+        self.records    = 0    # Records written or buffered
+        self.file       = None
+        self.compressor = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *_exception):
+        self.close()
+
+    def enable(self):
+        if self.enabled:
+            return
+
+        if self.file is None:
+            self.file = open(self.path, 'wb')
+            self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, ZLIB if self.compress else UNCOMPRESSED, RECORD.size))
+
+            if self.compress:
+                self.compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+        # The instance attribute shadows the method until it is deleted again
+        self.cpu.execute_cycles = self.execute_cycles
+        self.enabled            = True
+
+    def disable(self):
+        '''
+        Put the original execute_cycles back and write out the buffered records.
+        '''
+        if not self.enabled:
+            return
+
+        del self.cpu.execute_cycles
+        self.flush()
+
+        self.enabled = False
+
+    def close(self):
+        '''
+        Stop tracing and finish the file.
+        '''
+        self.disable()
+
+        if self.file is not None:
+            if self.compressor is not None:
+                self.file.write(self.compressor.flush())
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        data = memoryview(self.buffer)[:self.offset]
+
+        self.file.write(self.compressor.compress(data) if self.compressor is not None else data)
+        self.offset = 0
+
+    def execute_cycles(self, count):
+        '''
+        CPU.execute_cycles while tracing: execute_instruction inlined, followed by packing the record.
+        '''
+        cpu       = self.cpu
+        state     = cpu.state
+        v         = state.v
+        cache     = cpu.decode_cache
+        buffer    = self.buffer
+        size      = len(buffer)
+        pack_into = RECORD.pack_into
+        start     = cpu.cycles
+        cycle     = start
+        offset    = self.offset
+
+        try:
+            for cycle in range(start, start + count):
+                pc    = state.pc
+                entry = cache.get(pc)
+
+                if entry is None:
+                    entry = cache[pc] = cpu.fetch(pc)
+
+                operand, handler, arguments = entry
+                cpu.operand = operand
+                state.pc    = pc + 2
+
+                handler(*arguments)
+
+                pack_into(buffer, offset, cycle, pc, operand, v[(operand & 0x0F00) >> 8], v[0xF], state.i & 0xFFFF)
+                offset += RECORD.size
+
+                if offset == size:
+                    self.offset = offset
+                    self.flush()
+                    offset = 0
+            else:
+                cycle = start + count
+        finally:
+            # cycle is the first instruction not executed, one raising an exception has no record
+            self.offset   = offset
+            self.records += cycle - start
+            cpu.cycles    = cycle
+
+        return count
+
+class TraceReader:
+    '''
+    Reads a trace file written by Tracer, through mmap when it is uncompressed.
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+
+        magic, version, self.compression, record_size = TRACE_HEADER.unpack(self.file.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != RECORD.size:
+            self.file.close()
+            raise ValueError('Not a version {} ChipPy8 trace'.format(TRACE_VERSION))
+
+        self.map = None
+        if self.compression == UNCOMPRESSED:
+            size = self.file.seek(0, 2)
+
+            # An empty trace cannot be mapped, and a cut off last record is left out
+            self.count = (size - TRACE_HEADER.size) // RECORD.size
+            if self.count:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exception):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def chunks(self, first=0):
+        '''
+        Yield the records from index first on (uncompressed only) as buffers of whole records.
+        '''
+        if self.compression == UNCOMPRESSED:
+            view = memoryview(self.map) if self.map is not None else memoryview(b'')
+            end  = TRACE_HEADER.size + self.count * RECORD.size
+
+            try:
+                for offset in range(TRACE_HEADER.size + first * RECORD.size, end, TRACE_BUFFER):
+                    yield view[offset:min(offset + TRACE_BUFFER, end)]
+            finally:
+                view.release()
+            return
+
+        if first:
+            raise ValueError('Compressed traces can only be read from the start')
+
+        self.file.seek(TRACE_HEADER.size)
+        decompressor = zlib.decompressobj()
+        pending      = b''
+
+        while True:
+            compressed = self.file.read(TRACE_BUFFER)
+            data       = pending + (decompressor.decompress(compressed) if compressed else decompressor.flush())
+
+            whole   = len(data) - len(data) % RECORD.size
+            pending = data[whole:]
+            if whole:
+                yield data[:whole]
+
+            if not compressed:
+                return
+
+    def records(self, first=0):
+        '''
+        Yield (cycle, pc, operand, vx, vf, i) tuples from record index first on.
+        '''
+        for chunk in self.chunks(first):
+            yield from RECORD.iter_unpack(chunk)
+
+    def records_from(self, cycle):
+        '''
+        Yield the records from cycle on, found by binary search unless the trace is compressed.
+        '''
+        if self.compression != UNCOMPRESSED:
+            yield from (record for record in self.records() if record[0] >= cycle)
+            return
+
+        index = self.find_cycle(cycle)
+        if index is not None:
+            yield from self.records(index)
+
+    def record(self, index):
+        return RECORD.unpack_from(self.map, TRACE_HEADER.size + index * RECORD.size)
+
+    def find_cycle(self, cycle):
+        '''
+        Index of the first record at or after cycle, by binary search over the mapped file (uncompressed only).
+        '''
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.record(middle)[0] < cycle:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low if low < self.count else None
+
+def first_hit(reader, address):
+    '''
+    The first record executing the instruction at address, None if it never ran.
+
+    The PC field is searched for in each buffer rather than unpacking every record.
+    '''
+    needle = struct.pack('<H', address)
+
+    for chunk in reader.chunks():
+        data  = bytes(chunk)
+        found = data.find(needle)
+
+        while found != -1:
+            if found % RECORD.size == PC_OFFSET:
+                return RECORD.unpack_from(data, found - PC_OFFSET)
+            found = data.find(needle, found + 1)
+
+    return None
+
+def hot_loops(reader, top=10):
+    '''
+    The top most repeated loops as ((start, end), iterations), end being the address of the backward jump or skip.
+
+    A loop is counted every time execution goes back from an instruction to an earlier (or the same)
+    address other than by a return.
+    '''
+    loops    = Counter()
+    previous = None
+
+    for _cycle, pc, operand, _vx, _vf, _i in reader.records():
+        if previous is not None and pc <= previous[0] and previous[1] != 0x00EE:
+            loops[pc, previous[0]] += 1
+        previous = (pc, operand)
+
+    return loops.most_common(top)
+
+def flag_changes(reader):
+    '''
+    Yield the records where VF changed, as (record, previous VF).
+    '''
+    vf = None
+
+    for record in reader.records():
+        if vf is not None and record[4] != vf:
+            yield record, vf
+        vf = record[4]
+
+def format_record(record):
+    '''
+    A record as one line, the registers as CPU.__str__ shows them.
+    '''
+    cycle, pc, operand, vx, vf, i = record
+    dump = {'PC': pc, 'OP': operand, 'V{:X}'.format((operand & 0x0F00) >> 8): vx, 'VF': vf, 'I': i}
+
+    return '{:>10}  {:<18}  {}'.format(cycle, disassemble(operand), format_register_dump(dump, '  '))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query a ChipPy8 execution trace (see chippy8.py --trace).')
+    parser.add_argument('filepath', metavar='TRACE', type=str, help='trace file')
+    parser.add_argument('--first', metavar='ADDRESS', type=lambda text: int(text, 16), default=None,
+                        help='first time the instruction at ADDRESS (hex) ran')
+    parser.add_argument('--loops', metavar='N', type=int, default=None, help='the N most repeated loops')
+    parser.add_argument('--vf', action='store_true', help='every change of VF')
+    parser.add_argument('--dump', metavar='CYCLE', type=int, default=None, help='print the records from CYCLE on')
+    parser.add_argument('--count', metavar='N', type=int, default=20, help='records printed by --dump and --vf (default 20)')
+    args = parser.parse_args(argv)
+
+    with TraceReader(args.filepath) as reader:
+        if reader.compression == UNCOMPRESSED:
+            first, last = (reader.record(0)[0], reader.record(reader.count - 1)[0]) if reader.count else (None, None)
+            print('{} records, cycles {} - {}'.format(reader.count, first, last))
+        else:
+            print('compressed trace')
+
+        if args.first is not None:
+            record = first_hit(reader, args.first)
+            print(format_record(record) if record else '0x{:03X} never ran'.format(args.first))
+
+        if args.loops is not None:
+            for (start, end), iterations in hot_loops(reader, args.loops):
+                print('0x{:03X}-0x{:03X}  {} iterations'.format(start, end, iterations))
+
+        if args.vf:
+            for count, (record, vf) in enumerate(flag_changes(reader)):
+                if count == args.count:
+                    break
+                print('{}  (VF was {:X})'.format(format_record(record), vf))
+
+        if args.dump is not None:
+            for count, record in enumerate(reader.records_from(args.dump)):
+                if count == args.count:
+                    break
+                print(format_record(record))
+
+if __name__ == '__main__':
+    sys.exit(main())
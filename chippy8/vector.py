@@ -0,0 +1,478 @@
+try:
+    import numpy as np
+except ImportError as error:
+    raise ImportError('chippy8.vector requires NumPy, install it with pip install -r requirements-vector.txt') from error
+
+from chippy8.cpu import CPU
+from chippy8.screen import NullScreen
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.config import (
+    MAX_MEM0RY,
+    PROGRAM_COUNTER_START,
+    REGISTER_COUNT,
+    STACK_DEPTH
+)
+
+SCREEN_WIDTH  = 64
+SCREEN_HEIGHT = 32
+
+class VectorCPU:
+    '''
+    Lockstep engine stepping many independent CHIP-8 machines at once (requires numpy).
+
+    State is kept as a struct of arrays, one row per instance: memory is (N, 4096), the V registers
+    are (N, 16), the call stacks (N, 16) with SP as their depth, and PC, I, SP and the timers are vectors. The framebuffer uses the Screen layout,
+    one 64 bit word per row with the leftmost pixel as the most significant bit.
+
+    Every step fetches the operand of each active instance, groups the instances by opcode and
+    executes each group as vectorised operations. Instances whose programs diverge simply fall in
+    different groups, and share them again once their PCs re-converge. Semantics follow CPU,
+    except that Cxkk draws from a per-engine numpy generator instead of the random module.
+
+    Instances that hit an undefined instruction, address memory out of range or overflow the stack
+    are marked faulted and stop stepping, as a CPU would have raised. The framebuffer is fixed at
+    64x32, so SUPER-CHIP instructions fault as well.
+    '''
+
+    # Per-instance arrays, copied by split and join
+    STATE = (
+        'memory', 'v', 'stack', 'pixels', 'pc', 'i', 'sp', 'delay', 'sound', 'operand', 'keys', 'active', 'faulted'
+    )
+
+    def __init__(self, count, seed=None):
+        self.count = count
+
+        self.memory = np.zeros((count, MAX_MEM0RY), dtype=np.uint8)
+        self.v      = np.zeros((count, REGISTER_COUNT), dtype=np.uint8)
+        self.stack  = np.zeros((count, STACK_DEPTH), dtype=np.int64)
+        self.pixels = np.zeros((count, SCREEN_HEIGHT), dtype=np.uint64)
+
+        self.pc      = np.full(count, PROGRAM_COUNTER_START, dtype=np.int64)
+        self.i       = np.zeros(count, dtype=np.int64)
+        self.sp      = np.zeros(count, dtype=np.int64)
+        self.delay   = np.zeros(count, dtype=np.int64)
+        self.sound   = np.zeros(count, dtype=np.int64)
+        self.operand = np.zeros(count, dtype=np.int64)
+
+        # Keys held down per instance, a bitmask like Keyboard.pressed
+        self.keys = np.zeros(count, dtype=np.int64)
+
+        # Instances that step, and instances that stopped on an error
+        self.active  = np.ones(count, dtype=bool)
+        self.faulted = np.zeros(count, dtype=bool)
+
+        self.random = np.random.default_rng(seed)
+        self.cycles = 0
+
+        self.OPERATION_LOOKUP = {
+            0x0: self.opcode_0,
+            0x1: self.opcode_1,
+            0x2: self.opcode_2,
+            0x3: self.opcode_3,
+            0x4: self.opcode_4,
+            0x5: self.opcode_5,
+            0x6: self.opcode_6,
+            0x7: self.opcode_7,
+            0x8: self.opcode_8,
+            0x9: self.opcode_9,
+            0xA: self.opcode_A,
+            0xB: self.opcode_B,
+            0xC: self.opcode_C,
+            0xD: self.opcode_D,
+            0xE: self.opcode_E,
+            0xF: self.opcode_F
+        }
+
+    @classmethod
+    def from_cpu(cls, cpu, count, seed=None):
+        '''
+        Create count instances, each a copy of the state of cpu.
+        '''
+        if (cpu.screen.width, cpu.screen.height) != (SCREEN_WIDTH, SCREEN_HEIGHT):
+            raise ValueError('VectorCPU only runs {}x{} screens'.format(SCREEN_WIDTH, SCREEN_HEIGHT))
+
+        engine = cls(count, seed)
+
+        engine.memory[:]  = np.frombuffer(bytes(cpu.memory), dtype=np.uint8)
+        engine.v[:]       = np.frombuffer(bytes(cpu.state.v), dtype=np.uint8)
+        engine.stack[:]   = cpu.state.stack
+        engine.pc[:]      = cpu.state.pc
+        engine.i[:]       = cpu.state.i
+        engine.sp[:]      = cpu.state.sp
+        engine.delay[:]   = cpu.state.delay
+        engine.sound[:]   = cpu.state.sound
+        engine.operand[:] = cpu.operand
+        engine.pixels[:]  = cpu.screen.pixels
+
+        return engine
+
+    def to_cpu(self, index, screen=None, keyboard=None):
+        '''
+        Extract instance index into a regular CPU, with a null screen and scripted keyboard unless given.
+        '''
+        screen   = screen if screen is not None else NullScreen()
+        keyboard = keyboard if keyboard is not None else ScriptedKeyboard()
+        cpu      = CPU(screen, keyboard)
+
+        cpu.memory[:] = self.memory[index].tobytes()
+        cpu.invalidate()
+
+        state = cpu.state
+
+        state.v[:]     = self.v[index].tobytes()
+        state.stack[:] = [int(address) for address in self.stack[index]]
+        state.pc       = int(self.pc[index])
+        state.i        = int(self.i[index])
+        state.sp       = int(self.sp[index])
+        state.delay    = int(self.delay[index])
+        state.sound    = int(self.sound[index])
+        cpu.operand    = int(self.operand[index])
+
+        with screen.lock:
+            screen.pixels = [int(row) for row in self.pixels[index]]
+            screen.version += 1
+
+        return cpu
+
+    def split(self, indices):
+        '''
+        New engine holding copies of the given instances, e.g. to let them diverge under other inputs.
+        '''
+        indices = np.asarray(indices)
+        engine  = type(self)(len(indices))
+
+        for name in self.STATE:
+            setattr(engine, name, getattr(self, name)[indices].copy())
+        engine.random = np.random.default_rng(self.random.integers(1 << 63))
+        engine.cycles = self.cycles
+
+        return engine
+
+    @classmethod
+    def join(cls, engines):
+        '''
+        New engine holding the instances of all engines, in order.
+
+        Its generator is seeded from the generators of the parts, as split seeds from the original's,
+        so a run that splits and joins again stays reproducible.
+        '''
+        engine = cls(sum(part.count for part in engines))
+
+        for name in cls.STATE:
+            setattr(engine, name, np.concatenate([getattr(part, name) for part in engines]))
+        engine.random = np.random.default_rng([int(part.random.integers(1 << 63)) for part in engines])
+        engine.cycles = max(part.cycles for part in engines)
+
+        return engine
+
+    def load_rom(self, filename, offset=PROGRAM_COUNTER_START):
+        '''
+        Load ROM binary from file into every instance.
+        '''
+        romdata = np.frombuffer(open(filename, 'rb').read(), dtype=np.uint8)
+        self.memory[:, offset:offset + len(romdata)] = romdata
+
+    def fault(self, rows):
+        self.faulted[rows] = True
+        self.active[rows]  = False
+
+    def step(self):
+        '''
+        Execute one instruction on every active instance.
+        '''
+        rows = np.flatnonzero(self.active)
+        pc   = self.pc[rows]
+
+        out_of_range = pc + 1 >= MAX_MEM0RY
+        if out_of_range.any():
+            self.fault(rows[out_of_range])
+            rows, pc = rows[~out_of_range], pc[~out_of_range]
+
+        operand = (self.memory[rows, pc].astype(np.int64) << 8) | self.memory[rows, pc + 1]
+        self.operand[rows] = operand
+        self.pc[rows]      = pc + 2
+
+        opcodes = operand >> 12
+        for opcode in np.unique(opcodes):
+            group = opcodes == opcode
+            self.OPERATION_LOOKUP[int(opcode)](rows[group], operand[group])
+
+        self.cycles += 1
+
+    def execute_cycles(self, count):
+        for _ in range(count):
+            self.step()
+
+        return count
+
+    def decrement_timers(self):
+        rows = self.active
+        self.delay[rows] = np.maximum(self.delay[rows] - 1, 0)
+        self.sound[rows] = np.maximum(self.sound[rows] - 1, 0)
+
+    def skip_if(self, rows, condition):
+        self.pc[rows[condition]] += 2
+
+    def opcode_0(self, rows, operand):
+        '''
+        00E0 - Clear screen
+        00EE - Return from subroutine
+        0nnn - Ignored, except the SUPER-CHIP instructions 00Cn and 00FB - 00FF which fault
+        '''
+        self.fault(rows[((operand & 0xFFF0) == 0x00C0) | ((operand >= 0x00FB) & (operand <= 0x00FF))])
+
+        clear = rows[operand == 0x00E0]
+        self.pixels[clear] = 0
+
+        ret = rows[operand == 0x00EE]
+
+        underflow = self.sp[ret] == 0
+        if underflow.any():
+            self.fault(ret[underflow])
+            ret = ret[~underflow]
+
+        self.sp[ret] -= 1
+        self.pc[ret]  = self.stack[ret, self.sp[ret]]
+
+    def opcode_1(self, rows, operand):
+        '''
+        1nnn - Jump to address nnn
+        '''
+        self.pc[rows] = operand & 0x0FFF
+
+    def opcode_2(self, rows, operand):
+        '''
+        2nnn - Jump to subroutine at address nnn
+        '''
+        overflow = self.sp[rows] == STACK_DEPTH
+        if overflow.any():
+            self.fault(rows[overflow])
+            rows, operand = rows[~overflow], operand[~overflow]
+
+        sp = self.sp[rows]
+
+        self.stack[rows, sp] = self.pc[rows]
+        self.sp[rows]        = sp + 1
+        self.pc[rows]        = operand & 0x0FFF
+
+    def opcode_3(self, rows, operand):
+        '''
+        3xkk - Skip next instruction if Vx == kk
+        '''
+        self.skip_if(rows, self.v[rows, (operand & 0x0F00) >> 8] == (operand & 0x00FF))
+
+    def opcode_4(self, rows, operand):
+        '''
+        4xkk - Skip next instruction if Vx != kk
+        '''
+        self.skip_if(rows, self.v[rows, (operand & 0x0F00) >> 8] != (operand & 0x00FF))
+
+    def opcode_5(self, rows, operand):
+        '''
+        5xy0 - Skip next instruction if Vx == Vy
+        '''
+        self.skip_if(rows, self.v[rows, (operand & 0x0F00) >> 8] == self.v[rows, (operand & 0x00F0) >> 4])
+
+    def opcode_6(self, rows, operand):
+        '''
+        6xkk - Set register Vx to kk
+        '''
+        self.v[rows, (operand & 0x0F00) >> 8] = operand & 0x00FF
+
+    def opcode_7(self, rows, operand):
+        '''
+        7xkk - Add kk to register Vx
+        '''
+        x = (operand & 0x0F00) >> 8
+        self.v[rows, x] = (self.v[rows, x] + (operand & 0x00FF)) & 0xFF
+
+    def opcode_8(self, rows, operand):
+        '''
+        8xyN - Logical operations, VF is written before Vx except for 8xyE (as in CPU)
+        '''
+        x       = (operand & 0x0F00) >> 8
+        y       = (operand & 0x00F0) >> 4
+        n       = operand & 0x000F
+        value1  = self.v[rows, x].astype(np.int64)
+        value2  = self.v[rows, y].astype(np.int64)
+        v       = self.v
+
+        def apply(sub, target, flag=None, flag_last=False):
+            selected = n == sub
+            r, rx    = rows[selected], x[selected]
+            if flag is not None and not flag_last:
+                v[r, 0xF] = flag[selected]
+            v[r, rx] = target[selected] & 0xFF
+            if flag is not None and flag_last:
+                v[r, 0xF] = flag[selected]
+
+        apply(0x0, value2)
+        apply(0x1, value1 | value2)
+        apply(0x2, value1 & value2)
+        apply(0x3, value1 ^ value2)
+        apply(0x4, value1 + value2, (value1 + value2) > 0xFF)
+        apply(0x5, value1 - value2, value1 >= value2)
+        apply(0x6, value1 >> 1, value1 & 0x1)
+        apply(0x7, value2 - value1, value2 >= value1)
+        apply(0xE, value1 << 1, value1 >> 7, flag_last=True)
+
+        undefined = ~np.isin(n, (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE))
+        self.fault(rows[undefined])
+
+    def opcode_9(self, rows, operand):
+        '''
+        9xy0 - Skip next instruction if Vx != Vy
+        '''
+        self.skip_if(rows, self.v[rows, (operand & 0x0F00) >> 8] != self.v[rows, (operand & 0x00F0) >> 4])
+
+    def opcode_A(self, rows, operand):
+        '''
+        Annn - Set index register to nnn
+        '''
+        self.i[rows] = operand & 0x0FFF
+
+    def opcode_B(self, rows, operand):
+        '''
+        Bnnn - Jump to V0 + nnn
+        '''
+        self.pc[rows] += (operand & 0x0FFF) + self.v[rows, 0]
+
+    def opcode_C(self, rows, operand):
+        '''
+        Cxkk - Random byte AND kk, stored in Vx
+        '''
+        random_bytes = self.random.integers(0x00, 0x100, size=len(rows))
+        self.v[rows, (operand & 0x0F00) >> 8] = (operand & 0x00FF) & random_bytes
+
+    def opcode_D(self, rows, operand):
+        '''
+        Dxyn - Display n-byte sprite at position (Vx, Vy) starting at memory location given by index register
+
+        Dxy0 (a SUPER-CHIP 16x16 sprite) faults
+        '''
+        large = (operand & 0x000F) == 0
+        if large.any():
+            self.fault(rows[large])
+            rows, operand = rows[~large], operand[~large]
+
+        x    = self.v[rows, (operand & 0x0F00) >> 8].astype(np.int64) % SCREEN_WIDTH
+        y    = self.v[rows, (operand & 0x00F0) >> 4].astype(np.int64)
+        size = operand & 0x000F
+        i    = self.i[rows]
+
+        # Same shift or wrap-around rotation as Screen.place_sprite, for an 8 bit wide sprite
+        shift     = SCREEN_WIDTH - 8 - x
+        left      = np.clip(shift, 0, 63).astype(np.uint64)
+        right     = np.clip(-shift, 0, 63).astype(np.uint64)
+        wrap      = np.clip(SCREEN_WIDTH + shift, 0, 63).astype(np.uint64)
+        collision = np.zeros(len(rows), dtype=bool)
+
+        self.v[rows, 0xF] = 0
+
+        for offset in range(16):
+            # Sprite rows past the end of memory are dropped, like the memory slice in CPU.opcode_D
+            drawn = (size > offset) & (i + offset < MAX_MEM0RY)
+            if not drawn.any():
+                break
+
+            r      = rows[drawn]
+            sprite = self.memory[r, i[drawn] + offset].astype(np.uint64)
+            bits   = np.where(
+                shift[drawn] >= 0,
+                sprite << left[drawn],
+                (sprite >> right[drawn]) | (sprite << wrap[drawn])
+            )
+
+            row              = (y[drawn] + offset) % SCREEN_HEIGHT
+            current          = self.pixels[r, row]
+            collision[drawn] |= (current & bits) != 0
+            self.pixels[r, row] = current ^ bits
+
+        self.v[rows, 0xF] = collision
+
+    def opcode_E(self, rows, operand):
+        '''
+        Ex9E - Skip next instruction if key with value of Vx is not pressed
+        ExA1 - Skip next instruction if key with value of Vx is pressed
+        '''
+        kk      = operand & 0x00FF
+        vx      = self.v[rows, (operand & 0x0F00) >> 8]
+        pressed = (vx < 0x10) & ((self.keys[rows] >> (vx & 0xF)) & 1 == 1)
+
+        self.skip_if(rows, (kk == 0x9E) & ~pressed)
+        self.skip_if(rows, (kk == 0xA1) & pressed)
+        self.fault(rows[(kk != 0x9E) & (kk != 0xA1)])
+
+    def opcode_F(self, rows, operand):
+        '''
+        Fxkk - Utility operations, grouped again by kk
+        '''
+        x  = (operand & 0x0F00) >> 8
+        kk = operand & 0x00FF
+
+        for sub in np.unique(kk):
+            selected = kk == sub
+            r, rx    = rows[selected], x[selected]
+
+            if sub == 0x07:
+                self.v[r, rx] = self.delay[r]
+            elif sub == 0x0A:
+                # Run the instruction again until a key is down, then take the lowest one
+                keys    = self.keys[r]
+                waiting = keys == 0
+                lowest  = keys & -keys
+                self.pc[r[waiting]] -= 2
+                self.v[r[~waiting], rx[~waiting]] = np.log2(lowest[~waiting]).astype(np.uint8)
+            elif sub == 0x15:
+                self.delay[r] = self.v[r, rx]
+            elif sub == 0x18:
+                self.sound[r] = self.v[r, rx]
+            elif sub == 0x1E:
+                self.i[r] += self.v[r, rx]
+            elif sub == 0x29:
+                self.i[r] = (self.v[r, rx].astype(np.int64) & 0xF) * 5
+            elif sub == 0x33:
+                self.utility_bcd(r, rx)
+            elif sub == 0x55:
+                self.utility_registers(r, rx, store=True)
+            elif sub == 0x65:
+                self.utility_registers(r, rx, store=False)
+            else:
+                self.fault(r)
+
+    def utility_bcd(self, rows, x):
+        '''
+        Fx33 - Decode Vx into binary-coded decimal at i, i + 1 and i + 2
+        '''
+        i            = self.i[rows]
+        out_of_range = i + 2 >= MAX_MEM0RY
+        self.fault(rows[out_of_range])
+
+        rows, x, i = rows[~out_of_range], x[~out_of_range], i[~out_of_range]
+        value      = self.v[rows, x]
+
+        self.memory[rows, i    ] = value // 100
+        self.memory[rows, i + 1] = (value // 10) % 10
+        self.memory[rows, i + 2] = value % 10
+
+    def utility_registers(self, rows, x, store):
+        '''
+        Fx55 - Save V0 - Vx to index through index + x
+        Fx65 - Load V0 - Vx from index through index + x
+        '''
+        i            = self.i[rows]
+        out_of_range = i + x >= MAX_MEM0RY
+        self.fault(rows[out_of_range])
+
+        rows, x, i = rows[~out_of_range], x[~out_of_range], i[~out_of_range]
+
+        for counter in range(REGISTER_COUNT):
+            selected = x >= counter
+            if not selected.any():
+                break
+
+            r, address = rows[selected], i[selected] + counter
+            if store:
+                self.memory[r, address] = self.v[r, counter]
+            else:
+                self.v[r, counter] = self.memory[r, address]
@@ -0,0 +1,160 @@
+'''
+The block compiler: region boundaries, self-modifying code and budgets running out inside a block.
+'''
+import random
+
+import pytest
+
+from benchmarks.roms import PROGRAMS, assemble
+from chippy8.cpu import CPU
+from chippy8.screen import NullScreen
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.config import FONT_FILE, PROGRAM_COUNTER_START
+
+# A counting loop, then a jump to itself once V0 reaches 10
+COUNT = assemble(
+    0x6000,                                 # 0x200: V0 = 0
+    0x7001,                                 # 0x202: V0 += 1
+    0x300A,                                 # 0x204: skip if V0 == 10
+    0x1202,                                 # 0x206: loop
+    0x1208                                  # 0x208: halt
+)
+
+# Fx55 writes over the 6201 ahead of it in the same block
+REWRITE = assemble(
+    0x6062, 0x6163,                         # 0x200: V0 = 0x62, V1 = 0x63
+    0xA20A,                                 # 0x204: I = 0x20A
+    0xF155,                                 # 0x206: memory[0x20A:0x20C] = V0, V1
+    0x6300,                                 # 0x208: V3 = 0
+    0x6201,                                 # 0x20A: V2 = 1, becomes V2 = 0x63
+    0x120C                                  # 0x20C: halt
+)
+
+# A straight run of arithmetic long enough for any budget to run out inside it
+STRAIGHT = assemble(*[0x7001 + (register << 8) for register in range(8)] * 4, 0x8014, 0x8125, 0x8236, 0x1200)
+
+# Waits for the delay timer in an idle loop
+WAIT = assemble(
+    0x6020, 0xF015,                         # 0x200: delay = 0x20
+    0xF007,                                 # 0x204: V0 = delay
+    0x3000,                                 # 0x206: skip if V0 == 0
+    0x1204,                                 # 0x208: loop
+    0x120A                                  # 0x20A: halt
+)
+
+def create_cpu(program, compiled, seed=1):
+    chippy = CPU(NullScreen(), ScriptedKeyboard(), seed)
+    chippy.load_rom(FONT_FILE, 0)
+
+    chippy.memory[PROGRAM_COUNTER_START:PROGRAM_COUNTER_START + len(program)] = program
+    chippy.invalidate(PROGRAM_COUNTER_START, PROGRAM_COUNTER_START + len(program))
+
+    if compiled:
+        chippy.enable_compiler()
+
+    return chippy
+
+def run_both(program, budgets, seed=1):
+    '''
+    Run program interpreted and compiled with the same budgets, a frame each, and check they agree after every frame.
+    '''
+    interpreted = create_cpu(program, False, seed)
+    compiled    = create_cpu(program, True, seed)
+
+    for budget in budgets:
+        assert compiled.execute_cycles(budget) == interpreted.execute_cycles(budget)
+        assert compiled.save_state() == interpreted.save_state()
+        assert compiled.skipped_cycles == interpreted.skipped_cycles
+
+        interpreted.decrement_timers()
+        compiled.decrement_timers()
+
+    return compiled
+
+def test_loop_is_one_region():
+    chippy = run_both(COUNT, [3])
+    region = chippy.compiler.regions[0x200]
+
+    assert [block_start for block_start, _instructions in region.blocks] == [0x200, 0x206, 0x208, 0x202]
+    assert all(chippy.compiler.regions[block_start] is region for block_start in (0x202, 0x206, 0x208))
+
+    # The whole loop runs without leaving the region
+    assert region.function(100) == 0
+    assert chippy.state.v[0] == 10
+    assert chippy.state.pc == 0x208
+
+def test_blocks_end_at_jumps_and_calls():
+    chippy = run_both(REWRITE, [1])
+    region = chippy.compiler.regions[0x200]
+
+    # The Fx55 always goes on to the next instruction and stays in the block, the jump ends it
+    assert [(block_start, len(instructions)) for block_start, instructions in region.blocks] == [(0x200, 7), (0x20C, 1)]
+
+    chippy = run_both(dict(PROGRAMS)['calls'], [1])
+    region = chippy.compiler.regions[0x200]
+
+    # A 2nnn handler changes pc, so it ends the block
+    assert [(block_start, len(instructions)) for block_start, instructions in region.blocks][:2] == [(0x200, 2), (0x210, 1)]
+
+def test_single_instructions_are_interpreted():
+    chippy = run_both(assemble(0x1200), [10])
+
+    assert chippy.compiler.regions == {}
+    assert PROGRAM_COUNTER_START in chippy.compiler.interpreted
+
+def test_self_modifying_code():
+    # The Fx55 runs with the budget covering the rest of its block and with the budget running out after it
+    run_both(REWRITE, [3, 4])
+    run_both(REWRITE, [3, 2, 1, 5])
+
+    # Stop short of the Fx55, the code after it is already compiled
+    chippy = create_cpu(REWRITE, True)
+    chippy.execute_cycles(3)
+    first  = chippy.compiler.regions[0x200]
+
+    assert 'v2 = 1' in first.source
+
+    chippy.execute_cycles(4)
+
+    assert chippy.state.v[2] == 0x63
+    assert not first.valid
+
+    # The region stopped right after the Fx55, what replaced it holds the new code and the code after it is compiled as a whole again
+    second = chippy.compiler.regions[0x208]
+    assert 'v2 = 99' in second.source
+    assert [block_start for block_start, _instructions in second.blocks] == [0x208, 0x20C]
+    assert all(region.valid for region in chippy.compiler.covering[0x20C])
+
+def test_self_modifying_code_inside_running_region():
+    chippy = run_both(REWRITE, [100])
+
+    assert chippy.state.v[2] == 0x63
+    assert chippy.state.pc == 0x20C
+
+def test_write_outside_code_keeps_regions():
+    chippy = run_both(COUNT, [3])
+    region = chippy.compiler.regions[0x200]
+
+    chippy.memory[0x300] = 0xFF
+    chippy.invalidate(0x300, 0x301)
+
+    assert region.valid
+    assert chippy.compiler.regions[0x202] is region
+
+@pytest.mark.parametrize('budget', range(1, len(STRAIGHT) // 2 + 4))
+def test_budget_cut_inside_block(budget):
+    chippy = run_both(STRAIGHT, [budget] * 8)
+
+    assert chippy.cycles == budget * 8
+
+def test_idle_loop_fast_forward():
+    chippy = run_both(WAIT, [1000] * 0x22)
+
+    assert chippy.skipped_cycles > 0
+    assert chippy.state.pc == 0x20A
+
+@pytest.mark.parametrize('name, program', PROGRAMS)
+def test_programs_with_random_budgets(name, program):
+    budgets = random.Random(name).choices([1, 2, 3, 5, 7, 10, 31, 64, 100, 257], k=60)
+
+    run_both(program, budgets)
@@ -0,0 +1,89 @@
+'''
+CPU instructions and the decode cache.
+'''
+from chippy8.cpu import CPU
+from chippy8.screen import NullScreen
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.config import FONT_FILE, LARGE_FONT_START, PROGRAM_COUNTER_START
+
+def create_cpu(*words):
+    '''
+    A CPU with the font loaded and words (2 byte instructions) at PROGRAM_COUNTER_START.
+    '''
+    chippy = CPU(NullScreen(), ScriptedKeyboard())
+    chippy.load_rom(FONT_FILE, 0)
+    load(chippy, PROGRAM_COUNTER_START, *words)
+
+    return chippy
+
+def load(chippy, address, *words):
+    data = b''.join(word.to_bytes(2, 'big') for word in words)
+
+    chippy.memory[address:address + len(data)] = data
+    chippy.invalidate(address, address + len(data))
+
+def test_font_digit_addresses():
+    with open(FONT_FILE, 'rb') as font_file:
+        font = font_file.read()
+
+    for digit in range(0x10):
+        # Only the low nibble picks the digit
+        chippy = create_cpu(0x6000 | digit | 0x30, 0xF029, 0xF030)
+        chippy.execute_cycles(2)
+
+        assert chippy.state.i == digit * 5
+        assert chippy.memory[chippy.state.i:chippy.state.i + 5] == font[digit * 5:digit * 5 + 5]
+
+        chippy.execute_cycles(1)
+        assert chippy.state.i == LARGE_FONT_START + digit * 10
+
+def test_invalidate_drops_overlapping_instructions():
+    chippy = create_cpu()
+    for address in range(0x2F0, 0x320):
+        chippy.decode_cache[address] = chippy.fetch(address)
+
+    chippy.invalidate(0x300, 0x302)
+
+    # An instruction at 0x2FF ends in 0x300, jumps up to 0x304 may close an idle loop reaching into it
+    assert sorted(set(range(0x2F0, 0x320)) - chippy.decode_cache.keys()) == list(range(0x2FF, 0x306))
+
+def test_invalidate_everything():
+    chippy = create_cpu(0x6001, 0x1202)
+    chippy.execute_cycles(4)
+
+    chippy.invalidate()
+
+    assert chippy.decode_cache == {}
+
+def test_rewritten_instruction_runs_new_code():
+    chippy = create_cpu(0x6001, 0x1200)
+    chippy.execute_cycles(2)
+
+    load(chippy, PROGRAM_COUNTER_START, 0x6002)
+    chippy.execute_cycles(1)
+
+    assert chippy.state.v[0] == 2
+
+def test_write_to_second_byte_drops_instruction():
+    chippy = create_cpu(0x6001, 0x1200)
+    chippy.execute_cycles(2)
+
+    # Only the low byte of 6001 changes
+    chippy.memory[PROGRAM_COUNTER_START + 1] = 0x03
+    chippy.invalidate(PROGRAM_COUNTER_START + 1, PROGRAM_COUNTER_START + 2)
+    chippy.execute_cycles(1)
+
+    assert chippy.state.v[0] == 3
+
+def test_write_before_jump_drops_idle_loop():
+    # Fx07, 3xkk, 1nnn: the jump at 0x208 is an idle loop only while the two instructions before it are
+    chippy = create_cpu(0x6005, 0xF015, 0xF007, 0x3000, 0x1204)
+    chippy.execute_cycles(5)
+
+    assert chippy.decode_cache[0x208][1] == chippy.idle_jump
+
+    # The skip becomes 6000, the loop no longer waits on the timer
+    load(chippy, 0x206, 0x6000)
+
+    assert 0x208 not in chippy.decode_cache
+    assert chippy.fetch(0x208)[1] != chippy.idle_jump
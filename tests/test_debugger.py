@@ -0,0 +1,97 @@
+'''
+Breakpoint conditions and the stack watch.
+'''
+from chippy8.debugger import Debugger, parse_condition
+from tests.test_cpu import create_cpu
+
+# Counts in V0, calling a subroutine every iteration
+CALLS = (
+    0x6000,                                 # 0x200: V0 = 0
+    0x7001,                                 # 0x202: V0 += 1
+    0x220A,                                 # 0x204: call 0x20A
+    0x1202,                                 # 0x206: loop
+    0x0000,                                 # 0x208
+    0x6105,                                 # 0x20A: V1 = 5
+    0x00EE                                  # 0x20C: return
+)
+
+def create_debugger():
+    return Debugger(create_cpu(*CALLS), 100)
+
+def test_condition_sees_breakpoint_pc():
+    debugger = create_debugger()
+    debugger.add_breakpoint(0x204, parse_condition('pc == 0x204'))
+
+    stop = debugger.run(cycles=10)
+
+    assert stop is not None and 'Breakpoint at 0x204' in str(stop)
+    assert debugger.cpu.state.pc == 0x204
+
+def test_condition_on_next_pc_never_holds():
+    debugger = create_debugger()
+    debugger.add_breakpoint(0x204, parse_condition('pc == 0x206'))
+
+    assert debugger.run(cycles=50) is None
+
+def test_condition_on_register():
+    debugger = create_debugger()
+    debugger.add_breakpoint(0x204, parse_condition('v0 == 3'))
+
+    stop = debugger.run(cycles=100)
+
+    # Stopped before the call of the third iteration
+    assert stop is not None and '(v0 == 0x3)' in str(stop)
+    assert (debugger.cpu.state.pc, debugger.cpu.state.v[0], debugger.cpu.state.sp) == (0x204, 3, 0)
+    assert debugger.cpu.cycles == 1 + 2 * 5 + 1
+
+    # Continuing runs the call the breakpoint stopped before
+    debugger.breakpoints[0x204] = None
+    debugger.step()
+
+    assert debugger.cpu.state.pc == 0x20A
+
+def test_false_condition_runs_as_usual():
+    debugger = create_debugger()
+    debugger.add_breakpoint(0x204, parse_condition('v0 == 0xFF'))
+    debugger.run(cycles=1000)
+
+    plain = create_cpu(*CALLS)
+    plain.execute_cycles(1000)
+
+    assert debugger.cpu.save_state() == plain.save_state()
+
+def test_stack_watch_stops_after_call_and_return():
+    debugger = create_debugger()
+    debugger.watch_stack()
+
+    stop = debugger.run(cycles=100)
+
+    assert str(stop) == 'Stack: CALL 0x20A at 0x204, SP 0 -> 1, continuing at 0x20A'
+    assert debugger.cpu.cycles == 3
+
+    stop = debugger.run(cycles=100)
+
+    assert str(stop) == 'Stack: RET at 0x20C, SP 1 -> 0, continuing at 0x206'
+    assert debugger.cpu.cycles == 5
+
+    debugger.watch_stack(False)
+
+    assert debugger.run(cycles=100) is None
+
+def test_stopping_does_not_change_the_run():
+    debugger = create_debugger()
+    debugger.add_breakpoint(0x202, parse_condition('v0 < 40'))
+    debugger.watch_stack()
+
+    stops = 0
+    while debugger.cpu.cycles < 1000:
+        if debugger.run(cycles=1000 - debugger.cpu.cycles) is not None:
+            stops += 1
+
+    plain = create_cpu(*CALLS)
+    for _ in range(10):
+        plain.execute_cycles(100)
+        plain.decrement_timers()
+
+    assert stops > 100
+    assert debugger.cpu.save_state() == plain.save_state()
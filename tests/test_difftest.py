@@ -0,0 +1,70 @@
+'''
+The engines against the reference interpreter, and a planted bug to show a divergence is caught.
+'''
+import pytest
+
+from benchmarks.roms import PROGRAMS, assemble
+from chippy8 import difftest
+from chippy8.cpu import CPU
+
+# Vector runs at low resolution only
+ENGINE_PROGRAMS = [
+    (engine, name, program) for engine in sorted(difftest.ENGINES) for name, program in PROGRAMS
+    if not (engine == 'vector' and name == 'hires')
+]
+
+# 8xy4 with a carry at 0x204, then a loop
+CARRY = assemble(
+    0x60F0, 0x6120,                         # 0x200: V0 = 0xF0, V1 = 0x20
+    0x8014,                                 # 0x204: V0 += V1, VF = 1
+    0x1206                                  # 0x206: loop
+)
+
+class CarrylessCPU(CPU):
+    '''
+    A CPU with a bug planted in 8xy4: the carry is never set.
+    '''
+
+    def logic_opcode_4(self, register1, register2):
+        v = self.state.v
+
+        v[0xF]       = 0
+        v[register1] = (v[register1] + v[register2]) & 0xFF
+
+def write_rom(directory, name, program):
+    path = directory / '{}.ch8'.format(name)
+    path.write_bytes(program)
+
+    return str(path)
+
+@pytest.mark.parametrize('engine, name, program', ENGINE_PROGRAMS)
+def test_engine_matches_reference(tmp_path, engine, name, program):
+    if engine == 'vector':
+        pytest.importorskip('numpy')
+
+    result = difftest.run_rom((write_rom(tmp_path, name, program), 2000), engine)
+
+    assert result['status'] == 'match', list(difftest.describe(result))
+    assert result['cycles'] == 2000
+
+def test_planted_bug_is_found(tmp_path, monkeypatch):
+    monkeypatch.setitem(
+        difftest.ENGINES, 'carryless', lambda rom, seed, events: difftest.CPUEngine(difftest.load_cpu(CarrylessCPU, rom, seed, events))
+    )
+
+    result = difftest.run_rom((write_rom(tmp_path, 'carry', CARRY), 2000), 'carryless')
+
+    assert result['status'] == 'diverged'
+    assert result['where'] == 'instruction'
+    assert result['cycles'] == 3
+    assert result['before']['pc'] == 0x204
+    assert result['fields'] == ['v']
+    assert result['reference']['v'][0xF] == 1
+    assert result['candidate']['v'][0xF] == 0
+    assert '  instruction 0x204: 8014  ' in '\n'.join(difftest.describe(result))
+
+def test_unloadable_rom_is_an_error(tmp_path):
+    result = difftest.run_rom((str(tmp_path / 'missing.ch8'), 2000))
+
+    assert result['status'] == 'error'
+    assert result['error'].startswith('FileNotFoundError')
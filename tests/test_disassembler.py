@@ -0,0 +1,12 @@
+'''
+Mnemonics.
+'''
+from chippy8.disassembler import disassemble
+
+def test_key_skips_describe_the_emulator():
+    # Ex9E skips while the key is up, ExA1 while it is down
+    assert disassemble(0xE39E) == 'SKNP V3'
+    assert disassemble(0xE3A1) == 'SKP V3'
+
+def test_undefined_operand():
+    assert disassemble(0xF0FF) == 'DW 0xF0FF'
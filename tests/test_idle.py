@@ -0,0 +1,121 @@
+'''
+Idle loop detection and fast-forwarding.
+'''
+import pytest
+
+from chippy8.cpu import IdleLoop
+from tests.test_cpu import create_cpu
+
+# Fx07, 3xkk, 1nnn: waits until the delay timer runs out
+WAIT_ZERO = (0x6120, 0xF115, 0xF107, 0x3100, 0x1204, 0x120A)
+
+# Fx07, 3xkk, 1nnn: waits until the delay timer reaches 0x10
+WAIT_SIXTEEN = (0x6120, 0xF115, 0xF107, 0x3110, 0x1204, 0x120A)
+
+# Fx07, 4xkk, 1nnn: waits while the delay timer is 0, forever as nothing sets it
+WAIT_FOREVER = (0xF107, 0x4100, 0x1200)
+
+# Loops that look alike but must run as they are
+NOT_IDLE = [
+    (0x6120, 0xF115, 0xF107, 0x3201, 0x1204),        # Skip on another register
+    (0x6120, 0xF115, 0xE1A1, 0x3101, 0x1204),        # Reads a key instead of the timer
+    (0x6120, 0xF115, 0xF107, 0xF115, 0x3101, 0x1204) # Writes the timer back inside the loop
+]
+
+def step(chippy, count):
+    '''
+    Run count instructions one at a time, so no idle loop is ever fast-forwarded.
+    '''
+    for _ in range(count):
+        chippy.execute_instruction()
+
+    chippy.cycles += count
+
+def run_both(words, budgets):
+    '''
+    Run words fast-forwarding and stepping with the same budgets, a frame each, and check they agree after every frame.
+    '''
+    fast     = create_cpu(*words)
+    stepping = create_cpu(*words)
+
+    for budget in budgets:
+        fast.execute_cycles(budget)
+        step(stepping, budget)
+
+        assert fast.save_state() == stepping.save_state()
+
+        fast.decrement_timers()
+        stepping.decrement_timers()
+
+    return fast
+
+def test_idle_jump_is_decoded():
+    chippy = create_cpu(*WAIT_ZERO)
+    assert chippy.fetch(0x208) == (0x1204, chippy.idle_jump, (0x204, 1, 0x00, True))
+
+    chippy = create_cpu(*WAIT_FOREVER)
+    assert chippy.fetch(0x204) == (0x1200, chippy.idle_jump, (0x200, 1, 0x00, False))
+
+    # Anything else is a plain jump
+    chippy = create_cpu(*NOT_IDLE[0])
+    assert chippy.fetch(0x208)[1] != chippy.idle_jump
+
+def test_idle_loop_raises_only_inside_execute_cycles():
+    chippy = create_cpu(*WAIT_ZERO)
+    step(chippy, 5)
+
+    # Single steps run the loop as is
+    assert chippy.state.pc == 0x204
+
+    chippy.state.pc  = 0x208
+    chippy.in_cycles = True
+
+    with pytest.raises(IdleLoop):
+        chippy.execute_instruction()
+
+def test_jump_into_loop_from_outside_is_not_skipped():
+    # The jump closing the loop is first reached from 0x206, with V1 not holding the timer
+    words  = (0x6120, 0xF115, 0x6105, 0x120C, 0xF107, 0x3100, 0x1208, 0x120E)
+    chippy = create_cpu(*words)
+    chippy.execute_cycles(5)
+
+    assert chippy.skipped_cycles == 0
+    assert chippy.state.pc == 0x208
+
+    assert run_both(words, [1000] * 0x22).skipped_cycles > 0
+
+@pytest.mark.parametrize('budget', [1000, 1001, 1002, 7])
+def test_fast_forward_matches_stepping(budget):
+    chippy = run_both(WAIT_ZERO, [budget] * 0x22)
+
+    assert chippy.skipped_cycles > 0
+
+def test_loop_ends_when_timer_catches_up():
+    chippy = run_both(WAIT_ZERO, [1000] * 0x20)
+
+    # The timer ran out after the last frame, which still spun in the loop
+    assert chippy.state.delay == 0
+    assert 0x204 <= chippy.state.pc <= 0x208
+
+    chippy.execute_cycles(1000)
+
+    assert chippy.state.pc == 0x20A
+
+def test_skip_on_value_other_than_zero():
+    chippy = run_both(WAIT_SIXTEEN, [1000] * 0x12)
+
+    assert chippy.skipped_cycles > 0
+    assert chippy.state.pc == 0x20A
+    assert chippy.state.delay == 0x0E
+
+def test_wait_while_timer_holds():
+    chippy = run_both(WAIT_FOREVER, [1000] * 4)
+
+    # Every frame after the first few instructions is skipped
+    assert chippy.skipped_cycles > 3900
+
+@pytest.mark.parametrize('words', NOT_IDLE)
+def test_loops_touching_keys_or_timers_are_not_skipped(words):
+    chippy = run_both(words, [1000] * 4)
+
+    assert chippy.skipped_cycles == 0
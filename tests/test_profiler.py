@@ -0,0 +1,48 @@
+'''
+The profiler's execution counts.
+'''
+from benchmarks.roms import PROGRAMS, assemble
+from chippy8.profiler import Profiler
+from tests.test_compiler import create_cpu
+
+# Waits for the delay timer in an idle loop, then counts down from 0x10
+WAIT = assemble(
+    0x6020, 0xF015,                         # 0x200: delay = 0x20
+    0xF007,                                 # 0x204: V0 = delay
+    0x3000,                                 # 0x206: skip if V0 == 0
+    0x1204,                                 # 0x208: loop
+    0x6110,                                 # 0x20A: V1 = 0x10
+    0x71FF,                                 # 0x20C: V1 -= 1
+    0x4100,                                 # 0x20E: skip if V1 != 0
+    0x120E,                                 # 0x210: halt
+    0x120C                                  # 0x212: loop
+)
+
+def profile(program, frames, compiled=False):
+    chippy = create_cpu(program, compiled)
+
+    with Profiler(chippy) as profiler:
+        for _ in range(frames):
+            chippy.execute_cycles(1000)
+            chippy.decrement_timers()
+
+    return chippy, profiler
+
+def test_every_instruction_is_counted():
+    for name, program in PROGRAMS:
+        chippy, profiler = profile(program, 5)
+
+        assert profiler.report()['instructions'] == chippy.cycles, name
+
+def test_idle_loop_iterations_are_counted():
+    chippy, profiler = profile(WAIT, 0x22, compiled=True)
+    hot              = {pc: count for pc, count, _mnemonic in profiler.hot_pcs()}
+
+    assert chippy.skipped_cycles > 0
+    assert sum(profiler.executions.values()) == chippy.cycles
+
+    # The three loop instructions run the same number of times, but the one leaving the loop
+    assert hot[0x204] == hot[0x206] == hot[0x208] + 1
+
+    # The compiler is back once profiling stops
+    assert chippy.compiler is not None
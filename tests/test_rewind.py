@@ -0,0 +1,114 @@
+'''
+The rewind buffer: XOR/RLE deltas between snapshots, rebuilding them and evicting old history.
+'''
+import random
+
+from benchmarks.roms import PROGRAMS
+from chippy8.rewind import RUN_HEADER, RewindBuffer, apply_delta, encode_delta
+from tests.test_compiler import create_cpu
+
+def record_frames(rewind, frames):
+    '''
+    Run and record frames of the rewind buffer's CPU, returning the save state of each.
+    '''
+    chippy = rewind.cpu
+    states = []
+
+    for _ in range(frames):
+        chippy.execute_cycles(100)
+        chippy.decrement_timers()
+        rewind.record()
+        states.append(chippy.save_state())
+
+    return states
+
+def entry_size(rewind):
+    return sum(len(data) for _, data in rewind.entries)
+
+def test_delta_round_trip():
+    rng = random.Random(3)
+
+    for _ in range(50):
+        previous = bytes(rng.randrange(0x100) for _ in range(300))
+        state    = bytearray(previous)
+        for _ in range(rng.randint(0, 20)):
+            state[rng.randrange(300)] = rng.randrange(0x100)
+
+        delta = encode_delta(previous, bytes(state))
+
+        rebuilt = bytearray(previous)
+        apply_delta(rebuilt, delta)
+        assert rebuilt == state
+
+        # XOR undoes itself
+        apply_delta(rebuilt, delta)
+        assert rebuilt == previous
+
+def test_delta_runs():
+    previous = bytes(100)
+
+    assert encode_delta(previous, previous) == b''
+
+    # Up to 3 unchanged bytes are bridged, 4 start a new run
+    bridged   = encode_delta(previous, bytes([1, 0, 0, 0, 1]) + bytes(95))
+    separated = encode_delta(previous, bytes([1, 0, 0, 0, 0, 1]) + bytes(94))
+
+    assert bridged == RUN_HEADER.pack(0, 5) + bytes([1, 0, 0, 0, 1])
+    assert separated == RUN_HEADER.pack(0, 1) + b'\x01' + RUN_HEADER.pack(5, 1) + b'\x01'
+
+def test_every_snapshot_is_rebuilt():
+    rewind = RewindBuffer(create_cpu(dict(PROGRAMS)['bounce'], False), keyframe_interval=10)
+    states = record_frames(rewind, 35)
+
+    assert [index for index, (keyframe, _data) in enumerate(rewind.entries) if keyframe] == [0, 10, 20, 30]
+    assert all(rewind.state_at(index) == state for index, state in enumerate(states))
+    assert rewind.size == entry_size(rewind)
+
+    # Deltas are a small part of a full snapshot
+    assert max(len(data) for keyframe, data in rewind.entries if not keyframe) < len(states[0]) // 10
+
+def test_step_back_restores_and_continues():
+    rewind = RewindBuffer(create_cpu(dict(PROGRAMS)['score'], False), keyframe_interval=8)
+    states = record_frames(rewind, 20)
+
+    assert rewind.step_back(5) == 5
+    assert rewind.cpu.save_state() == states[14]
+    assert len(rewind) == 15
+
+    # Recording from the restored state picks up where the history now ends
+    states = states[:15] + record_frames(rewind, 10)
+
+    assert all(rewind.state_at(index) == state for index, state in enumerate(states))
+    assert rewind.size == entry_size(rewind)
+
+def test_step_back_past_history():
+    rewind = RewindBuffer(create_cpu(dict(PROGRAMS)['score'], False))
+    states = record_frames(rewind, 3)
+
+    assert rewind.step_back(10) == 2
+    assert rewind.cpu.save_state() == states[0]
+    assert rewind.step_back(1) == 0
+
+def test_capacity_evicts_oldest_keyframe_groups():
+    chippy    = create_cpu(dict(PROGRAMS)['bounce'], False)
+    full_size = len(chippy.save_state())
+    rewind    = RewindBuffer(chippy, max_bytes=full_size * 3, keyframe_interval=5)
+    states    = record_frames(rewind, 40)
+
+    assert rewind.size <= rewind.max_bytes
+    assert rewind.size == entry_size(rewind)
+
+    # Whole groups go, so the history still starts with a keyframe and ends at the latest frame
+    assert rewind.entries[0][0]
+    assert len(rewind) % 5 == 0 and len(rewind) < 40
+
+    kept = states[-len(rewind):]
+    assert all(rewind.state_at(index) == state for index, state in enumerate(kept))
+
+def test_newest_group_is_kept_over_capacity():
+    rewind = RewindBuffer(create_cpu(dict(PROGRAMS)['bounce'], False), max_bytes=1, keyframe_interval=5)
+    states = record_frames(rewind, 7)
+
+    # Frames 5 and 6 are the newest group, larger than max_bytes but never dropped
+    assert len(rewind) == 2
+    assert rewind.state_at(1) == states[-1]
@@ -0,0 +1,177 @@
+'''
+Frame pacing and turbo for Scheduler and AsyncScheduler, on a fake clock.
+'''
+import asyncio
+
+import pytest
+
+import chippy8.aio
+import chippy8.scheduler
+from chippy8.aio import AsyncScheduler
+from chippy8.keyboard import ScriptedKeyboard
+from chippy8.scheduler import Scheduler
+from tests.test_cpu import create_cpu
+
+INTERVAL = 1.0 / 60
+
+# Counts in V0 forever
+COUNT = (0x7001, 0x1200)
+
+# Waits for a key, forever as none comes
+WAIT_KEY = (0xF00A, 0x1200)
+
+class FakeClock:
+    '''
+    Stands in for the monotonic clock, time only passes when something sleeps or spends it.
+    '''
+
+    def __init__(self):
+        self.now    = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+        await ASYNC_SLEEP(0)
+
+    def spend(self, chippy, costs):
+        '''
+        Make each execute_cycles call of chippy take the next of costs seconds (the last one from then on).
+        '''
+        execute_cycles = chippy.execute_cycles
+        costs          = list(costs)
+
+        def spent(count):
+            self.now += costs.pop(0) if len(costs) > 1 else costs[0]
+            return execute_cycles(count)
+
+        chippy.execute_cycles = spent
+
+class RealtimeKeyboard(ScriptedKeyboard):
+    '''
+    A keyboard without keys that reports waits for one, as a host keyboard would block in them.
+    '''
+
+    realtime = True
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.waits = []
+
+    def wait_for_key(self, timeout):
+        self.waits.append(timeout)
+        self.clock.now += timeout
+
+        return False
+
+ASYNC_SLEEP = asyncio.sleep
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+
+    monkeypatch.setattr(chippy8.scheduler, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(chippy8.scheduler, 'sleep', clock.sleep)
+    monkeypatch.setattr(chippy8.aio, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(chippy8.aio.asyncio, 'sleep', clock.async_sleep)
+
+    return clock
+
+def test_frames_are_paced_at_the_frame_rate(clock):
+    chippy = create_cpu(*COUNT)
+    clock.spend(chippy, [INTERVAL / 4])
+
+    Scheduler(chippy, 100).run(1000)
+
+    # Each frame waits out what its instructions left of the interval
+    assert clock.sleeps == pytest.approx([INTERVAL * 3 / 4] * 10)
+    assert clock.now == pytest.approx(INTERVAL * 10)
+    assert chippy.cycles == 1000
+
+def test_late_frame_resets_the_schedule(clock):
+    chippy = create_cpu(*COUNT)
+    clock.spend(chippy, [INTERVAL / 4, INTERVAL * 3, INTERVAL / 4])
+
+    Scheduler(chippy, 100).run(500)
+
+    # No sleep after the late frame, and the 3 frames after it are paced from then instead of bursting to catch up
+    assert clock.sleeps == pytest.approx([INTERVAL * 3 / 4] * 4)
+    assert clock.now == pytest.approx(INTERVAL * 7)
+
+def test_slightly_late_frame_is_made_up(clock):
+    chippy = create_cpu(*COUNT)
+    clock.spend(chippy, [INTERVAL / 2, INTERVAL * 1.5, INTERVAL / 2])
+
+    Scheduler(chippy, 100).run(400)
+
+    # Less than a frame behind, the next frame starts straight away and the one after catches up
+    assert clock.sleeps == pytest.approx([INTERVAL / 2, INTERVAL / 2])
+    assert clock.now == pytest.approx(INTERVAL * 4)
+
+def test_turbo_never_sleeps(clock):
+    chippy = create_cpu(0x6040, 0xF015, 0x7001, 0x1204)
+    clock.spend(chippy, [INTERVAL / 10])
+
+    scheduler = Scheduler(chippy, 100, turbo=True)
+    scheduler.run(3000)
+
+    assert clock.sleeps == []
+    assert scheduler.frames == 30
+
+    # The timers still follow emulated frames, set in the first and ticked at the end of each
+    assert chippy.state.delay == 0x40 - 30
+
+def test_last_frame_is_cut_at_max_cycles(clock):
+    chippy    = create_cpu(*COUNT)
+    scheduler = Scheduler(chippy, 100, turbo=True)
+    scheduler.run(250)
+
+    assert chippy.cycles == 250
+    assert scheduler.frames == 3
+
+def test_waiting_for_key_blocks_instead_of_spinning(clock):
+    chippy          = create_cpu(*WAIT_KEY)
+    chippy.keyboard = RealtimeKeyboard(clock)
+
+    scheduler = Scheduler(chippy, 100, turbo=True)
+    scheduler.run(5)
+
+    # Even in turbo mode, a frame waiting on Fx0A waits on the keyboard for a frame
+    assert chippy.waiting_for_key
+    assert chippy.keyboard.waits == pytest.approx([INTERVAL] * scheduler.frames)
+    assert clock.sleeps == []
+
+def test_async_frames_are_paced_at_the_frame_rate(clock):
+    chippy = create_cpu(*COUNT)
+    clock.spend(chippy, [INTERVAL / 4])
+
+    asyncio.run(AsyncScheduler(chippy, 100).run(1000))
+
+    assert clock.sleeps == pytest.approx([INTERVAL * 3 / 4] * 10)
+    assert chippy.cycles == 1000
+
+def test_async_turbo_yields_between_frames(clock):
+    first  = create_cpu(*COUNT)
+    second = create_cpu(*COUNT)
+    frames = []
+
+    class Recorded(AsyncScheduler):
+        def run_frame(self, budget=None):
+            frames.append(self.cpu)
+            super().run_frame(budget)
+
+    async def run_both():
+        await asyncio.gather(Recorded(first, 100, turbo=True).run(300), Recorded(second, 100, turbo=True).run(300))
+
+    asyncio.run(run_both())
+
+    # Turbo frames still end in a zero second sleep, so the two schedulers take turns
+    assert clock.sleeps == [0] * 6
+    assert frames == [first, second] * 3
@@ -0,0 +1,203 @@
+'''
+The packed pixel buffer and the renderers diffing it against what was last drawn.
+'''
+import random
+import re
+
+import pytest
+
+from chippy8.screen import BRAILLE_DOTS, BrailleScreen, HalfBlockScreen, PackedScreen, Screen
+from tests.test_cpu import create_cpu
+
+# Cursor moves and color codes
+ESCAPE = re.compile('\033\\[[0-9;]*[A-Za-z]')
+
+def render(screen, capsys, frame=None):
+    '''
+    What screen.update writes to the terminal, split into (cursor moves, text without escape sequences).
+    '''
+    capsys.readouterr()
+    screen.update(frame)
+    output = capsys.readouterr().out
+
+    return re.findall('\033\\[([0-9]+);([0-9]+)H', output), ESCAPE.sub('', output)
+
+def test_packed_screen_draws_a_pixel_per_cell(capsys):
+    screen = PackedScreen(8, 2)
+    screen.place_sprite(bytes([0b10100000]), 0, 0)
+
+    moves, text = render(screen, capsys)
+    assert text == '█' * 16
+
+    # Only the pixel turned off is drawn again
+    screen.place_sprite(bytes([0b10000000]), 2, 0)
+
+    moves, text = render(screen, capsys)
+    assert moves[0] == ('2', '5')
+    assert text == '█'
+
+def lit(screen):
+    '''
+    The (x, y) pixels switched on, read one at a time.
+    '''
+    return {(x, y) for y in range(screen.height) for x in range(screen.width) if screen.get_pixel(x, y)}
+
+def test_sprite_wraps_around_the_edges():
+    screen = Screen()
+    screen.place_sprite(bytes([0xFF, 0x81]), 60, 31)
+
+    assert lit(screen) == {(x % 64, 31) for x in range(60, 68)} | {(60, 0), (3, 0)}
+
+def test_position_wraps_before_drawing():
+    screen = Screen()
+    screen.place_sprite(bytes([0x80]), 64 + 5, 32 + 7)
+
+    assert lit(screen) == {(5, 7)}
+
+def test_large_sprite_wraps_around_the_edges():
+    screen = Screen(128, 64)
+    screen.place_sprite([0x8001] * 2, 120, 63, 16)
+
+    assert lit(screen) == {(120, 63), (7, 63), (120, 0), (7, 0)}
+
+def test_collision():
+    screen = Screen()
+
+    assert screen.place_sprite(bytes([0xF0]), 0, 0) == 0
+    assert screen.place_sprite(bytes([0x0F]), 0, 0) == 0
+
+    # Only switching a lit pixel off collides, here in the part wrapped around to the left edge
+    assert screen.place_sprite(bytes([0x80]), 63, 0) == 0
+    assert screen.place_sprite(bytes([0x40]), 63, 0) == 1
+    assert lit(screen) == {(x, 0) for x in range(1, 8)} | {(63, 0)}
+
+def test_drawing_twice_erases():
+    screen = Screen()
+    screen.place_sprite(bytes([0xA5, 0x5A]), 10, 20)
+
+    assert screen.place_sprite(bytes([0xA5, 0x5A]), 10, 20) == 1
+    assert lit(screen) == set()
+
+def test_matches_pixel_by_pixel_drawing():
+    rng    = random.Random(5)
+    screen = Screen()
+    pixels = set()
+
+    for _ in range(200):
+        sprite    = bytes(rng.randrange(0x100) for _ in range(rng.randint(1, 15)))
+        x, y      = rng.randrange(0x100), rng.randrange(0x100)
+        collision = 0
+
+        for y_offset, sprite_row in enumerate(sprite):
+            for x_offset in range(8):
+                if sprite_row >> (7 - x_offset) & 1:
+                    pixel      = ((x + x_offset) % 64, (y + y_offset) % 32)
+                    collision |= pixel in pixels
+                    pixels    ^= {pixel}
+
+        assert screen.place_sprite(sprite, x, y) == collision
+
+    assert lit(screen) == pixels
+
+def test_resolution_switch_blanks_the_screen():
+    screen = Screen()
+    screen.place_sprite(bytes([0xFF]), 0, 0)
+
+    screen.set_resolution(128, 64)
+
+    assert lit(screen) == set()
+    assert screen.columns == 256
+    assert screen.place_sprite(bytes([0xFF]), 124, 0) == 0
+    assert lit(screen) == {(x % 128, 0) for x in range(124, 132)}
+
+    screen.set_resolution(64, 32)
+
+    assert screen.pixels == [0] * 32
+
+def test_hires_instructions():
+    chippy = create_cpu(0x00FF, 0xA000, 0xD010, 0x00FE)
+    chippy.execute_cycles(3)
+
+    # The 16x16 sprite drawn from address 0
+    assert chippy.screen.width == 128
+    assert lit(chippy.screen) == {
+        (x, y) for y in range(16) for x in range(16) if chippy.memory[y * 2 + x // 8] >> (7 - x % 8) & 1
+    }
+
+    chippy.execute_cycles(1)
+    assert (chippy.screen.width, chippy.screen.height) == (64, 32)
+    assert lit(chippy.screen) == set()
+
+def test_only_changed_runs_are_redrawn(capsys):
+    screen = Screen()
+    render(screen, capsys)
+
+    moves, text = render(screen, capsys)
+    assert (moves, text) == ([], '')
+
+    # Pixels 2 apart are redrawn as one run, further apart as two
+    screen.place_sprite(bytes([0b10010000]), 8, 3)
+    screen.place_sprite(bytes([0b10000000]), 20, 3)
+
+    moves, text = render(screen, capsys)
+    assert moves[:-1] == [('5', str(8 * 2 + 3)), ('5', str(20 * 2 + 3))]
+    assert text == '██' * 5
+
+def test_resolution_switch_redraws_everything(capsys):
+    screen = Screen()
+    render(screen, capsys)
+    before = screen.snapshot()
+
+    screen.set_resolution(128, 64)
+
+    # A frame taken at the old resolution is dropped
+    assert render(screen, capsys, before) == ([], '')
+
+    capsys.readouterr()
+    screen.update()
+    output = capsys.readouterr().out
+
+    assert output.startswith('\033[2J')
+    assert ESCAPE.sub('', output) == '██' * 128 * 64
+
+def braille_pixels(screen, text):
+    '''
+    The (x, y) pixels lit in a full BrailleScreen redraw.
+    '''
+    lines  = [text[offset:offset + screen.cells] for offset in range(0, len(text), screen.cells)]
+    pixels = set()
+
+    for line, cells in enumerate(lines):
+        for cell, character in enumerate(cells):
+            dots = ord(character) - 0x2800
+            for row, (left, right) in enumerate(BRAILLE_DOTS):
+                for column, dot in enumerate((left, right)):
+                    if dots & dot:
+                        pixels.add((cell * 2 + column, line * 4 + row))
+
+    return pixels
+
+@pytest.mark.parametrize('size', [(64, 32), (128, 64)])
+def test_braille_packs_the_frame(capsys, size):
+    screen = BrailleScreen(*size)
+    rng    = random.Random(8)
+
+    for _ in range(40):
+        screen.place_sprite(bytes(rng.randrange(0x100) for _ in range(5)), rng.randrange(0x100), rng.randrange(0x100))
+
+    _moves, text = render(screen, capsys)
+
+    assert braille_pixels(screen, text) == lit(screen)
+
+def test_half_blocks_redraw_changed_cells(capsys):
+    screen = HalfBlockScreen()
+    render(screen, capsys)
+
+    # A pixel on row 5 is the lower half of line 2
+    screen.place_sprite(bytes([0x80]), 10, 5)
+
+    moves, text = render(screen, capsys)
+    assert moves[:-1] == [('4', '13')]
+
+    # An upper half in the off color over a lit background
+    assert text == '▀'
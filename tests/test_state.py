@@ -0,0 +1,56 @@
+'''
+Save states: saving, loading and resuming, from Python and from the command line.
+'''
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.roms import PROGRAMS
+from chippy8.headless import create_headless, run_headless
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chippy8.py')
+
+def write_rom(directory, name, program):
+    path = directory / '{}.ch8'.format(name)
+    path.write_bytes(program)
+
+    return str(path)
+
+@pytest.mark.parametrize('name, program', PROGRAMS)
+def test_resume_matches_uninterrupted_run(tmp_path, name, program):
+    rom = write_rom(tmp_path, name, program)
+
+    uninterrupted = create_headless(rom, seed=1)
+    run_headless(uninterrupted, 10000)
+
+    saved = create_headless(rom, seed=1)
+    run_headless(saved, 5000)
+
+    resumed = create_headless(rom, seed=1)
+    resumed.load_state(saved.save_state())
+
+    assert resumed.save_state() == saved.save_state()
+
+    run_headless(resumed, 10000)
+
+    assert resumed.cycles == 10000
+    assert resumed.save_state() == uninterrupted.save_state()
+
+def test_max_cycles_counts_from_loaded_state(tmp_path):
+    rom   = write_rom(tmp_path, 'bounce', dict(PROGRAMS)['bounce'])
+    first = str(tmp_path / 'first.state')
+    last  = str(tmp_path / 'last.state')
+
+    def run(*arguments):
+        subprocess.run([sys.executable, MAIN, rom, '--headless', '--seed', '1'] + list(arguments), check=True)
+
+    run('--max-cycles', '5000', '--save-state', first)
+    run('--load-state', first, '--max-cycles', '5000', '--save-state', last)
+
+    uninterrupted = create_headless(rom, seed=1)
+    run_headless(uninterrupted, 10000)
+
+    with open(last, 'rb') as state:
+        assert state.read() == uninterrupted.save_state()
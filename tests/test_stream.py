@@ -0,0 +1,61 @@
+'''
+A FrameServer and a FrameClient talking over loopback.
+'''
+import asyncio
+
+from benchmarks.roms import DRAW
+from chippy8.aio import create_session
+from chippy8.stream import FrameClient, FrameServer
+
+# Seconds to wait for anything sent over loopback
+TIMEOUT = 5
+
+async def wait_until(condition):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), TIMEOUT)
+
+async def loopback(rom):
+    session = create_session(rom)
+    screen  = session.cpu.screen
+    server  = FrameServer(session, port=0)
+
+    await server.start()
+    try:
+        client = await FrameClient.connect('localhost', server.port)
+        assert (client.width, client.height) == (screen.width, screen.height)
+
+        # The first frame goes out as a keyframe, the next as a delta against it
+        for _ in range(2):
+            session.cpu.execute_cycles(50)
+            server.publish(screen.snapshot())
+
+            assert await asyncio.wait_for(client.receive(), TIMEOUT) == screen.pixels
+            assert bytes(client.packed) == screen.to_bytes()
+        assert server.latest.delta is not None
+
+        keyboard = session.cpu.keyboard
+
+        await client.send_key(0xA, True)
+        await wait_until(lambda: keyboard.host_pressed == 1 << 0xA)
+
+        await client.send_key(0xA, False)
+        await wait_until(lambda: keyboard.host_pressed == 0)
+
+        # Keys held by a viewer are released when it disconnects
+        await client.send_key(0x3, True)
+        await wait_until(lambda: keyboard.host_pressed == 1 << 0x3)
+
+        await client.close()
+        await wait_until(lambda: not server.viewers)
+        assert keyboard.host_pressed == 0
+    finally:
+        await server.stop()
+
+def test_loopback(tmp_path):
+    rom = tmp_path / 'draw.ch8'
+    rom.write_bytes(DRAW)
+
+    asyncio.run(loopback(str(rom)))
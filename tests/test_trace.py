@@ -0,0 +1,44 @@
+'''
+Traces left behind by a ROM that crashes, on the headless and the interactive path of chippy8.py.
+'''
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.roms import assemble
+from chippy8.trace import TraceReader
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chippy8.py')
+
+# Three instructions, then 8xy8, which is undefined
+CRASH = assemble(0x6005, 0x7001, 0x7001, 0x8008)
+
+# The interactive path without a terminal or host keyboard: frames are served on a free port
+PATHS = {
+    'headless':    ['--headless'],
+    'interactive': ['--serve', '0']
+}
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('path', sorted(PATHS))
+def test_trace_survives_a_crash(tmp_path, path, compress):
+    rom   = tmp_path / 'crash.ch8'
+    trace = str(tmp_path / 'crash.trace')
+    rom.write_bytes(CRASH)
+
+    arguments = [sys.executable, MAIN, str(rom), '--trace', trace] + PATHS[path]
+    if compress:
+        arguments.append('--trace-compress')
+
+    result = subprocess.run(arguments, capture_output=True, text=True, timeout=60)
+
+    assert result.returncode != 0
+    assert 'KeyError' in result.stderr
+
+    # Every instruction up to the crash is in the file, compressed ones included, so it was flushed and closed
+    with TraceReader(trace) as reader:
+        assert [(cycle, pc, vx) for cycle, pc, _operand, vx, _vf, _i in reader.records()] == [
+            (0, 0x200, 5), (1, 0x202, 6), (2, 0x204, 7)
+        ]